@@ -8,15 +8,18 @@ from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import os
 
-from shared.database import get_db, init_db
-from shared.models import User, UserStatus, Document
+from shared.database import get_db, init_db, get_pool_metrics
+from shared.models import User, UserRole, UserStatus, Document
 from shared.schemas import (
     UserCreate, UserResponse, UserLogin, Token, UserUpdate,
     SuccessResponse, ErrorResponse
 )
 from shared.auth import (
-    get_password_hash, verify_password, create_access_token,
-    create_refresh_token, get_current_user, require_verification
+    create_access_token, create_refresh_token, get_current_db_user,
+    get_current_user_readonly, require_verification
+)
+from shared.password_hashing import (
+    hash_password, verify_password, verify_and_update_password, password_pool
 )
 from shared.notifications import (
     send_verification_email, send_welcome_notification
@@ -67,7 +70,7 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
             )
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     
     # Generate email verification token
     import secrets
@@ -142,7 +145,14 @@ async def login_user(login_data: UserLogin, db: Session = Depends(get_db)):
     """Authenticate user and return tokens"""
     # Find user by email
     user = db.query(User).filter(User.email == login_data.email).first()
-    if not user or not verify_password(login_data.password, user.hashed_password):
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password"
+        )
+    
+    password_valid, new_hash = await verify_and_update_password(login_data.password, user.hashed_password)
+    if not password_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
@@ -165,8 +175,10 @@ async def login_user(login_data: UserLogin, db: Session = Depends(get_db)):
         # Verify 2FA code
         pass
     
-    # Update last login
+    # Update last login (and rehash if the stored hash uses an outdated cost)
     user.last_login = datetime.utcnow()
+    if new_hash:
+        user.hashed_password = new_hash
     db.commit()
     
     # Create tokens
@@ -243,7 +255,7 @@ async def refresh_token(
 
 
 @app.get("/me", response_model=UserResponse)
-async def get_current_user_profile(current_user: User = Depends(get_current_user)):
+async def get_current_user_profile(current_user: User = Depends(get_current_user_readonly)):
     """Get current user profile"""
     return current_user
 
@@ -251,7 +263,7 @@ async def get_current_user_profile(current_user: User = Depends(get_current_user
 @app.put("/me", response_model=UserResponse)
 async def update_user_profile(
     user_update: UserUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: Session = Depends(get_db)
 ):
     """Update current user profile"""
@@ -361,19 +373,19 @@ async def reset_password(
 async def change_password(
     current_password: str,
     new_password: str,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: Session = Depends(get_db)
 ):
     """Change user password"""
     # Verify current password
-    if not verify_password(current_password, current_user.hashed_password):
+    if not await verify_password(current_password, current_user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
     
     # Update password
-    current_user.hashed_password = get_password_hash(new_password)
+    current_user.hashed_password = await hash_password(new_password)
     current_user.updated_at = datetime.utcnow()
     db.commit()
     
@@ -386,7 +398,12 @@ async def change_password(
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "auth-service"}
+    return {
+        "status": "healthy",
+        "service": "auth-service",
+        "db_pool": get_pool_metrics(),
+        "password_pool": password_pool.stats()
+    }
 
 
 if __name__ == "__main__":
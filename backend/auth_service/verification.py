@@ -11,7 +11,7 @@ from pydantic import BaseModel
 from shared.database import get_db
 from shared.models import User, UserStatus, Document
 from shared.schemas import SuccessResponse
-from shared.auth import get_current_user
+from shared.auth import get_current_user, get_current_db_user, get_current_user_readonly
 from shared.notifications import (
     send_phone_verification_code,
     send_verification_status_update,
@@ -23,7 +23,7 @@ router = APIRouter(prefix="/verification", tags=["verification"])
 
 @router.post("/send-phone-code", response_model=SuccessResponse)
 async def send_phone_verification(
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: Session = Depends(get_db)
 ):
     """Send phone verification code via SMS"""
@@ -53,7 +53,7 @@ class PhoneVerificationRequest(BaseModel):
 @router.post("/verify-phone")
 async def verify_phone_code(
     request: PhoneVerificationRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: Session = Depends(get_db)
 ):
     """Verify phone with code"""
@@ -95,7 +95,7 @@ async def verify_phone_code(
 
 @router.get("/status")
 async def get_verification_status(
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_readonly)
 ):
     """Get current verification status"""
     return {
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark: custody balances from a full ledger scan vs snapshot plus delta, and the
+streaming integrity check
+
+Fills a ledger with balanced hold/payment/fee/release journals, folds them into the
+balance snapshots, appends a tail of new journals and then compares reading the balances
+with a GROUP BY over every entry against get_balances() (snapshots plus the tail). Finally
+runs verify_ledger() over the whole ledger and reports its throughput and memory growth.
+
+Usage (from the backend directory):
+    python benchmarks/bench_ledger.py --transactions 500000 --tail 1000
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_ledger.db")
+
+from sqlalchemy import func, insert, select
+
+from shared.database import AsyncSessionLocal, dispose_async_engines, engine, init_db
+import shared.models  # noqa: F401 (users table, referenced by the ESCROW tables)
+from escrow_service.ledger import (
+    BUYER_AUTHORIZATIONS, ESCROW_CUSTODY, FEE, FEE_REVENUE, HOLD, PAYMENT, PROCESSOR_BALANCE,
+    RELEASE, SELLER_PAYABLE, get_balances, take_snapshot, verify_ledger
+)
+from escrow_service.models import LedgerEntry, LedgerJournal
+
+CURRENCIES = ["MXN", "USD", "EUR"]
+
+
+def transaction_journals(number: int):
+    """The four journals of a released transaction (4 x 2 entries)"""
+    currency = CURRENCIES[number % len(CURRENCIES)]
+    total = Decimal(1000 + number % 9000)
+    fee = (total * Decimal("0.025")).quantize(Decimal("0.01"))
+    return currency, [
+        (HOLD, [(BUYER_AUTHORIZATIONS, total), (ESCROW_CUSTODY, -total)]),
+        (PAYMENT, [(PROCESSOR_BALANCE, total), (BUYER_AUTHORIZATIONS, -total)]),
+        (FEE, [(ESCROW_CUSTODY, fee), (FEE_REVENUE, -fee)]),
+        (RELEASE, [(ESCROW_CUSTODY, total - fee), (SELLER_PAYABLE, fee - total)]),
+    ]
+
+
+def fill(first: int, count: int, batch_size: int = 20000):
+    """Bulk insert the journals of count transactions (ids assigned here to skip RETURNING)"""
+    with engine.begin() as conn:
+        next_journal_id = (conn.execute(select(func.max(LedgerJournal.id))).scalar() or 0) + 1
+        journals, entries = [], []
+        for number in range(first, first + count):
+            currency, postings = transaction_journals(number)
+            for kind, lines in postings:
+                journals.append({
+                    "id": next_journal_id, "reference": f"{kind}:bench_{number}", "kind": kind,
+                    "currency": currency, "payment_intent_id": f"bench_{number}"
+                })
+                entries.extend(
+                    {"journal_id": next_journal_id, "account": account, "currency": currency, "amount": amount}
+                    for account, amount in lines
+                )
+                next_journal_id += 1
+            if len(entries) >= batch_size:
+                conn.execute(insert(LedgerJournal), journals)
+                conn.execute(insert(LedgerEntry), entries)
+                journals, entries = [], []
+        if journals:
+            conn.execute(insert(LedgerJournal), journals)
+            conn.execute(insert(LedgerEntry), entries)
+
+
+async def main_async(args):
+    start = time.perf_counter()
+    fill(0, args.transactions)
+    print(f"filled {args.transactions * 8} entries in {time.perf_counter() - start:.1f} s")
+
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        folded = await take_snapshot(db)
+        print(f"first snapshot: {folded} entries folded in {time.perf_counter() - start:.2f} s")
+    fill(args.transactions, args.tail // 8)
+
+    async with AsyncSessionLocal() as db:
+        async def full_scan():
+            return (await db.execute(
+                select(LedgerEntry.account, LedgerEntry.currency, func.sum(LedgerEntry.amount))
+                .group_by(LedgerEntry.account, LedgerEntry.currency)
+            )).all()
+
+        scan_seconds = 0.0
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            await full_scan()
+            scan_seconds += time.perf_counter() - started_at
+        snapshot_seconds = 0.0
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            balances = await get_balances(db)
+            snapshot_seconds += time.perf_counter() - started_at
+        scan_seconds /= args.repeat
+        snapshot_seconds /= args.repeat
+        custody = {balance["currency"]: str(balance["balance"]) for balance in balances if balance["account"] == ESCROW_CUSTODY}
+        print(f"balances, full scan          {scan_seconds * 1000:10.2f} ms")
+        print(f"balances, snapshot + delta   {snapshot_seconds * 1000:10.2f} ms  ({args.tail // 8 * 8} entries since the snapshot)")
+        print(f"speedup: {scan_seconds / snapshot_seconds:.0f}x   custody: {custody}")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report = await verify_ledger(db, args.batch_size)
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        print(
+            f"verify: balanced={report['balanced']} {report['entries']} entries, {report['journals']} journals "
+            f"in {report['duration_seconds']:.1f} s ({report['entries_per_second']:.0f} entries/s), "
+            f"peak RSS growth {rss_growth / 1024:.1f} MiB"
+        )
+    await dispose_async_engines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--transactions", type=int, default=250000, help="Released transactions (8 entries each)")
+    parser.add_argument("--tail", type=int, default=1000, help="Entries written after the snapshot")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Entries per round trip when verifying")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    init_db()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
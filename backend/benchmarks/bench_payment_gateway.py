@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark: payment flows through the blocking stripe library vs the async gateway
+
+Runs the fake processor locally with simulated network latency and pushes concurrent
+create -> confirm -> capture flows through both clients from one event loop, the way
+the payment service's async handlers do. The blocking flow goes through the stripe
+library's synchronous requestor (the HTTP path of stripe.PaymentIntent.*) and includes
+the retrieve the old capture handler made before capturing.
+
+Usage (from the backend directory):
+    python benchmarks/bench_payment_gateway.py --flows 200 --latency-ms 50
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import stripe
+import uvicorn
+
+from payment_service.fake_processor import create_app
+from payment_service.gateway import StripeGateway
+
+
+def start_processor(latency_ms: float, failure_rate: float):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(latency_ms, failure_rate), host="127.0.0.1", port=port, log_level="warning"
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def blocking_flow(requestor: stripe.APIRequestor, number: int):
+    intent, _ = requestor.request("post", "/v1/payment_intents", {
+        "amount": 10000, "currency": "mxn", "metadata": {"flow": str(number)},
+        "payment_method_types": ["card"], "capture_method": "manual"
+    })
+    intent_id = intent.data["id"]
+    requestor.request("post", f"/v1/payment_intents/{intent_id}/confirm")
+    requestor.request("get", f"/v1/payment_intents/{intent_id}")
+    requestor.request("post", f"/v1/payment_intents/{intent_id}/capture")
+
+
+async def gateway_flow(gateway: StripeGateway, number: int):
+    intent = await gateway.create_payment_intent(10000, "mxn", {"flow": str(number)})
+    await gateway.confirm_payment_intent(intent["id"])
+    await gateway.capture_payment_intent(intent["id"])
+
+
+async def run(label: str, make_flow, flows: int):
+    start = time.perf_counter()
+    results = await asyncio.gather(*[make_flow(number) for number in range(flows)], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failed = sum(isinstance(result, Exception) for result in results)
+    print(f"{label:<24} {elapsed:8.2f} s  {flows / elapsed:8.1f} flows/s  ({flows} flows, {failed} failed)")
+    return elapsed
+
+
+async def main_async(args, api_base: str):
+    stripe.max_network_retries = args.max_retries
+    requestor = stripe.APIRequestor(key="sk_test_fake", api_base=api_base)
+    blocking = await run("stripe (blocking)", lambda number: blocking_flow(requestor, number), args.flows)
+
+    gateway = StripeGateway(
+        "sk_test_fake", api_base=api_base, max_connections=args.concurrency,
+        max_concurrency=args.concurrency, max_retries=args.max_retries, retry_base_seconds=0.05
+    )
+    try:
+        non_blocking = await run("gateway (async, pooled)", lambda number: gateway_flow(gateway, number), args.flows)
+    finally:
+        await gateway.close()
+
+    print(f"speedup: {blocking / non_blocking:.1f}x")
+    print(f"gateway stats: {gateway.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--flows", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--max-retries", type=int, default=2)
+    args = parser.parse_args()
+
+    server, api_base = start_processor(args.latency_ms, args.failure_rate)
+    try:
+        asyncio.run(main_async(args, api_base))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Benchmark: capturing approved ESCROW payments one by one vs in a payout run
+
+Runs the fake processor locally with simulated latency and a per-second rate limit, seeds
+approved transactions with authorized intents, and captures them three ways: one at a
+time like /capture-payment calls, in a payout run under the configured rate limit, and
+in a payout run without one (which runs into the processor's quota and retries).
+
+Usage (from the backend directory):
+    python benchmarks/bench_payout_run.py --transactions 200 --latency-ms 300 --processor-rate-limit 25
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_payouts.db")
+
+import uvicorn
+from sqlalchemy import select
+
+from shared.database import AsyncSessionLocal, SessionLocal, dispose_async_engines, init_db
+from shared.models import User, UserRole, UserStatus
+from escrow_service.models import (
+    Currency, DeliveryMethod, EscrowStatus, EscrowTransaction, ItemCategory, ItemCondition
+)
+from payment_service.fake_processor import create_app
+from payment_service.gateway import StripeGateway
+from payment_service.models import PaymentOperation
+from payment_service.payouts import run_payouts
+from payment_service.records import record_payment
+
+
+def start_processor(latency_ms: float, rate_limit: int):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    processor = create_app(latency_ms, rate_limit=rate_limit)
+    server = uvicorn.Server(uvicorn.Config(processor, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, processor, f"http://127.0.0.1:{port}"
+
+
+def create_users():
+    with SessionLocal() as db:
+        users = [
+            User(email=f"{name}@bench.local", first_name=name, last_name="Bench", hashed_password="x",
+                 role=role, status=UserStatus.ACTIVE, is_identity_verified=True)
+            for name, role in (("buyer", UserRole.CLIENT), ("seller", UserRole.CLIENT), ("admin", UserRole.ADMIN))
+        ]
+        db.add_all(users)
+        db.commit()
+        return [user.id for user in users]
+
+
+async def seed(gateway: StripeGateway, processor, label: str, count: int, buyer_id: int, seller_id: int):
+    """Approved transactions whose intents are authorized at the processor (not timed, no rate limit)"""
+    rate_limit, processor.state.rate_limit = processor.state.rate_limit, 0
+    try:
+        async def authorize(number: int) -> str:
+            intent = await gateway.create_payment_intent(100000, "mxn", {"user_id": str(buyer_id)})
+            await gateway.confirm_payment_intent(intent["id"])
+            return intent["id"]
+
+        intents = await asyncio.gather(*[authorize(number) for number in range(count)])
+    finally:
+        processor.state.rate_limit = rate_limit
+
+    with SessionLocal() as db:
+        db.add_all([
+            EscrowTransaction(
+                transaction_id=f"BENCH-{label}-{number:06d}",
+                buyer_id=buyer_id,
+                seller_id=seller_id,
+                item_title="Bench item",
+                item_description="Bench item",
+                item_category=ItemCategory.ELECTRONICS,
+                item_condition=ItemCondition.GOOD,
+                item_estimated_value=Decimal("1000"),
+                price=Decimal("1000"),
+                currency=Currency.MXN,
+                escrow_fee=Decimal("0"),
+                total_amount=Decimal("1000"),
+                delivery_method=DeliveryMethod.PICKUP,
+                status=EscrowStatus.BUYER_APPROVED,
+                payment_status="authorized",
+                payment_transaction_id=intent_id
+            )
+            for number, intent_id in enumerate(intents)
+        ])
+        db.commit()
+
+
+async def capture_one_by_one(gateway: StripeGateway, admin_id: int) -> int:
+    """What an admin clicking /capture-payment per transaction amounts to"""
+    async with AsyncSessionLocal() as db:
+        intents = (await db.execute(
+            select(EscrowTransaction.payment_transaction_id)
+            .where(EscrowTransaction.payment_status == "authorized")
+        )).scalars().all()
+        for intent_id in intents:
+            intent = await gateway.capture_payment_intent(intent_id)
+            await record_payment(db, PaymentOperation.CAPTURE, intent, admin_id)
+            await db.execute(
+                EscrowTransaction.__table__.update()
+                .where(EscrowTransaction.payment_transaction_id == intent_id)
+                .values(payment_status="completed")
+            )
+            await db.commit()
+    return len(intents)
+
+
+def report_line(label: str, captured: int, failed: int, elapsed: float, processor, gateway: StripeGateway) -> float:
+    print(
+        f"{label:<26} {elapsed:8.2f} s  {captured / elapsed:7.1f} captures/s  "
+        f"({captured} captured, {failed} failed, {processor.state.rate_limited} rate limited, "
+        f"{gateway.metrics['retries']} retries)"
+    )
+    return captured / elapsed
+
+
+async def main_async(args, processor, api_base: str):
+    buyer_id, seller_id, admin_id = create_users()
+    modes = [
+        ("one by one", None),
+        (f"payout run ({args.rate:g}/s)", args.rate),
+        ("payout run (no limit)", 0),
+    ]
+    throughput = []
+    for label, rate in modes:
+        gateway = StripeGateway(
+            "sk_test_fake", api_base=api_base, max_connections=args.concurrency,
+            max_concurrency=args.concurrency, max_retries=args.max_retries, retry_base_seconds=0.25
+        )
+        try:
+            await seed(gateway, processor, label.split()[0] + str(rate), args.transactions, buyer_id, seller_id)
+            gateway.metrics["retries"] = 0
+            processor.state.rate_limited = 0
+            start = time.perf_counter()
+            if rate is None:
+                captured, failed = await capture_one_by_one(gateway, admin_id), 0
+            else:
+                report = await run_payouts(
+                    started_by_id=admin_id, rate_per_second=rate, concurrency=args.concurrency, gateway=gateway
+                )
+                captured, failed = report["captured"], report["failed"]
+            throughput.append(report_line(label, captured, failed, time.perf_counter() - start, processor, gateway))
+        finally:
+            await gateway.close()
+    print(f"speedup of the rate-limited payout run: {throughput[1] / throughput[0]:.1f}x")
+    # Pooled aiosqlite connections run in threads that would keep the process alive
+    await dispose_async_engines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--transactions", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--processor-rate-limit", type=int, default=25, help="Processor requests per second")
+    parser.add_argument("--rate", type=float, default=20, help="Payout run captures per second")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--max-retries", type=int, default=2)
+    args = parser.parse_args()
+
+    init_db()
+    server, processor, api_base = start_processor(args.latency_ms, args.processor_rate_limit)
+    try:
+        asyncio.run(main_async(args, processor, api_base))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: JWT verification cost per request with and without the token cache
+
+Simulates a dashboard sending the same bearer token on every request.
+
+Usage (from the backend directory):
+    python benchmarks/bench_verify_token.py --requests 20000
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from shared.auth import create_access_token, decode_token, token_cache, verify_token
+
+
+def run(label: str, func, token: str, requests: int):
+    start = time.perf_counter()
+    for _ in range(requests):
+        func(token)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / requests * 1_000_000:10.2f} us/request  ({requests} requests)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = create_access_token({"sub": "1", "email": "buyer@example.com", "role": "client"})
+    token_cache.clear()
+
+    uncached = run("decode_token (no cache)", decode_token, token, args.requests)
+    cached = run("verify_token (cached)", verify_token, token, args.requests)
+
+    print(f"speedup: {uncached / cached:.1f}x")
+    print(f"cache stats: {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
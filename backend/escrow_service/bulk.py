@@ -0,0 +1,201 @@
+"""
+Bulk ESCROW transaction creation (broker inventory onboarding)
+Rows are validated against EscrowTransactionCreate, all sellers are resolved with one
+query, and valid rows are inserted in chunks with one multi-row INSERT ... RETURNING
+per chunk, together with their stats deltas and outbox events. Each chunk is committed
+on its own, so progress can be reported while a large file is processed.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import csv
+import io
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.config import settings
+from shared.models import User
+from .fees import fee_schedule
+from .models import EscrowTransaction, EscrowStatus
+from .outbox import TRANSACTION_CREATED, record_events
+from .schemas import EscrowTransactionCreate
+from .stats import apply_stats_delta
+
+# CSV columns: item_* map to "item", the terms columns to "terms"
+CSV_ITEM_COLUMNS = ["title", "description", "category", "condition", "estimated_value", "images"]
+CSV_TERMS_COLUMNS = ["price", "currency", "delivery_method", "inspection_period_days"]
+
+
+def parse_csv_rows(content: bytes) -> List[Dict[str, Any]]:
+    """
+    Nested create payloads from a CSV file with the columns seller_id, item_title,
+    item_description, item_category, item_condition, item_estimated_value, item_images
+    (separated by "|"), price, currency, delivery_method, inspection_period_days.
+    Empty cells are left out so schema defaults apply.
+    """
+    reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+    rows = []
+    for record in reader:
+        record = {key.strip(): value.strip() for key, value in record.items() if key and value and value.strip()}
+        item = {column: record[f"item_{column}"] for column in CSV_ITEM_COLUMNS if f"item_{column}" in record}
+        if "images" in item:
+            item["images"] = [image for image in item["images"].split("|") if image]
+        terms = {column: record[column] for column in CSV_TERMS_COLUMNS if column in record}
+        rows.append({"seller_id": record.get("seller_id"), "item": item, "terms": terms})
+    return rows
+
+
+def _errors(exc: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()]
+
+
+class BulkCreation:
+    """Validates and inserts one bulk request; iterate run() for per-chunk progress"""
+
+    def __init__(self, db: AsyncSession, buyer_id: int, rows: List[Dict[str, Any]], generate_transaction_id: Callable[[], str]):
+        self.db = db
+        self.buyer_id = buyer_id
+        self.rows = rows
+        self.generate_transaction_id = generate_transaction_id
+        self.results: List[Optional[Dict[str, Any]]] = [None] * len(rows)
+        self.created = 0
+        self.failed = 0
+
+    def _fail(self, index: int, errors: List[str]):
+        self.results[index] = {"row": index, "success": False, "errors": errors}
+        self.failed += 1
+
+    async def _validate(self) -> List[Tuple[int, EscrowTransactionCreate]]:
+        validated = []
+        for index, row in enumerate(self.rows):
+            try:
+                validated.append((index, EscrowTransactionCreate.model_validate(row)))
+            except ValidationError as exc:
+                self._fail(index, _errors(exc))
+
+        # One query for every seller referenced by the request
+        seller_ids = {data.seller_id for _, data in validated}
+        sellers = {}
+        if seller_ids:
+            result = await self.db.execute(
+                select(User.id, User.is_identity_verified).where(User.id.in_(seller_ids))
+            )
+            sellers = {row.id: row.is_identity_verified for row in result}
+
+        accepted = []
+        for index, data in validated:
+            if data.seller_id not in sellers:
+                self._fail(index, ["seller_id: Seller not found"])
+            elif not sellers[data.seller_id]:
+                self._fail(index, ["seller_id: Seller must be identity verified"])
+            elif data.seller_id == self.buyer_id:
+                self._fail(index, ["seller_id: Cannot create transaction with yourself"])
+            else:
+                accepted.append((index, data))
+        return accepted
+
+    async def _insert_chunk(self, chunk: List[Tuple[int, EscrowTransactionCreate]]):
+        fees = fee_schedule.quote_many(
+            [(data.terms.price, data.item.category, data.terms.currency) for _, data in chunk]
+        )
+        expiry_date = datetime.utcnow() + timedelta(days=settings.transaction_expiry_days)
+        values = [
+            {
+                "transaction_id": self.generate_transaction_id(),
+                "buyer_id": self.buyer_id,
+                "seller_id": data.seller_id,
+                "item_title": data.item.title,
+                "item_description": data.item.description,
+                "item_category": data.item.category,
+                "item_condition": data.item.condition,
+                "item_estimated_value": data.item.estimated_value,
+                "item_images": data.item.images or [],
+                "price": data.terms.price,
+                "currency": data.terms.currency,
+                "escrow_fee": fee,
+                "total_amount": data.terms.price + fee,
+                "delivery_method": data.terms.delivery_method,
+                "delivery_address": data.terms.delivery_address,
+                "inspection_period_days": data.terms.inspection_period_days,
+                "status": EscrowStatus.PENDING_AGREEMENT,
+                "expiry_date": expiry_date,
+                "source": "bulk",
+            }
+            for (_, data), (fee, _) in zip(chunk, fees)
+        ]
+        result = await self.db.execute(
+            insert(EscrowTransaction).returning(
+                EscrowTransaction.id, EscrowTransaction.transaction_id, sort_by_parameter_order=True
+            ),
+            values
+        )
+        inserted = result.all()
+
+        totals = defaultdict(lambda: [0, Decimal("0"), Decimal("0")])
+        for row in values:
+            total = totals[row["item_category"]]
+            total[0] += 1
+            total[1] += row["price"]
+            total[2] += row["escrow_fee"]
+        for category, (count, value, fees_total) in totals.items():
+            await apply_stats_delta(self.db, EscrowStatus.PENDING_AGREEMENT, category, count, value, fees_total)
+
+        await record_events(self.db, [
+            {
+                "transaction_id": created.id,
+                "event_type": TRANSACTION_CREATED,
+                "payload": {
+                    "transaction_id": created.transaction_id,
+                    "buyer_id": row["buyer_id"],
+                    "seller_id": row["seller_id"],
+                    "item_title": row["item_title"],
+                    "status": EscrowStatus.PENDING_AGREEMENT.value,
+                    "price": str(row["price"]),
+                    "currency": row["currency"].value,
+                    "source": "bulk"
+                }
+            }
+            for created, row in zip(inserted, values)
+        ])
+        await self.db.commit()
+
+        for (index, _), created, row in zip(chunk, inserted, values):
+            self.results[index] = {
+                "row": index,
+                "success": True,
+                "id": created.id,
+                "transaction_id": created.transaction_id,
+                "escrow_fee": row["escrow_fee"],
+                "total_amount": row["total_amount"],
+            }
+        self.created += len(chunk)
+
+    async def run(self) -> AsyncIterator[Dict[str, Any]]:
+        """Process the request, yielding a progress record after validation and after each chunk"""
+        accepted = await self._validate()
+        yield self.progress()
+
+        chunk_size = settings.escrow_bulk_chunk_size
+        for start in range(0, len(accepted), chunk_size):
+            chunk = accepted[start:start + chunk_size]
+            try:
+                await self._insert_chunk(chunk)
+            except Exception as exc:
+                await self.db.rollback()
+                for index, _ in chunk:
+                    self._fail(index, [f"Insert failed: {exc.__class__.__name__}"])
+            yield self.progress()
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "total": len(self.rows),
+            "processed": self.created + self.failed,
+            "created": self.created,
+            "failed": self.failed,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.progress(), "results": self.results}
@@ -0,0 +1,252 @@
+"""
+ESCROW transaction exports for finance reconciliation
+Rows are read through a server-side cursor (yield_per) and encoded one partition at a
+time, so memory stays constant whatever the export size. The same row stream is sent
+directly as an HTTP response, or written by a background job as a gzip file for later
+download. Job files are stored in the database (escrow_export_chunks), so any replica
+can serve the download; a job whose writer stops sending heartbeats is failed by the
+next process that starts.
+"""
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, List, Sequence
+import asyncio
+import csv
+import io
+import logging
+import time
+import uuid
+import zlib
+
+import orjson
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.config import settings
+from shared.responses import dumps
+from .models import EscrowTransaction, EscrowExportJob, EscrowExportChunk
+from .schemas import EscrowExportJobCreate
+
+logger = logging.getLogger(__name__)
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Columns finance reconciles against bank and processor statements
+EXPORT_COLUMNS = [
+    EscrowTransaction.id,
+    EscrowTransaction.transaction_id,
+    EscrowTransaction.created_at,
+    EscrowTransaction.buyer_id,
+    EscrowTransaction.seller_id,
+    EscrowTransaction.item_category,
+    EscrowTransaction.status,
+    EscrowTransaction.currency,
+    EscrowTransaction.price,
+    EscrowTransaction.escrow_fee,
+    EscrowTransaction.total_amount,
+    EscrowTransaction.payment_method,
+    EscrowTransaction.payment_status,
+    EscrowTransaction.payment_transaction_id,
+    EscrowTransaction.payment_date,
+    EscrowTransaction.payment_processed_at,
+    EscrowTransaction.payment_refunded_at,
+    EscrowTransaction.completion_date,
+]
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+
+# Background export tasks, kept referenced until they finish
+_running_jobs = set()
+
+
+def export_filename(format: str, compressed: bool = False) -> str:
+    name = f"escrow-transactions-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{format}"
+    return f"{name}.gz" if compressed else name
+
+
+def export_conditions(filters: Dict[str, Any]) -> List[Any]:
+    conditions = []
+    if filters.get("created_from"):
+        conditions.append(EscrowTransaction.created_at >= filters["created_from"])
+    if filters.get("created_to"):
+        conditions.append(EscrowTransaction.created_at < filters["created_to"])
+    if filters.get("status"):
+        conditions.append(EscrowTransaction.status == filters["status"])
+    if filters.get("currency"):
+        conditions.append(EscrowTransaction.currency == filters["currency"])
+    return conditions
+
+
+async def stream_export_rows(db: AsyncSession, filters: Dict[str, Any]) -> AsyncIterator[Sequence[Any]]:
+    """Matching rows in (created_at, id) order, one yield_per partition at a time"""
+    result = await db.stream(
+        select(*EXPORT_COLUMNS)
+        .where(*export_conditions(filters))
+        .order_by(EscrowTransaction.created_at, EscrowTransaction.id)
+        .execution_options(yield_per=settings.escrow_export_batch_size)
+    )
+    async for partition in result.partitions():
+        yield partition
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_header(format: str) -> bytes:
+    if format != "csv":
+        return b""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_FIELDS)
+    return buffer.getvalue().encode()
+
+
+def encode_rows(format: str, rows: Sequence[Any]) -> bytes:
+    """Encode one partition as CSV lines or NDJSON"""
+    if format == "ndjson":
+        return b"".join(dumps(row._asdict(), orjson.OPT_APPEND_NEWLINE) for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def export_chunks(session_factory, format: str, filters: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """
+    Encoded export for a streaming response. Opens its own read-only session so the
+    cursor lives exactly as long as the response body.
+    """
+    async with session_factory() as db:
+        db.sync_session.info["read_only"] = True
+        header = encode_header(format)
+        if header:
+            yield header
+        async for rows in stream_export_rows(db, filters):
+            yield encode_rows(format, rows)
+
+
+async def create_export_job(db: AsyncSession, requested_by_id: int, request: EscrowExportJobCreate) -> EscrowExportJob:
+    """Record an export job and start writing it in the background"""
+    job = EscrowExportJob(
+        id=str(uuid.uuid4()),
+        requested_by_id=requested_by_id,
+        format=request.format,
+        filters=request.model_dump(mode="json", exclude={"format"}, exclude_none=True)
+    )
+    db.add(job)
+    await db.commit()
+
+    filters = request.model_dump(exclude={"format"})
+    task = asyncio.get_running_loop().create_task(run_export_job(job.id, request.format, filters))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    return job
+
+
+async def run_export_job(job_id: str, format: str, filters: Dict[str, Any]):
+    """
+    Write the export as gzip chunks of about ESCROW_EXPORT_CHUNK_BYTES, then publish it by
+    marking the job completed. Each chunk commits with a heartbeat for the job.
+    """
+    from shared.database import AsyncSessionLocal, AsyncReplicaSessionLocal
+
+    # Kept if the task is cancelled (e.g. the process shuts down mid-export)
+    values: Dict[str, Any] = {"status": "failed", "error": "Export was interrupted"}
+    try:
+        async with AsyncSessionLocal() as writer, AsyncReplicaSessionLocal() as reader:
+            reader.sync_session.info["read_only"] = True
+            job = update(EscrowExportJob).where(EscrowExportJob.id == job_id)
+            await writer.execute(job.values(status="running", heartbeat_at=datetime.utcnow()))
+            await writer.commit()
+
+            # wbits=31: gzip container, compressed incrementally as partitions arrive
+            compressor = zlib.compressobj(wbits=31)
+            pending = bytearray(compressor.compress(encode_header(format)))
+            sequence = row_count = file_size = 0
+            heartbeat_interval = settings.escrow_export_stale_seconds / 4
+            last_write = time.monotonic()
+
+            async def write_chunk():
+                nonlocal pending, sequence, file_size, last_write
+                await writer.execute(insert(EscrowExportChunk).values(job_id=job_id, sequence=sequence, data=bytes(pending)))
+                await writer.execute(job.values(heartbeat_at=datetime.utcnow()))
+                await writer.commit()
+                sequence += 1
+                file_size += len(pending)
+                pending = bytearray()
+                last_write = time.monotonic()
+
+            async for rows in stream_export_rows(reader, filters):
+                # Compression is CPU bound; keep it off the event loop
+                pending += await asyncio.to_thread(compressor.compress, encode_rows(format, rows))
+                row_count += len(rows)
+                if (len(pending) >= settings.escrow_export_chunk_bytes
+                        or time.monotonic() - last_write >= heartbeat_interval):
+                    await write_chunk()
+            pending += compressor.flush()
+            await write_chunk()
+        values = {"status": "completed", "row_count": row_count, "file_size": file_size}
+    except Exception as exc:
+        logger.exception("ESCROW export job %s failed", job_id)
+        values = {"status": "failed", "error": str(exc)}
+    finally:
+        async with AsyncSessionLocal() as db:
+            if values["status"] == "failed":
+                await db.execute(delete(EscrowExportChunk).where(EscrowExportChunk.job_id == job_id))
+            # Unless another process already failed the job as abandoned
+            await db.execute(
+                update(EscrowExportJob)
+                .where(EscrowExportJob.id == job_id, EscrowExportJob.status.in_(["pending", "running"]))
+                .values(completed_at=datetime.utcnow(), **values)
+            )
+            await db.commit()
+
+
+async def export_file_chunks(session_factory, job_id: str) -> AsyncIterator[bytes]:
+    """A completed job's gzip file for a streaming response, read one chunk at a time"""
+    sequence = 0
+    while True:
+        async with session_factory() as db:
+            data = (await db.execute(
+                select(EscrowExportChunk.data)
+                .where(EscrowExportChunk.job_id == job_id, EscrowExportChunk.sequence == sequence)
+            )).scalar_one_or_none()
+        if data is None:
+            return
+        yield data
+        sequence += 1
+
+
+async def fail_stale_export_jobs(db: AsyncSession) -> int:
+    """
+    Fail pending and running jobs without a heartbeat for ESCROW_EXPORT_STALE_SECONDS
+    (their process crashed or was killed) and drop their chunks. Returns the number failed.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.escrow_export_stale_seconds)
+    stale_ids = (await db.execute(
+        select(EscrowExportJob.id).where(
+            EscrowExportJob.status.in_(["pending", "running"]),
+            func.coalesce(EscrowExportJob.heartbeat_at, EscrowExportJob.created_at) < stale_before
+        )
+    )).scalars().all()
+    if not stale_ids:
+        return 0
+
+    await db.execute(delete(EscrowExportChunk).where(EscrowExportChunk.job_id.in_(stale_ids)))
+    # The status guard skips jobs that finished since they were selected
+    result = await db.execute(
+        update(EscrowExportJob)
+        .where(EscrowExportJob.id.in_(stale_ids), EscrowExportJob.status.in_(["pending", "running"]))
+        .values(status="failed", error="Export was abandoned", completed_at=datetime.utcnow())
+    )
+    await db.commit()
+    logger.warning("Failed %s abandoned ESCROW export jobs", result.rowcount)
+    return result.rowcount
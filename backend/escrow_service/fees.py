@@ -0,0 +1,142 @@
+"""
+ESCROW fee schedule
+Fees are a percentage of the price, chosen by price tier and optionally by item
+category and currency, with optional minimum and maximum fees.
+
+Rules are compiled once into a lookup table per (category, currency), and fees are
+computed in integer cents from exact rational prices, rounding half to even like
+Decimal.quantize. Single transactions and batch quotes share the same code, so a
+quote always equals the fee charged when the transaction is created.
+
+ESCROW_FEE_SCHEDULE holds the rules as a JSON list, for example:
+    [{"min_price": "100000", "percentage": "2.0"},
+     {"category": "real_estate", "percentage": "1.0", "min_fee": "5000"},
+     {"currency": "USD", "percentage": "3.0", "max_fee": "2500"}]
+A tier applies from min_price upwards (the whole price is charged at that tier's rate).
+Category and currency rules replace the general tiers for matching transactions from
+their lowest min_price upwards; the most specific set wins (category and currency, then
+category, then currency), and below its first tier the next less specific set applies.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import json
+
+from shared.config import settings
+from .models import ItemCategory, Currency
+
+CENT = Decimal("0.01")
+
+
+@dataclass(frozen=True)
+class FeeRule:
+    """One fee tier, optionally limited to a category and/or currency"""
+    percentage: Decimal
+    min_price: Decimal = Decimal("0")
+    category: Optional[ItemCategory] = None
+    currency: Optional[Currency] = None
+    min_fee: Optional[Decimal] = None
+    max_fee: Optional[Decimal] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "FeeRule":
+        def decimal(key):
+            return Decimal(str(data[key])) if data.get(key) is not None else None
+
+        return cls(
+            percentage=decimal("percentage"),
+            min_price=decimal("min_price") or Decimal("0"),
+            category=ItemCategory(data["category"]) if data.get("category") else None,
+            currency=Currency(data["currency"]) if data.get("currency") else None,
+            min_fee=decimal("min_fee"),
+            max_fee=decimal("max_fee"),
+        )
+
+
+def _to_cents(value: Optional[Decimal]) -> Optional[int]:
+    return int(value.quantize(CENT) * 100) if value is not None else None
+
+
+class _CompiledTiers:
+    """Tier bounds plus precomputed integer rate and clamps for one (category, currency)"""
+
+    __slots__ = ("bounds", "rates", "min_fees", "max_fees", "percentages")
+
+    def __init__(self, rules: Sequence[FeeRule]):
+        rules = sorted(rules, key=lambda rule: rule.min_price)
+        self.bounds = [rule.min_price for rule in rules]
+        # percentage / 100 as an exact fraction (numerator, denominator)
+        self.rates = [(rule.percentage / 100).as_integer_ratio() for rule in rules]
+        self.min_fees = [_to_cents(rule.min_fee) for rule in rules]
+        self.max_fees = [_to_cents(rule.max_fee) for rule in rules]
+        self.percentages = [rule.percentage for rule in rules]
+
+
+class FeeSchedule:
+    """Compiled fee rules"""
+
+    def __init__(self, rules: Iterable[FeeRule], default_percentage: Decimal):
+        rules = list(rules)
+        # The general tier from zero always exists unless the rules define one
+        if not any(rule.category is None and rule.currency is None and rule.min_price == 0 for rule in rules):
+            rules.append(FeeRule(percentage=default_percentage))
+
+        groups: Dict[Tuple[Optional[ItemCategory], Optional[Currency]], List[FeeRule]] = {}
+        for rule in rules:
+            groups.setdefault((rule.category, rule.currency), []).append(rule)
+
+        self.rules = rules
+        self._tiers: Dict[Tuple[ItemCategory, Currency], _CompiledTiers] = {}
+        for category in ItemCategory:
+            for currency in Currency:
+                # Overlay the matching sets from least to most specific: a set replaces the
+                # tiers from its lowest min_price upwards and keeps the ones below it
+                tiers: List[FeeRule] = []
+                for key in ((None, None), (None, currency), (category, None), (category, currency)):
+                    if key in groups:
+                        lowest = min(rule.min_price for rule in groups[key])
+                        tiers = [rule for rule in tiers if rule.min_price < lowest] + groups[key]
+                self._tiers[(category, currency)] = _CompiledTiers(tiers)
+
+    @classmethod
+    def from_settings(cls) -> "FeeSchedule":
+        rules = [FeeRule.from_dict(rule) for rule in json.loads(settings.escrow_fee_schedule or "[]")]
+        return cls(rules, Decimal(str(settings.escrow_fee_percentage)))
+
+    def quote_many(self, items: Iterable[Tuple[Decimal, ItemCategory, Currency]]) -> List[Tuple[Decimal, Decimal]]:
+        """(fee, percentage) for each (price, category, currency), in input order"""
+        tiers_by_key = self._tiers
+        results = []
+        append = results.append
+        for price, category, currency in items:
+            tiers = tiers_by_key[(category, currency)]
+            # The general tiers start at zero, so every price has a tier
+            tier = bisect_right(tiers.bounds, price) - 1
+
+            # fee in cents = price * rate * 100, from exact fractions, rounded half to even
+            price_numerator, price_denominator = price.as_integer_ratio()
+            rate_numerator, rate_denominator = tiers.rates[tier]
+            cents, remainder = divmod(price_numerator * rate_numerator * 100, price_denominator * rate_denominator)
+            twice = remainder * 2
+            if twice > price_denominator * rate_denominator or (
+                twice == price_denominator * rate_denominator and cents % 2
+            ):
+                cents += 1
+
+            min_fee = tiers.min_fees[tier]
+            if min_fee is not None and cents < min_fee:
+                cents = min_fee
+            max_fee = tiers.max_fees[tier]
+            if max_fee is not None and cents > max_fee:
+                cents = max_fee
+
+            append((Decimal(cents).scaleb(-2), tiers.percentages[tier]))
+        return results
+
+    def quote(self, price: Decimal, category: ItemCategory, currency: Currency) -> Decimal:
+        """ESCROW fee for one transaction"""
+        return self.quote_many([(price, category, currency)])[0][0]
+
+
+fee_schedule = FeeSchedule.from_settings()
@@ -0,0 +1,267 @@
+"""
+Time-ordered ESCROW transaction identifiers
+    ESC-YYYYMMDD-<13 Crockford base32 chars>
+The suffix encodes a 63-bit value: milliseconds since 2024-01-01 UTC (41 bits), a worker
+id (10 bits) and a per-millisecond sequence (12 bits). IDs from one process are strictly
+increasing, IDs sort by creation time as plain strings, and new rows land at the right
+edge of the transaction_id index instead of at random positions.
+
+IDs are unique across processes as long as each running process has its own worker id.
+Set ESCROW_WORKER_ID explicitly, or leave it at -1 to lease a free worker id from the
+escrow_id_worker_leases table. A process that cannot renew its lease stops issuing IDs
+before the lease can be claimed by another process.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from shared.config import settings
+from .models import EscrowIdWorkerLease
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "ESC"
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+EPOCH_MS = int(EPOCH.timestamp() * 1000)
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Crockford base32: digits before letters, so string order equals numeric order
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+SUFFIX_LENGTH = 13
+
+
+def encode_suffix(value: int) -> str:
+    chars = []
+    for _ in range(SUFFIX_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def parse_transaction_id(transaction_id: str) -> Tuple[datetime, int, int]:
+    """(created_at, worker_id, sequence) encoded in a time-ordered transaction id"""
+    suffix = transaction_id.rsplit("-", 1)[-1]
+    if len(suffix) != SUFFIX_LENGTH or any(char not in ALPHABET for char in suffix):
+        raise ValueError(f"Not a time-ordered transaction id: {transaction_id}")
+    value = 0
+    for char in suffix:
+        value = value * 32 + ALPHABET.index(char)
+    sequence = value & MAX_SEQUENCE
+    worker_id = (value >> SEQUENCE_BITS) & MAX_WORKER_ID
+    millis = value >> (WORKER_BITS + SEQUENCE_BITS)
+    return EPOCH + timedelta(milliseconds=millis), worker_id, sequence
+
+
+class TransactionIdGenerator:
+    """Thread-safe monotonic ID generator for one worker id"""
+
+    def __init__(self, worker_id: int, valid_for_seconds: Optional[float] = None):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+        # Monotonic deadline after which the worker id may belong to another process
+        self._valid_until = time.monotonic() + valid_for_seconds if valid_for_seconds else None
+
+    def extend(self, valid_for_seconds: float):
+        self._valid_until = time.monotonic() + valid_for_seconds
+
+    def _next_value(self) -> Tuple[int, int]:
+        with self._lock:
+            if self._valid_until is not None and time.monotonic() > self._valid_until:
+                raise RuntimeError(f"Worker id {self.worker_id} lease expired; not issuing transaction ids")
+
+            # Never go back in time, even if the wall clock does
+            now_ms = max(int(time.time() * 1000) - EPOCH_MS, self._last_ms)
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 4096 IDs in this millisecond; move to the next one
+                    now_ms += 1
+                    while int(time.time() * 1000) - EPOCH_MS < now_ms:
+                        time.sleep(0.0001)
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            value = (now_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+            return now_ms, value
+
+    def next_id(self) -> str:
+        millis, value = self._next_value()
+        day = (EPOCH + timedelta(milliseconds=millis)).strftime("%Y%m%d")
+        return f"{PREFIX}-{day}-{encode_suffix(value)}"
+
+
+class WorkerIdLease:
+    """Holds one worker id in escrow_id_worker_leases for this process"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds or settings.escrow_worker_lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.worker_id: Optional[int] = None
+
+    def _expires_at(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+
+    def claim(self, db: Session) -> int:
+        """Take over an expired worker id, or the lowest unused one"""
+        for _ in range(MAX_WORKER_ID + 1):
+            now = datetime.utcnow()
+            expired = db.execute(
+                select(EscrowIdWorkerLease.worker_id)
+                .where(EscrowIdWorkerLease.expires_at < now)
+                .order_by(EscrowIdWorkerLease.worker_id)
+                .limit(1)
+            ).scalar()
+            if expired is not None:
+                # Guarded by expires_at so only one claimer wins the row
+                result = db.execute(
+                    update(EscrowIdWorkerLease)
+                    .where(EscrowIdWorkerLease.worker_id == expired, EscrowIdWorkerLease.expires_at < now)
+                    .values(owner=self.owner, expires_at=self._expires_at())
+                )
+                db.commit()
+                if result.rowcount == 1:
+                    self.worker_id = expired
+                    return expired
+                continue
+
+            used = db.execute(select(func.count(), func.max(EscrowIdWorkerLease.worker_id))).first()
+            if used[0] > MAX_WORKER_ID:
+                raise RuntimeError("All ESCROW worker ids are leased")
+            candidate = 0 if used[1] is None else used[1] + 1
+            if candidate > MAX_WORKER_ID:
+                # Gaps only appear if rows were deleted by hand; take the first free id
+                taken = set(db.execute(select(EscrowIdWorkerLease.worker_id)).scalars())
+                candidate = min(set(range(MAX_WORKER_ID + 1)) - taken)
+            try:
+                db.add(EscrowIdWorkerLease(worker_id=candidate, owner=self.owner, expires_at=self._expires_at()))
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                continue
+            self.worker_id = candidate
+            return candidate
+        raise RuntimeError("Could not lease an ESCROW worker id")
+
+    def renew(self, db: Session) -> bool:
+        result = db.execute(
+            update(EscrowIdWorkerLease)
+            .where(EscrowIdWorkerLease.worker_id == self.worker_id, EscrowIdWorkerLease.owner == self.owner)
+            .values(expires_at=self._expires_at())
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    def release(self, db: Session):
+        db.execute(
+            delete(EscrowIdWorkerLease)
+            .where(EscrowIdWorkerLease.worker_id == self.worker_id, EscrowIdWorkerLease.owner == self.owner)
+        )
+        db.commit()
+
+
+class TransactionIds:
+    """Process-wide generator; the worker id is configured or leased on first use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generator: Optional[TransactionIdGenerator] = None
+        self.lease: Optional[WorkerIdLease] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def generator(self) -> TransactionIdGenerator:
+        if self._generator is None:
+            with self._lock:
+                if self._generator is None:
+                    self._generator = self._create_generator()
+        return self._generator
+
+    def _create_generator(self) -> TransactionIdGenerator:
+        if settings.escrow_worker_id >= 0:
+            return TransactionIdGenerator(settings.escrow_worker_id)
+
+        from shared.database import SessionLocal
+
+        self.lease = WorkerIdLease()
+        with SessionLocal() as db:
+            worker_id = self.lease.claim(db)
+        logger.info("Leased ESCROW worker id %s as %s", worker_id, self.lease.owner)
+        # Stop well before the lease can be taken over, allowing for clock skew between hosts
+        return TransactionIdGenerator(worker_id, valid_for_seconds=self.lease.ttl_seconds / 2)
+
+    def next_id(self) -> str:
+        return self.generator.next_id()
+
+    def renew(self):
+        """Extend the lease; if it was lost, lease a new worker id"""
+        if self.lease is None or self._generator is None:
+            return
+        from shared.database import SessionLocal
+
+        with SessionLocal() as db:
+            renewed = self.lease.renew(db)
+        if renewed:
+            self._generator.extend(self.lease.ttl_seconds / 2)
+            return
+        logger.error("ESCROW worker id %s lease was lost; leasing a new one", self.lease.worker_id)
+        with self._lock:
+            self._generator = self._create_generator()
+
+    async def run_renewals(self):
+        while True:
+            await asyncio.sleep(self.lease.ttl_seconds / 3)
+            try:
+                await asyncio.to_thread(self.renew)
+            except Exception:
+                logger.exception("ESCROW worker id lease renewal failed")
+
+    async def start(self):
+        """Configure or lease the worker id now, and keep a leased id renewed"""
+        await asyncio.to_thread(lambda: self.generator)
+        if self.lease is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self.run_renewals())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.release)
+
+    def release(self):
+        if self.lease is None or self.lease.worker_id is None:
+            return
+        from shared.database import SessionLocal
+
+        with SessionLocal() as db:
+            self.lease.release(db)
+
+    def stats(self):
+        return {
+            "worker_id": self._generator.worker_id if self._generator else None,
+            "leased": self.lease is not None,
+        }
+
+
+transaction_ids = TransactionIds()
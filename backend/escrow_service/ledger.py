@@ -0,0 +1,484 @@
+"""
+ESCROW custody ledger
+Append-only double-entry ledger of the funds held for ESCROW transactions. Every money
+movement is a journal whose entries (debits positive, credits negative) sum to zero:
+
+    hold     buyer_authorizations / escrow_custody   buyer funds authorized for a transaction
+    payment  processor_balance / buyer_authorizations authorized funds captured
+    void     escrow_custody / buyer_authorizations    the uncaptured rest of a partial capture, or
+                                                      the whole hold of a canceled authorization
+    fee      escrow_custody / fee_revenue             ESCROW fee, earned when funds are released
+    release  escrow_custody / seller_payable          the rest of the captured funds, to the seller
+    refund   escrow_custody or seller_payable / processor_balance
+
+Fee and release are posted when a captured transaction is approved (buyer approval or the
+scheduler's automatic release) or when an approved transaction is captured, whichever
+comes last.
+
+Journals carry a unique reference ("hold:pi_123"), so a posting reported more than once
+(webhook redeliveries, a capture seen by the payout run and by its webhook) is written once.
+
+Balances are served from each account's snapshot plus the entries written after the last
+snapshot, so a read only touches the recent tail of the ledger. The snapshotter folds new
+entries into the snapshots periodically. verify_ledger() streams every entry once to check
+that each journal and each currency sums to zero and that the snapshots match the entries.
+
+Run in the API process (LEDGER_SNAPSHOT_ENABLED=true) or as a worker:
+    python -m escrow_service.ledger [--once | --verify]
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.config import settings
+from .models import EscrowStatus, LedgerBalanceSnapshot, LedgerEntry, LedgerJournal
+
+logger = logging.getLogger(__name__)
+
+# Accounts
+BUYER_AUTHORIZATIONS = "buyer_authorizations"
+PROCESSOR_BALANCE = "processor_balance"
+ESCROW_CUSTODY = "escrow_custody"
+FEE_REVENUE = "fee_revenue"
+SELLER_PAYABLE = "seller_payable"
+
+# Accounts with a credit balance (liabilities and revenue), reported as positive amounts
+CREDIT_ACCOUNTS = {ESCROW_CUSTODY, FEE_REVENUE, SELLER_PAYABLE}
+
+# Journal kinds
+HOLD = "hold"
+PAYMENT = "payment"
+VOID = "void"
+FEE = "fee"
+RELEASE = "release"
+REFUND = "refund"
+
+# Captured funds of transactions in these statuses are released to the seller
+RELEASED_STATUSES = {EscrowStatus.BUYER_APPROVED, EscrowStatus.FUNDS_RELEASED, EscrowStatus.TRANSACTION_COMPLETED}
+
+# Unbalanced journals listed in a verification report (the counter includes all of them)
+REPORT_MAX_UNBALANCED = 100
+
+UPSERT_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+
+def minor_to_amount(value: Any) -> Decimal:
+    """Processor amounts are in the currency's minor unit"""
+    return Decimal(value or 0).scaleb(-2)
+
+
+async def post_journal(
+    db: AsyncSession,
+    reference: str,
+    kind: str,
+    currency: str,
+    lines: Sequence[Tuple[str, Decimal]],
+    escrow_transaction_id: Optional[int] = None,
+    payment_intent_id: Optional[str] = None
+) -> bool:
+    """
+    Write a balanced journal unless its reference is already posted (joins the caller's
+    transaction). Returns False for an already posted reference or an all-zero journal.
+    """
+    lines = [(account, amount) for account, amount in lines if amount]
+    if not lines:
+        return False
+    if sum(amount for _, amount in lines) != 0:
+        raise ValueError(f"Ledger journal {reference} does not balance")
+
+    values = {
+        "reference": reference,
+        "kind": kind,
+        "currency": currency,
+        "escrow_transaction_id": escrow_transaction_id,
+        "payment_intent_id": payment_intent_id,
+        "created_at": datetime.utcnow(),
+    }
+    upsert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        journal_id = (await db.execute(
+            upsert(LedgerJournal).values(**values)
+            .on_conflict_do_nothing(index_elements=[LedgerJournal.reference])
+            .returning(LedgerJournal.id)
+        )).scalar()
+    elif (await db.execute(select(LedgerJournal.id).where(LedgerJournal.reference == reference))).scalar() is None:
+        journal = LedgerJournal(**values)
+        db.add(journal)
+        await db.flush()
+        journal_id = journal.id
+    else:
+        journal_id = None
+    if journal_id is None:
+        return False
+
+    await db.execute(insert(LedgerEntry), [
+        {"journal_id": journal_id, "account": account, "currency": currency, "amount": amount}
+        for account, amount in lines
+    ])
+    return True
+
+
+async def post_intent(
+    db: AsyncSession,
+    intent: Dict[str, Any],
+    escrow_transaction_id: int,
+    escrow_status: EscrowStatus,
+    escrow_fee: Optional[Decimal]
+) -> List[str]:
+    """
+    Post what a payment intent's state means for its transaction: the hold once funds are
+    authorized, the payment once captured, fee and release once the captured funds'
+    transaction is approved, and a void of the hold once the authorization is canceled
+    (by the processor when it expires, too). Safe to call on every update; returns the
+    kinds posted.
+    """
+    intent_status = intent.get("status")
+    if intent_status not in ("requires_capture", "succeeded", "canceled"):
+        return []
+    intent_id = intent["id"]
+    currency = (intent.get("currency") or "").upper()
+    posted = []
+
+    async def post(kind: str, lines: Sequence[Tuple[str, Decimal]]):
+        if await post_journal(db, f"{kind}:{intent_id}", kind, currency, lines, escrow_transaction_id, intent_id):
+            posted.append(kind)
+
+    if intent_status == "canceled":
+        # Only a posted hold is voided; intents canceled before authorization held nothing
+        held = (await db.execute(
+            select(LedgerEntry.amount)
+            .join(LedgerJournal, LedgerJournal.id == LedgerEntry.journal_id)
+            .where(LedgerJournal.reference == f"{HOLD}:{intent_id}", LedgerEntry.account == BUYER_AUTHORIZATIONS)
+        )).scalar()
+        if held is not None:
+            await post(VOID, [(ESCROW_CUSTODY, held), (BUYER_AUTHORIZATIONS, -held)])
+        return posted
+
+    held = minor_to_amount(intent.get("amount"))
+    await post(HOLD, [(BUYER_AUTHORIZATIONS, held), (ESCROW_CUSTODY, -held)])
+    if intent_status != "succeeded":
+        return posted
+
+    captured = minor_to_amount(intent.get("amount_received") or intent.get("amount"))
+    await post(PAYMENT, [(PROCESSOR_BALANCE, captured), (BUYER_AUTHORIZATIONS, -captured)])
+    uncaptured = max(held - captured, Decimal("0"))
+    await post(VOID, [(ESCROW_CUSTODY, uncaptured), (BUYER_AUTHORIZATIONS, -uncaptured)])
+    if EscrowStatus(escrow_status) in RELEASED_STATUSES:
+        posted.extend(await _post_release(db, intent_id, currency, captured, escrow_fee, escrow_transaction_id))
+    return posted
+
+
+async def _post_release(
+    db: AsyncSession,
+    intent_id: str,
+    currency: str,
+    captured: Decimal,
+    escrow_fee: Optional[Decimal],
+    escrow_transaction_id: int
+) -> List[str]:
+    """Fee and release of an approved transaction's captured funds; returns the kinds posted"""
+    fee = min(Decimal(escrow_fee or 0), captured)
+    posted = []
+    for kind, lines in (
+        (FEE, [(ESCROW_CUSTODY, fee), (FEE_REVENUE, -fee)]),
+        (RELEASE, [(ESCROW_CUSTODY, captured - fee), (SELLER_PAYABLE, fee - captured)]),
+    ):
+        if await post_journal(db, f"{kind}:{intent_id}", kind, currency, lines, escrow_transaction_id, intent_id):
+            posted.append(kind)
+    return posted
+
+
+async def post_releases(db: AsyncSession, transactions: Sequence[Tuple[int, Optional[Decimal]]]) -> int:
+    """
+    Post fee and release for approved transactions, given as (id, escrow_fee), whose payment
+    is already captured (joins the caller's transaction). The others are released when their
+    capture is posted. Returns the number of journals posted.
+    """
+    fees = dict(transactions)
+    if not fees:
+        return 0
+    payments = (await db.execute(
+        select(
+            LedgerJournal.escrow_transaction_id,
+            LedgerJournal.payment_intent_id,
+            LedgerJournal.currency,
+            LedgerEntry.amount
+        )
+        .join(LedgerEntry, LedgerEntry.journal_id == LedgerJournal.id)
+        .where(
+            LedgerJournal.kind == PAYMENT,
+            LedgerJournal.escrow_transaction_id.in_(fees),
+            LedgerEntry.account == PROCESSOR_BALANCE
+        )
+    )).all()
+    posted = 0
+    for payment in payments:
+        posted += len(await _post_release(
+            db, payment.payment_intent_id, payment.currency, payment.amount,
+            fees[payment.escrow_transaction_id], payment.escrow_transaction_id
+        ))
+    return posted
+
+
+async def post_refund(db: AsyncSession, refund: Dict[str, Any], escrow_transaction_id: int) -> bool:
+    """Post a processor refund: from custody, or from the seller's payable once released"""
+    intent_id = refund["payment_intent"]
+    released = (await db.execute(
+        select(LedgerJournal.id).where(LedgerJournal.reference == f"{RELEASE}:{intent_id}")
+    )).scalar() is not None
+    amount = minor_to_amount(refund.get("amount"))
+    return await post_journal(
+        db, f"{REFUND}:{refund['id']}", REFUND, (refund.get("currency") or "").upper(),
+        [(SELLER_PAYABLE if released else ESCROW_CUSTODY, amount), (PROCESSOR_BALANCE, -amount)],
+        escrow_transaction_id, intent_id
+    )
+
+
+async def _tail_totals(db: AsyncSession, after_entry_id: int, up_to_entry_id: Optional[int] = None):
+    """Per account and currency totals of the entries after after_entry_id (up to up_to_entry_id)"""
+    conditions = [LedgerEntry.id > after_entry_id]
+    if up_to_entry_id is not None:
+        conditions.append(LedgerEntry.id <= up_to_entry_id)
+    # Read the tail by primary key range; grouped directly, planners may scan the whole
+    # (account, currency, id) index instead
+    tail = (
+        select(LedgerEntry.account, LedgerEntry.currency, LedgerEntry.amount)
+        .where(*conditions)
+        .order_by(LedgerEntry.id)
+        .subquery()
+    )
+    return (await db.execute(
+        select(tail.c.account, tail.c.currency, func.sum(tail.c.amount).label("total"), func.count().label("entries"))
+        .group_by(tail.c.account, tail.c.currency)
+    )).all()
+
+
+async def get_balances(db: AsyncSession, currency: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Every account's balance: its snapshot plus the entries written after the last snapshot
+    (a primary key range scan of the ledger's tail, however long the ledger is)
+    """
+    snapshots = (await db.execute(select(LedgerBalanceSnapshot))).scalars().all()
+    last_entry_id = max((snapshot.last_entry_id for snapshot in snapshots), default=0)
+    balances = {(snapshot.account, snapshot.currency): snapshot.balance for snapshot in snapshots}
+
+    # An account with entries up to last_entry_id was folded into its snapshot by then
+    for row in await _tail_totals(db, last_entry_id):
+        key = (row.account, row.currency)
+        balances[key] = balances.get(key, Decimal("0")) + Decimal(row.total)
+
+    return [
+        {
+            "account": account,
+            "currency": account_currency,
+            "balance": -balance if account in CREDIT_ACCOUNTS else balance,
+        }
+        for (account, account_currency), balance in sorted(balances.items())
+        if currency is None or account_currency == currency
+    ]
+
+
+async def take_snapshot(db: AsyncSession) -> int:
+    """Fold the entries written since the last snapshot into the snapshots and commit; returns the entries folded"""
+    if db.get_bind().dialect.name == "postgresql":
+        # Waits for transactions still writing entries (so none below the new high-water mark
+        # commits later) and keeps a second snapshotter from folding the same entries
+        await db.execute(text("LOCK TABLE ledger_entries IN SHARE ROW EXCLUSIVE MODE"))
+
+    snapshots = {
+        (snapshot.account, snapshot.currency): snapshot
+        for snapshot in (await db.execute(select(LedgerBalanceSnapshot))).scalars()
+    }
+    last_entry_id = max((snapshot.last_entry_id for snapshot in snapshots.values()), default=0)
+    high_entry_id = (await db.execute(select(func.max(LedgerEntry.id)))).scalar()
+    if not high_entry_id or high_entry_id <= last_entry_id:
+        await db.rollback()
+        return 0
+
+    deltas = await _tail_totals(db, last_entry_id, high_entry_id)
+    for row in deltas:
+        snapshot = snapshots.get((row.account, row.currency))
+        if snapshot is None:
+            snapshot = LedgerBalanceSnapshot(account=row.account, currency=row.currency, balance=Decimal("0"))
+            db.add(snapshot)
+        snapshot.balance = Decimal(snapshot.balance) + Decimal(row.total)
+        snapshot.last_entry_id = high_entry_id
+    await db.commit()
+    return sum(row.entries for row in deltas)
+
+
+async def verify_ledger(db: AsyncSession, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Stream every entry once, journal by journal, and check that each journal balances,
+    that each currency sums to zero and that the snapshots match the entries they cover.
+    Memory stays constant: only the current journal and per-account totals are kept.
+    """
+    started_at = time.perf_counter()
+    snapshots = {
+        (snapshot.account, snapshot.currency): snapshot
+        for snapshot in (await db.execute(select(LedgerBalanceSnapshot))).scalars()
+    }
+    covered: Dict[Tuple[str, str], Decimal] = defaultdict(Decimal)
+    currency_totals: Dict[str, Decimal] = defaultdict(Decimal)
+    entries = 0
+    journals = 0
+    unbalanced = 0
+    unbalanced_ids: List[int] = []
+
+    current_journal = None
+    journal_totals: Dict[str, Decimal] = defaultdict(Decimal)
+    journal_lines = 0
+
+    def close_journal():
+        nonlocal unbalanced
+        if current_journal is None:
+            return
+        if journal_lines < 2 or any(journal_totals.values()):
+            unbalanced += 1
+            if len(unbalanced_ids) < REPORT_MAX_UNBALANCED:
+                unbalanced_ids.append(current_journal)
+
+    result = await db.stream(
+        select(LedgerEntry.journal_id, LedgerEntry.id, LedgerEntry.account, LedgerEntry.currency, LedgerEntry.amount)
+        .order_by(LedgerEntry.journal_id, LedgerEntry.id)
+        .execution_options(yield_per=batch_size or settings.ledger_verify_batch_size)
+    )
+    async for partition in result.partitions():
+        for journal_id, entry_id, account, currency, amount in partition:
+            if journal_id != current_journal:
+                close_journal()
+                journals += 1
+                current_journal = journal_id
+                journal_totals = defaultdict(Decimal)
+                journal_lines = 0
+            journal_totals[currency] += amount
+            journal_lines += 1
+            currency_totals[currency] += amount
+            snapshot = snapshots.get((account, currency))
+            if snapshot is not None and entry_id <= snapshot.last_entry_id:
+                covered[(account, currency)] += amount
+            entries += 1
+    close_journal()
+
+    snapshot_mismatches = [
+        {
+            "account": account,
+            "currency": currency,
+            "snapshot": str(snapshot.balance),
+            "entries": str(covered[(account, currency)])
+        }
+        for (account, currency), snapshot in snapshots.items()
+        if Decimal(snapshot.balance) != covered[(account, currency)]
+    ]
+    seconds = time.perf_counter() - started_at
+    return {
+        "balanced": not unbalanced and not any(currency_totals.values()) and not snapshot_mismatches,
+        "entries": entries,
+        "journals": journals,
+        "unbalanced_journals": unbalanced,
+        "unbalanced_journal_ids": unbalanced_ids,
+        "currency_totals": {currency: str(total) for currency, total in sorted(currency_totals.items())},
+        "snapshot_mismatches": snapshot_mismatches,
+        "duration_seconds": round(seconds, 3),
+        "entries_per_second": round(entries / seconds, 1) if seconds > 0 else 0.0
+    }
+
+
+class LedgerSnapshotter:
+    """Folds new ledger entries into the balance snapshots periodically on the event loop"""
+
+    def __init__(self, interval_seconds: Optional[float] = None):
+        self.interval_seconds = interval_seconds or settings.ledger_snapshot_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self.counters = {"runs": 0, "entries": 0, "failed": 0}
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    async def run_once(self) -> int:
+        from shared.database import AsyncSessionLocal
+
+        started_at = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as db:
+                folded = await take_snapshot(db)
+        except Exception:
+            logger.exception("Ledger snapshot failed")
+            with self._lock:
+                self.counters["failed"] += 1
+            return 0
+        with self._lock:
+            self.counters["runs"] += 1
+            self.counters["entries"] += folded
+            self.last_run = {
+                "finished_at": datetime.utcnow().isoformat(),
+                "entries": folded,
+                "duration_ms": round((time.perf_counter() - started_at) * 1000, 3)
+            }
+        return folded
+
+    async def run_forever(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._task is not None and not self._task.done(),
+                "interval_seconds": self.interval_seconds,
+                **self.counters,
+                "last_run": self.last_run
+            }
+
+
+ledger_snapshotter = LedgerSnapshotter()
+
+
+async def verify(batch_size: Optional[int] = None) -> Dict[str, Any]:
+    from shared.database import AsyncReplicaSessionLocal
+
+    async with AsyncReplicaSessionLocal() as db:
+        return await verify_ledger(db, batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ledger snapshotter or verify the ledger")
+    parser.add_argument("--once", action="store_true", help="Take one snapshot and exit")
+    parser.add_argument("--verify", action="store_true", help="Check the sum-to-zero invariant and the snapshots")
+    parser.add_argument("--batch-size", type=int, help="Entries fetched per round trip when verifying")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.verify:
+        report = asyncio.run(verify(args.batch_size))
+        print(json.dumps(report, indent=2))
+        raise SystemExit(0 if report["balanced"] else 1)
+    if args.once:
+        print(asyncio.run(ledger_snapshotter.run_once()))
+    else:
+        asyncio.run(ledger_snapshotter.run_forever())
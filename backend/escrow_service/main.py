@@ -2,27 +2,49 @@
 ESCROW Microservice
 Handles all ESCROW transaction logic, state management, and dispute resolution
 """
-from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Header, Response, Body, File, UploadFile
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, select, union
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
+import csv
 import os
-import uuid
 
-from shared.database import get_db, init_db
+import orjson
+
+from shared.config import settings
+from shared.database import get_async_db, get_async_read_db, init_db, get_pool_metrics, AsyncSessionLocal, AsyncReplicaSessionLocal, dispose_async_engines
 from shared.models import User
 from shared.auth import get_current_user, require_verification, require_roles, UserRole
-from shared.audit_middleware import AuditMiddleware, ComplianceValidator, CriticalNotificationManager
+from shared.audit_middleware import AuditMiddleware, ComplianceValidator
+from shared.critical_notifications import CriticalNotificationManager
+from shared.idempotency import IdempotencyMiddleware, IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from shared.etag import etag_cache, etag_matches, not_modified, set_etag
+from shared.pagination import NEXT_CURSOR_HEADER, encode_cursor, keyset_after
+from shared.responses import FastJSONResponse, dumps
 from shared.session_manager import SessionManager
-from .models import EscrowTransaction, EscrowMessage, EscrowDispute, EscrowStatus
+from .models import EscrowTransaction, EscrowMessage, EscrowDispute, EscrowExportJob, EscrowStatus, ItemCategory, Currency
+from .stats import get_stats, record_transaction_created
+from .transitions import apply_transition, days_after, parse_if_match
+from .scheduler import escrow_scheduler
+from .search import search_transactions
+from .fees import fee_schedule
+from .bulk import BulkCreation, parse_csv_rows
+from .ids import transaction_ids
+from .ledger import ESCROW_CUSTODY, get_balances, ledger_snapshotter, post_releases
+from .exports import EXPORT_MEDIA_TYPES, create_export_job, export_chunks, export_file_chunks, export_filename, fail_stale_export_jobs
+from .outbox import (
+    MESSAGE_ADDED, TRANSACTION_CREATED, outbox_dispatcher, record_event, transaction_payload
+)
 from .schemas import (
-    EscrowTransactionCreate, EscrowTransactionResponse, EscrowTransactionUpdate,
+    EscrowTransactionCreate, EscrowTransactionResponse, EscrowTransactionSummary, EscrowTransactionUpdate,
+    EscrowTransactionSearchResult,
     EscrowMessageCreate, EscrowMessageResponse, EscrowDisputeCreate,
     EscrowDisputeResponse, PaymentInfo, ShippingEvidence, InspectionEvidence,
-    EscrowStats
+    EscrowStats, FeeQuoteRequest, FeeQuoteResponse, EscrowExportFilters, EscrowExportJobCreate, EscrowExportJobResponse
 )
 
 # Initialize FastAPI app
@@ -32,6 +54,18 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Replay responses for retried creates and payments that carry an Idempotency-Key
+# (added before CORS so CORS wraps it and its own 400/409/422 responses get CORS headers)
+app.add_middleware(
+    IdempotencyMiddleware,
+    routes=[
+        ("POST", r"^/transactions$"),
+        ("POST", r"^/transactions/bulk$"),
+        ("POST", r"^/transactions/bulk/csv$"),
+        ("PUT", r"^/transactions/\d+/pay$")
+    ]
+)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -39,6 +73,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", REPLAYED_HEADER],
 )
 
 # Audit middleware
@@ -47,26 +82,86 @@ app.add_middleware(AuditMiddleware, service_name="escrow-service")
 # Initialize database
 init_db()
 
+# Columns selected for list responses (only what EscrowTransactionSummary needs)
+SUMMARY_COLUMNS = [getattr(EscrowTransaction, field) for field in EscrowTransactionSummary.model_fields]
+
+
+@app.on_event("startup")
+async def start_workers():
+    """
+    Lease the transaction id worker id and fail abandoned export jobs; run the scheduler,
+    outbox dispatcher and ledger snapshotter when enabled
+    """
+    await transaction_ids.start()
+    async with AsyncSessionLocal() as db:
+        await fail_stale_export_jobs(db)
+    if settings.escrow_scheduler_enabled:
+        escrow_scheduler.start()
+    if settings.escrow_outbox_dispatcher_enabled:
+        outbox_dispatcher.start()
+    if settings.ledger_snapshot_enabled:
+        ledger_snapshotter.start()
+
 
-def calculate_escrow_fee(price: Decimal) -> Decimal:
-    """Calculate ESCROW fee (2.5% of price)"""
-    return (price * Decimal('0.025')).quantize(Decimal('0.01'))
+@app.on_event("shutdown")
+async def stop_workers():
+    await escrow_scheduler.stop()
+    await outbox_dispatcher.stop()
+    await ledger_snapshotter.stop()
+    await transaction_ids.stop()
+    await dispose_async_engines()
+
+
+def calculate_escrow_fee(price: Decimal, category: ItemCategory, currency: Currency) -> Decimal:
+    """Calculate ESCROW fee from the configured fee schedule"""
+    return fee_schedule.quote(price, category, currency)
 
 
 def generate_transaction_id() -> str:
-    """Generate unique transaction ID"""
-    return f"ESC-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
+    """Generate unique, time-ordered transaction ID"""
+    return transaction_ids.next_id()
+
+
+def add_transaction_message(
+    db: AsyncSession,
+    transaction: EscrowTransaction,
+    sender_id: int,
+    message: str,
+    is_internal: bool = False,
+    attachments: Optional[List[Dict[str, Any]]] = None
+) -> EscrowMessage:
+    """Append a message row to a transaction's history (committed with the caller's transaction)"""
+    db_message = EscrowMessage(
+        transaction_id=transaction.id,
+        sender_id=sender_id,
+        message=message,
+        is_internal=is_internal,
+        attachments=attachments or []
+    )
+    db.add(db_message)
+    return db_message
+
+
+def check_transaction_access(transaction: EscrowTransaction, current_user: User):
+    """Allow transaction parties, admins and advisors"""
+    if (transaction.buyer_id != current_user.id and 
+        transaction.seller_id != current_user.id and 
+        current_user.role not in [UserRole.ADMIN, UserRole.ADVISOR]):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
 
 
 @app.post("/transactions", response_model=EscrowTransactionResponse)
 async def create_transaction(
     transaction_data: EscrowTransactionCreate,
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new ESCROW transaction"""
     # Verify seller exists and is verified
-    seller = db.query(User).filter(User.id == transaction_data.seller_id).first()
+    seller = await db.get(User, transaction_data.seller_id)
     if not seller:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -87,7 +182,9 @@ async def create_transaction(
         )
     
     # Calculate fees
-    escrow_fee = calculate_escrow_fee(transaction_data.terms.price)
+    escrow_fee = calculate_escrow_fee(
+        transaction_data.terms.price, transaction_data.item.category, transaction_data.terms.currency
+    )
     total_amount = transaction_data.terms.price + escrow_fee
     
     # Create transaction
@@ -113,70 +210,231 @@ async def create_transaction(
     )
     
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    
-    # TODO: Send notification to seller
-    # TODO: Create audit log
+    await record_transaction_created(db, db_transaction)
+    record_event(db, db_transaction, TRANSACTION_CREATED, transaction_payload(
+        db_transaction,
+        item_title=db_transaction.item_title,
+        status=db_transaction.status,
+        price=str(db_transaction.price),
+        currency=db_transaction.currency
+    ))
+    await db.commit()
+    await db.refresh(db_transaction)
     
     return db_transaction
 
 
-@app.get("/transactions", response_model=List[EscrowTransactionResponse])
+def require_verified_broker(
+    current_user: User = Depends(require_roles([UserRole.BROKER, UserRole.ADMIN]))
+) -> User:
+    """Bulk creation is for identity-verified brokers (and admins)"""
+    if not current_user.is_identity_verified:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Identity verification required"
+        )
+    return current_user
+
+
+def require_idempotency_key(idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)) -> str:
+    """Bulk creations must be retryable without creating every row again"""
+    if not idempotency_key:
+        raise HTTPException(
+            status_code=status.HTTP_428_PRECONDITION_REQUIRED,
+            detail=f"{IDEMPOTENCY_HEADER} header is required for bulk creation"
+        )
+    return idempotency_key
+
+
+async def bulk_create_response(buyer_id: int, rows: List[Dict[str, Any]], stream: bool):
+    """Run a bulk creation; with stream=true, report progress as NDJSON while it runs"""
+    if not rows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No transactions to create"
+        )
+    if len(rows) > settings.escrow_bulk_max_rows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.escrow_bulk_max_rows} transactions per request"
+        )
+    
+    if not stream:
+        async with AsyncSessionLocal() as db:
+            creation = BulkCreation(db, buyer_id, rows, generate_transaction_id)
+            async for _ in creation.run():
+                pass
+        return FastJSONResponse(creation.summary())
+    
+    async def progress_lines():
+        async with AsyncSessionLocal() as db:
+            creation = BulkCreation(db, buyer_id, rows, generate_transaction_id)
+            async for progress in creation.run():
+                yield dumps({"type": "progress", **progress}, orjson.OPT_APPEND_NEWLINE)
+        yield dumps({"type": "result", **creation.summary()}, orjson.OPT_APPEND_NEWLINE)
+    
+    return StreamingResponse(progress_lines(), media_type="application/x-ndjson")
+
+
+@app.post("/transactions/bulk")
+async def bulk_create_transactions(
+    rows: List[Dict[str, Any]] = Body(..., description="EscrowTransactionCreate objects"),
+    stream: bool = Query(False, description="Stream NDJSON progress records, then the result"),
+    current_user: User = Depends(require_verified_broker),
+    idempotency_key: str = Depends(require_idempotency_key)
+):
+    """
+    Create many ESCROW transactions at once (broker inventories).
+    Each row is validated on its own; the response has one result per row.
+    Requires an Idempotency-Key: a retry with the same key replays the first response.
+    """
+    return await bulk_create_response(current_user.id, rows, stream)
+
+
+@app.post("/transactions/bulk/csv")
+async def bulk_create_transactions_csv(
+    file: UploadFile = File(..., description="CSV with seller_id, item_* and terms columns"),
+    stream: bool = Query(False, description="Stream NDJSON progress records, then the result"),
+    current_user: User = Depends(require_verified_broker),
+    idempotency_key: str = Depends(require_idempotency_key)
+):
+    """
+    Create many ESCROW transactions from a CSV upload (see escrow_service.bulk.parse_csv_rows).
+    Requires an Idempotency-Key; retries must resend the same bytes (multipart boundary included).
+    """
+    try:
+        rows = parse_csv_rows(await file.read())
+    except (UnicodeDecodeError, csv.Error):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be a UTF-8 CSV"
+        )
+    return await bulk_create_response(current_user.id, rows, stream)
+
+
+@app.get("/transactions", response_model=List[EscrowTransactionSummary], response_class=FastJSONResponse)
 async def get_transactions(
     status: Optional[EscrowStatus] = Query(None),
     category: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header; replaces page"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """Get user's ESCROW transactions with filtering and pagination"""
-    query = db.query(EscrowTransaction).filter(
-        or_(
-            EscrowTransaction.buyer_id == current_user.id,
-            EscrowTransaction.seller_id == current_user.id
+    """
+    Get user's ESCROW transactions, newest first, with filtering and pagination.
+    The X-Next-Cursor response header holds the cursor for the next page, if any.
+    """
+    filters = []
+    if status:
+        filters.append(EscrowTransaction.status == status)
+    if category:
+        filters.append(EscrowTransaction.item_category == category)
+    if cursor:
+        filters.append(keyset_after(EscrowTransaction.created_at, EscrowTransaction.id, cursor))
+    
+    # Legacy page mode skips rows; cursor mode starts right after the cursor
+    offset = 0 if cursor else (page - 1) * limit
+    order = (EscrowTransaction.created_at.desc(), EscrowTransaction.id.desc())
+    
+    # Walk the buyer and seller indexes separately and merge the candidate ids
+    candidate_ids = union(*[
+        select(party_page.c.id) for party_page in (
+            select(EscrowTransaction.id)
+            .where(party_column == current_user.id, *filters)
+            .order_by(*order)
+            .limit(offset + limit + 1)
+            .subquery()
+            for party_column in (EscrowTransaction.buyer_id, EscrowTransaction.seller_id)
         )
+    ]).subquery()
+    
+    # Summary columns only; rows are serialized straight to JSON without ORM objects
+    query = (
+        select(*SUMMARY_COLUMNS)
+        .where(EscrowTransaction.id.in_(select(candidate_ids.c.id)))
+        .order_by(*order)
+        .offset(offset)
+        .limit(limit + 1)
     )
+    result = await db.execute(query)
+    rows = result.all()
     
-    # Apply filters
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    
+    return FastJSONResponse([row._asdict() for row in rows], headers=headers)
+
+
+@app.get("/transactions/search", response_model=List[EscrowTransactionSearchResult], response_class=FastJSONResponse)
+async def search_transactions_endpoint(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find in the transaction id, item title and description"),
+    status: Optional[EscrowStatus] = Query(None),
+    category: Optional[ItemCategory] = Query(None),
+    currency: Optional[Currency] = Query(None),
+    min_price: Optional[Decimal] = Query(None, ge=0),
+    max_price: Optional[Decimal] = Query(None, ge=0),
+    page: int = Query(1, ge=1, le=50),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(require_roles([UserRole.ADMIN, UserRole.ADVISOR])),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Ranked full-text search over all ESCROW transactions (admin/advisor only)"""
+    filters = []
     if status:
-        query = query.filter(EscrowTransaction.status == status)
+        filters.append(EscrowTransaction.status == status)
     if category:
-        query = query.filter(EscrowTransaction.item_category == category)
-    
-    # Pagination
-    offset = (page - 1) * limit
-    transactions = query.offset(offset).limit(limit).all()
-    
-    return transactions
+        filters.append(EscrowTransaction.item_category == category)
+    if currency:
+        filters.append(EscrowTransaction.currency == currency)
+    if min_price is not None:
+        filters.append(EscrowTransaction.price >= min_price)
+    if max_price is not None:
+        filters.append(EscrowTransaction.price <= max_price)
+    
+    rows = await search_transactions(
+        db, q, SUMMARY_COLUMNS, filters,
+        limit=limit, offset=(page - 1) * limit
+    )
+    return FastJSONResponse([row._asdict() for row in rows])
 
 
 @app.get("/transactions/{transaction_id}", response_model=EscrowTransactionResponse)
 async def get_transaction(
     transaction_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """Get specific ESCROW transaction"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
-    
-    if not transaction:
+    """Get specific ESCROW transaction (supports If-None-Match)"""
+    # Version and parties only; enough to authorize and answer a conditional request
+    state = (await db.execute(
+        select(EscrowTransaction.version, EscrowTransaction.buyer_id, EscrowTransaction.seller_id)
+        .where(EscrowTransaction.id == transaction_id)
+    )).first()
+    
+    if not state:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transaction not found"
         )
     
     # Check permissions
-    if (transaction.buyer_id != current_user.id and 
-        transaction.seller_id != current_user.id and 
-        current_user.role not in [UserRole.ADMIN, UserRole.ADVISOR]):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
+    check_transaction_access(state, current_user)
+    
+    etag = etag_cache.etag(f"escrow_transaction:{transaction_id}", state.version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    transaction = await db.get(EscrowTransaction, transaction_id)
+    if transaction.version != state.version:
+        etag = etag_cache.etag(f"escrow_transaction:{transaction_id}", transaction.version)
+    set_etag(response, etag)
     
     return transaction
 
@@ -184,267 +442,134 @@ async def get_transaction(
 @app.put("/transactions/{transaction_id}/accept")
 async def accept_transaction(
     transaction_id: int,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Accept transaction terms (seller)"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
-    
-    if not transaction:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Transaction not found"
-        )
-    
-    if transaction.seller_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only seller can accept transaction"
-        )
-    
-    if transaction.status != EscrowStatus.PENDING_AGREEMENT:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Transaction is not pending agreement"
-        )
-    
-    # Update status
-    transaction.status = EscrowStatus.PENDING_PAYMENT
-    transaction.agreement_date = datetime.utcnow()
+    transaction = await apply_transition(
+        db, transaction_id, "accept", current_user.id,
+        expected_version=parse_if_match(if_match),
+        values={"agreement_date": datetime.utcnow()}
+    )
     
     # Add message
-    message = {
-        "sender_id": current_user.id,
-        "message": "Transaction terms accepted. Waiting for payment.",
-        "timestamp": datetime.utcnow().isoformat(),
-        "is_internal": False
-    }
-    transaction.messages.append(message)
-    
-    db.commit()
+    add_transaction_message(db, transaction, current_user.id, "Transaction terms accepted. Waiting for payment.")
     
-    # TODO: Send notification to buyer
-    # TODO: Create audit log
+    await db.commit()
     
-    return {"success": True, "message": "Transaction accepted"}
+    return {"success": True, "message": "Transaction accepted", "version": transaction.version}
 
 
 @app.put("/transactions/{transaction_id}/pay")
 async def process_payment(
     transaction_id: int,
     payment_info: PaymentInfo,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Process payment (buyer)"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
-    
-    if not transaction:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Transaction not found"
-        )
-    
-    if transaction.buyer_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only buyer can process payment"
-        )
-    
-    if transaction.status != EscrowStatus.PENDING_PAYMENT:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Transaction is not pending payment"
-        )
-    
     # TODO: Integrate with Stripe for actual payment processing
     # For now, simulate successful payment
-    
-    # Update transaction
-    transaction.status = EscrowStatus.PAYMENT_RECEIVED
-    transaction.payment_date = datetime.utcnow()
-    transaction.payment_method = payment_info.payment_method
-    transaction.payment_status = "completed"
-    transaction.payment_processed_at = datetime.utcnow()
+    now = datetime.utcnow()
+    transaction = await apply_transition(
+        db, transaction_id, "pay", current_user.id,
+        expected_version=parse_if_match(if_match),
+        values={
+            "payment_date": now,
+            "payment_method": payment_info.payment_method,
+            "payment_status": "completed",
+            "payment_processed_at": now
+        }
+    )
     
     # Add message
-    message = {
-        "sender_id": current_user.id,
-        "message": f"Payment processed successfully via {payment_info.payment_method.value}",
-        "timestamp": datetime.utcnow().isoformat(),
-        "is_internal": False
-    }
-    transaction.messages.append(message)
-    
-    db.commit()
+    add_transaction_message(db, transaction, current_user.id, f"Payment processed successfully via {payment_info.payment_method.value}")
     
-    # TODO: Send notification to seller
-    # TODO: Create audit log
+    await db.commit()
     
-    return {"success": True, "message": "Payment processed successfully"}
+    return {"success": True, "message": "Payment processed successfully", "version": transaction.version}
 
 
 @app.put("/transactions/{transaction_id}/ship")
 async def mark_item_shipped(
     transaction_id: int,
     shipping_evidence: ShippingEvidence,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Mark item as shipped (seller)"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
-    
-    if not transaction:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Transaction not found"
-        )
-    
-    if transaction.seller_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only seller can mark item as shipped"
-        )
-    
-    if transaction.status != EscrowStatus.PAYMENT_RECEIVED:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Payment must be received before shipping"
-        )
-    
-    # Update transaction
-    transaction.status = EscrowStatus.ITEM_SHIPPED
-    transaction.shipping_date = datetime.utcnow()
-    transaction.shipping_evidence = shipping_evidence.dict()
+    transaction = await apply_transition(
+        db, transaction_id, "ship", current_user.id,
+        expected_version=parse_if_match(if_match),
+        values={
+            "shipping_date": datetime.utcnow(),
+            "shipping_evidence": shipping_evidence.dict()
+        }
+    )
     
     # Add message
-    message = {
-        "sender_id": current_user.id,
-        "message": f"Item shipped. Tracking: {shipping_evidence.tracking_number or 'N/A'}",
-        "timestamp": datetime.utcnow().isoformat(),
-        "is_internal": False
-    }
-    transaction.messages.append(message)
-    
-    db.commit()
+    add_transaction_message(db, transaction, current_user.id, f"Item shipped. Tracking: {shipping_evidence.tracking_number or 'N/A'}")
     
-    # TODO: Send notification to buyer
-    # TODO: Create audit log
+    await db.commit()
     
-    return {"success": True, "message": "Item marked as shipped"}
+    return {"success": True, "message": "Item marked as shipped", "version": transaction.version}
 
 
 @app.put("/transactions/{transaction_id}/deliver")
 async def mark_item_delivered(
     transaction_id: int,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Mark item as delivered (buyer)"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
-    
-    if not transaction:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Transaction not found"
-        )
-    
-    if transaction.buyer_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only buyer can mark item as delivered"
-        )
-    
-    if transaction.status != EscrowStatus.ITEM_SHIPPED:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Item must be shipped before delivery confirmation"
-        )
-    
-    # Update transaction
-    transaction.status = EscrowStatus.INSPECTION_PERIOD
-    transaction.delivery_date = datetime.utcnow()
-    transaction.inspection_start_date = datetime.utcnow()
-    transaction.inspection_end_date = datetime.utcnow() + timedelta(days=transaction.inspection_period_days)
+    now = datetime.utcnow()
+    # The inspection window depends on the row, so the guarded UPDATE computes its end
+    transaction = await apply_transition(
+        db, transaction_id, "deliver", current_user.id,
+        expected_version=parse_if_match(if_match),
+        values={
+            "delivery_date": now,
+            "inspection_start_date": now,
+            "inspection_end_date": days_after(db, now, EscrowTransaction.inspection_period_days)
+        }
+    )
     
     # Add message
-    message = {
-        "sender_id": current_user.id,
-        "message": "Item received. Inspection period started.",
-        "timestamp": datetime.utcnow().isoformat(),
-        "is_internal": False
-    }
-    transaction.messages.append(message)
-    
-    db.commit()
+    add_transaction_message(db, transaction, current_user.id, "Item received. Inspection period started.")
     
-    # TODO: Send notification to seller
-    # TODO: Create audit log
+    await db.commit()
     
-    return {"success": True, "message": "Item marked as delivered. Inspection period started."}
+    return {"success": True, "message": "Item marked as delivered. Inspection period started.", "version": transaction.version}
 
 
 @app.put("/transactions/{transaction_id}/approve")
 async def approve_transaction(
     transaction_id: int,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Approve transaction (buyer)"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
-    
-    if not transaction:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Transaction not found"
-        )
-    
-    if transaction.buyer_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only buyer can approve transaction"
-        )
-    
-    if transaction.status != EscrowStatus.INSPECTION_PERIOD:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Transaction must be in inspection period"
-        )
+    transaction = await apply_transition(
+        db, transaction_id, "approve", current_user.id,
+        expected_version=parse_if_match(if_match)
+    )
     
-    # Update transaction
-    transaction.status = EscrowStatus.BUYER_APPROVED
+    # Captured funds move from custody to fee revenue and the seller's payable
+    await post_releases(db, [(transaction.id, transaction.escrow_fee)])
     
     # Add message
-    message = {
-        "sender_id": current_user.id,
-        "message": "Transaction approved. Funds will be released to seller.",
-        "timestamp": datetime.utcnow().isoformat(),
-        "is_internal": False
-    }
-    transaction.messages.append(message)
-    
-    # Check if seller also approved (for mutual approval)
-    if transaction.seller_approved_at:
-        transaction.status = EscrowStatus.FUNDS_RELEASED
-        transaction.completion_date = datetime.utcnow()
+    add_transaction_message(db, transaction, current_user.id, "Transaction approved. Funds will be released to seller.")
     
-    db.commit()
+    await db.commit()
     
     # TODO: Release funds to seller
-    # TODO: Send notification to seller
-    # TODO: Create audit log
     
-    return {"success": True, "message": "Transaction approved"}
+    return {"success": True, "message": "Transaction approved", "version": transaction.version}
 
 
 @app.post("/transactions/{transaction_id}/messages")
@@ -452,12 +577,10 @@ async def add_message(
     transaction_id: int,
     message_data: EscrowMessageCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Add message to transaction"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
+    transaction = await db.get(EscrowTransaction, transaction_id)
     
     if not transaction:
         raise HTTPException(
@@ -466,43 +589,37 @@ async def add_message(
         )
     
     # Check permissions
-    if (transaction.buyer_id != current_user.id and 
-        transaction.seller_id != current_user.id and 
-        current_user.role not in [UserRole.ADMIN, UserRole.ADVISOR]):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
+    check_transaction_access(transaction, current_user)
     
     # Add message
-    message = {
-        "sender_id": current_user.id,
-        "message": message_data.message,
-        "timestamp": datetime.utcnow().isoformat(),
-        "is_internal": message_data.is_internal,
-        "attachments": message_data.attachments or []
-    }
-    transaction.messages.append(message)
-    
-    db.commit()
+    add_transaction_message(
+        db, transaction, current_user.id, message_data.message,
+        is_internal=message_data.is_internal,
+        attachments=message_data.attachments
+    )
+    record_event(db, transaction, MESSAGE_ADDED, transaction_payload(
+        transaction, sender_id=current_user.id, is_internal=message_data.is_internal
+    ))
     
-    # TODO: Send real-time notification
-    # TODO: Create audit log
+    await db.commit()
     
     return {"success": True, "message": "Message added"}
 
 
-@app.post("/transactions/{transaction_id}/dispute")
-async def create_dispute(
+@app.get("/transactions/{transaction_id}/messages", response_model=List[EscrowMessageResponse])
+async def get_messages(
     transaction_id: int,
-    dispute_data: EscrowDisputeCreate,
-    current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header"),
+    response: Response = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """Create dispute for transaction"""
-    transaction = db.query(EscrowTransaction).filter(
-        EscrowTransaction.id == transaction_id
-    ).first()
+    """
+    Get a transaction's messages, newest first.
+    The X-Next-Cursor response header holds the cursor for the next page, if any.
+    """
+    transaction = await db.get(EscrowTransaction, transaction_id)
     
     if not transaction:
         raise HTTPException(
@@ -511,80 +628,218 @@ async def create_dispute(
         )
     
     # Check permissions
-    if (transaction.buyer_id != current_user.id and 
-        transaction.seller_id != current_user.id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only transaction parties can create disputes"
-        )
+    check_transaction_access(transaction, current_user)
+    
+    query = select(EscrowMessage).where(EscrowMessage.transaction_id == transaction_id)
+    
+    # Internal notes are only visible to staff
+    if current_user.role not in [UserRole.ADMIN, UserRole.ADVISOR]:
+        query = query.where(EscrowMessage.is_internal.is_(False))
+    
+    if cursor:
+        query = query.where(keyset_after(EscrowMessage.created_at, EscrowMessage.id, cursor))
     
-    # Check if dispute already exists
-    if transaction.dispute_info.get("is_disputed"):
+    query = query.order_by(EscrowMessage.created_at.desc(), EscrowMessage.id.desc()).limit(limit + 1)
+    result = await db.execute(query)
+    messages = result.scalars().all()
+    
+    if len(messages) > limit:
+        messages = messages[:limit]
+        last = messages[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    
+    return messages
+
+
+@app.post("/transactions/{transaction_id}/dispute")
+async def create_dispute(
+    transaction_id: int,
+    dispute_data: EscrowDisputeCreate,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(require_verification),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Create dispute for transaction (buyer or seller)"""
+    # The dispute row is written first so its id goes into the guarded UPDATE and the
+    # event; a refused transition rolls it back with the request's DB transaction
+    if (await db.execute(select(EscrowTransaction.id).where(EscrowTransaction.id == transaction_id))).first() is None:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Dispute already exists for this transaction"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Transaction not found"
         )
-    
-    # Create dispute
     dispute = EscrowDispute(
         transaction_id=transaction_id,
         initiated_by_id=current_user.id,
         reason=dispute_data.reason,
         description=dispute_data.description
     )
-    
     db.add(dispute)
-    
-    # Update transaction
-    transaction.status = EscrowStatus.DISPUTED
-    transaction.dispute_info = {
-        "is_disputed": True,
-        "dispute_id": dispute.id,
-        "initiated_by": current_user.id,
-        "reason": dispute_data.reason,
-        "created_at": datetime.utcnow().isoformat()
-    }
+    await db.flush()
+    
+    transaction = await apply_transition(
+        db, transaction_id, "dispute", current_user.id,
+        expected_version=parse_if_match(if_match),
+        values={"dispute_info": {
+            "is_disputed": True,
+            "dispute_id": dispute.id,
+            "initiated_by": current_user.id,
+            "reason": dispute_data.reason,
+            "created_at": datetime.utcnow().isoformat()
+        }},
+        event_details={"dispute_id": dispute.id, "reason": dispute_data.reason}
+    )
     
     # Add message
-    message = {
-        "sender_id": current_user.id,
-        "message": f"Dispute created: {dispute_data.reason}",
-        "timestamp": datetime.utcnow().isoformat(),
-        "is_internal": False
-    }
-    transaction.messages.append(message)
+    add_transaction_message(db, transaction, current_user.id, f"Dispute created: {dispute_data.reason}")
     
-    db.commit()
+    await db.commit()
     
-    # TODO: Send notification to admin
-    # TODO: Create audit log
+    return {"success": True, "message": "Dispute created", "version": transaction.version}
+
+
+@app.post("/fees/quote", response_model=FeeQuoteResponse, response_class=FastJSONResponse)
+async def quote_fees(
+    quote_request: FeeQuoteRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Quote ESCROW fees for many prices at once (same fees as transaction creation)"""
+    if len(quote_request.items) > settings.escrow_fee_quote_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.escrow_fee_quote_max_items} items per quote"
+        )
     
-    return {"success": True, "message": "Dispute created"}
+    items = [(item.price, item.category, item.currency) for item in quote_request.items]
+    quotes = [
+        {
+            "price": price,
+            "category": category,
+            "currency": currency,
+            "fee_percentage": percentage,
+            "escrow_fee": fee,
+            "total_amount": price + fee
+        }
+        for (price, category, currency), (fee, percentage) in zip(items, fee_schedule.quote_many(items))
+    ]
+    return FastJSONResponse({"quotes": quotes})
 
 
 @app.get("/stats", response_model=EscrowStats)
 async def get_escrow_stats(
     current_user: User = Depends(require_roles([UserRole.ADMIN, UserRole.ADVISOR])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get ESCROW statistics (admin/advisor only), served from the running summary table"""
+    return await get_stats(db)
+
+
+@app.get("/ledger/balances")
+async def get_ledger_balances(
+    currency: Optional[Currency] = Query(None),
+    current_user: User = Depends(require_roles([UserRole.ADMIN, UserRole.ADVISOR])),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Get the custody ledger's account balances (admin/advisor only), from the balance
+    snapshots plus the entries since. "custody" is the amount held per currency.
+    """
+    balances = await get_balances(db, currency.value if currency else None)
+    return FastJSONResponse({
+        "balances": balances,
+        "custody": {
+            balance["currency"]: balance["balance"]
+            for balance in balances
+            if balance["account"] == ESCROW_CUSTODY
+        }
+    })
+
+
+@app.get("/exports/transactions")
+async def export_transactions(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    created_from: Optional[datetime] = Query(None),
+    created_to: Optional[datetime] = Query(None, description="Exclusive upper bound"),
+    status: Optional[EscrowStatus] = Query(None),
+    currency: Optional[Currency] = Query(None),
+    current_user: User = Depends(require_roles([UserRole.ADMIN]))
+):
+    """Stream transactions as CSV or NDJSON for reconciliation (admin only)"""
+    filters = EscrowExportFilters(
+        created_from=created_from, created_to=created_to, status=status, currency=currency
+    ).dict()
+    return StreamingResponse(
+        export_chunks(AsyncReplicaSessionLocal, format, filters),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format)}"'}
+    )
+
+
+@app.post("/exports/transactions/jobs", response_model=EscrowExportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_transactions_export_job(
+    export_request: EscrowExportJobCreate,
+    current_user: User = Depends(require_roles([UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get ESCROW statistics (admin/advisor only)"""
-    # TODO: Implement comprehensive statistics
-    return EscrowStats(
-        total_transactions=0,
-        total_value=Decimal('0'),
-        total_fees=Decimal('0'),
-        active_transactions=0,
-        completed_transactions=0,
-        disputed_transactions=0,
-        status_breakdown={},
-        category_breakdown={}
+    """Start a gzip-compressed export in the background (admin only)"""
+    return await create_export_job(db, current_user.id, export_request)
+
+
+async def get_export_job_or_404(job_id: str, db: AsyncSession) -> EscrowExportJob:
+    job = await db.get(EscrowExportJob, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export job not found"
+        )
+    return job
+
+
+@app.get("/exports/transactions/jobs/{job_id}", response_model=EscrowExportJobResponse)
+async def get_transactions_export_job(
+    job_id: str,
+    current_user: User = Depends(require_roles([UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get the status of an export job (admin only)"""
+    return await get_export_job_or_404(job_id, db)
+
+
+@app.get("/exports/transactions/jobs/{job_id}/download")
+async def download_transactions_export(
+    job_id: str,
+    current_user: User = Depends(require_roles([UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download a completed export job's file (admin only)"""
+    job = await get_export_job_or_404(job_id, db)
+    if job.status != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Export job is {job.status}"
+        )
+    return StreamingResponse(
+        export_file_chunks(AsyncSessionLocal, job.id),
+        media_type="application/gzip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{export_filename(job.format, compressed=True)}"',
+            "Content-Length": str(job.file_size)
+        }
     )
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "escrow-service"}
+    return {
+        "status": "healthy",
+        "service": "escrow-service",
+        "db_pool": get_pool_metrics(),
+        "scheduler": escrow_scheduler.stats(),
+        "outbox": outbox_dispatcher.stats(),
+        "ledger_snapshots": ledger_snapshotter.stats(),
+        "transaction_ids": transaction_ids.stats(),
+        "etag_cache": etag_cache.stats()
+    }
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
 """
 ESCROW Service Models
 """
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON, ForeignKey, Enum, Numeric
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, JSON, ForeignKey, Enum, Numeric, Index, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from datetime import datetime
 from enum import Enum as PyEnum
 from shared.database import Base
 
@@ -64,6 +65,14 @@ class Currency(str, PyEnum):
 
 class EscrowTransaction(Base):
     __tablename__ = "escrow_transactions"
+    __table_args__ = (
+        # Keyset pagination of a party's transactions ordered by (created_at, id)
+        Index("idx_escrow_buyer_created", "buyer_id", "created_at", "id"),
+        Index("idx_escrow_seller_created", "seller_id", "created_at", "id"),
+        # Due-date scans by the scheduler
+        Index("idx_escrow_status_expiry", "status", "expiry_date"),
+        Index("idx_escrow_status_inspection_end", "status", "inspection_end_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     transaction_id = Column(String(50), unique=True, index=True, nullable=False)
@@ -76,7 +85,7 @@ class EscrowTransaction(Base):
     # Item information
     item_title = Column(String(200), nullable=False)
     item_description = Column(Text, nullable=False)
-    item_category = Column(Enum(ItemCategory), nullable=False)
+    item_category = Column(Enum(ItemCategory), nullable=False, index=True)
     item_condition = Column(Enum(ItemCondition), nullable=False)
     item_estimated_value = Column(Numeric(15, 2), nullable=False)
     item_images = Column(JSON, default=list)
@@ -92,10 +101,13 @@ class EscrowTransaction(Base):
     inspection_period_days = Column(Integer, default=3, nullable=False)
     
     # Transaction status
-    status = Column(Enum(EscrowStatus), default=EscrowStatus.PENDING_AGREEMENT, nullable=False)
+    status = Column(Enum(EscrowStatus), default=EscrowStatus.PENDING_AGREEMENT, nullable=False, index=True)
+    # Bumped on every change; guards transitions and ORM updates against lost updates
+    version = Column(Integer, default=1, server_default="1", nullable=False)
     
     # Important dates
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Python-side default gives sub-second, consistently formatted sort keys on every backend
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now(), index=True)
     agreement_date = Column(DateTime(timezone=True), nullable=True)
     payment_date = Column(DateTime(timezone=True), nullable=True)
     shipping_date = Column(DateTime(timezone=True), nullable=True)
@@ -107,7 +119,7 @@ class EscrowTransaction(Base):
     
     # Payment information
     payment_method = Column(Enum(PaymentMethod), nullable=True)
-    payment_transaction_id = Column(String(100), nullable=True)
+    payment_transaction_id = Column(String(100), nullable=True, index=True)
     payment_status = Column(String(20), default="pending")
     payment_processed_at = Column(DateTime(timezone=True), nullable=True)
     payment_refunded_at = Column(DateTime(timezone=True), nullable=True)
@@ -117,7 +129,7 @@ class EscrowTransaction(Base):
     inspection_evidence = Column(JSON, default=dict)
     documents = Column(JSON, default=list)
     
-    # Communication
+    # Legacy message history; new messages are stored in escrow_messages
     messages = Column(JSON, default=list)
     
     # Dispute information
@@ -135,13 +147,19 @@ class EscrowTransaction(Base):
     kyc_flags = Column(JSON, default=dict)
     
     # Relationships
-    buyer = relationship("User", foreign_keys=[buyer_id], back_populates="escrow_transactions_as_buyer")
-    seller = relationship("User", foreign_keys=[seller_id], back_populates="escrow_transactions_as_seller")
+    buyer = relationship("User", foreign_keys=[buyer_id], backref="escrow_transactions_as_buyer")
+    seller = relationship("User", foreign_keys=[seller_id], backref="escrow_transactions_as_seller")
     supervisor = relationship("User", foreign_keys=[supervisor_id])
 
+    __mapper_args__ = {"version_id_col": version}
+
 
 class EscrowMessage(Base):
     __tablename__ = "escrow_messages"
+    __table_args__ = (
+        # Keyset pagination of a transaction's messages ordered by (created_at, id)
+        Index("idx_escrow_messages_transaction_created", "transaction_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     transaction_id = Column(Integer, ForeignKey("escrow_transactions.id"), nullable=False)
@@ -151,7 +169,7 @@ class EscrowMessage(Base):
     is_internal = Column(Boolean, default=False)
     attachments = Column(JSON, default=list)
     
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     
     # Relationships
     transaction = relationship("EscrowTransaction")
@@ -179,3 +197,143 @@ class EscrowDispute(Base):
     transaction = relationship("EscrowTransaction")
     initiated_by = relationship("User", foreign_keys=[initiated_by_id])
     resolved_by = relationship("User", foreign_keys=[resolved_by_id])
+
+
+class EscrowStatsSummary(Base):
+    """Running totals per (status, category), maintained alongside every transition"""
+    __tablename__ = "escrow_stats_summary"
+
+    status = Column(Enum(EscrowStatus), primary_key=True)
+    item_category = Column(Enum(ItemCategory), primary_key=True)
+    
+    transaction_count = Column(BigInteger, default=0, nullable=False)
+    total_value = Column(Numeric(18, 2), default=0, nullable=False)
+    total_fees = Column(Numeric(18, 2), default=0, nullable=False)
+    
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EscrowOutboxEvent(Base):
+    """Domain event written in the same commit as the change it describes, dispatched later"""
+    __tablename__ = "escrow_outbox"
+    __table_args__ = (
+        # Dispatcher claim query: pending events that are due, in insertion order
+        Index("idx_escrow_outbox_status_available", "status", "available_at", "id"),
+        # Per-transaction ordering check: earlier pending events of the same transaction
+        Index("idx_escrow_outbox_transaction", "transaction_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(Integer, ForeignKey("escrow_transactions.id"), nullable=False)
+    
+    event_type = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    
+    # Delivery state
+    status = Column(String(20), nullable=False, default="pending")  # pending, dispatched, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    delivered_sinks = Column(JSON, default=list)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # Relationships
+    transaction = relationship("EscrowTransaction")
+
+
+class EscrowExportJob(Base):
+    """Background export of transactions to a gzip-compressed file stored in escrow_export_chunks"""
+    __tablename__ = "escrow_export_jobs"
+
+    id = Column(String(36), primary_key=True)
+    requested_by_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    format = Column(String(10), nullable=False)  # csv, ndjson
+    filters = Column(JSON, default=dict)
+    
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    row_count = Column(BigInteger, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    # Refreshed by the writer with every chunk; a running job without heartbeats is abandoned
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # Relationships
+    requested_by = relationship("User")
+
+
+class EscrowExportChunk(Base):
+    """Consecutive slice of an export job's gzip file, readable by every replica"""
+    __tablename__ = "escrow_export_chunks"
+
+    job_id = Column(String(36), ForeignKey("escrow_export_jobs.id", ondelete="CASCADE"), primary_key=True)
+    sequence = Column(Integer, primary_key=True, autoincrement=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class EscrowIdWorkerLease(Base):
+    """Worker id held by a running process for time-ordered transaction ids"""
+    __tablename__ = "escrow_id_worker_leases"
+
+    worker_id = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String(100), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class LedgerJournal(Base):
+    """One balanced posting (hold, payment, fee, release or refund); never updated or deleted"""
+    __tablename__ = "ledger_journals"
+
+    id = Column(Integer, primary_key=True)
+    # Idempotency key (e.g. "hold:pi_123"); a posting is written once however often it is reported
+    reference = Column(String(255), unique=True, nullable=False)
+    kind = Column(String(20), nullable=False)
+    currency = Column(String(3), nullable=False)
+    escrow_transaction_id = Column(Integer, ForeignKey("escrow_transactions.id"), nullable=True, index=True)
+    payment_intent_id = Column(String(255), nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    
+    # Relationships
+    entries = relationship("LedgerEntry", back_populates="journal")
+
+
+class LedgerEntry(Base):
+    """One line of a journal: a signed amount on an account (debits positive, credits negative)"""
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        # Balance deltas: an account's entries after its last snapshot
+        Index("idx_ledger_entries_account_currency_id", "account", "currency", "id"),
+        # Integrity check: entries streamed journal by journal
+        Index("idx_ledger_entries_journal_id", "journal_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    journal_id = Column(Integer, ForeignKey("ledger_journals.id"), nullable=False)
+    account = Column(String(40), nullable=False)
+    currency = Column(String(3), nullable=False)
+    amount = Column(Numeric(15, 2), nullable=False)
+    
+    # Relationships
+    journal = relationship("LedgerJournal", back_populates="entries")
+
+
+class LedgerBalanceSnapshot(Base):
+    """Balance of an account including every entry up to last_entry_id (one row per account and currency)"""
+    __tablename__ = "ledger_balance_snapshots"
+    __table_args__ = (
+        UniqueConstraint("account", "currency", name="uq_ledger_snapshots_account_currency"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    account = Column(String(40), nullable=False)
+    currency = Column(String(3), nullable=False)
+    balance = Column(Numeric(18, 2), nullable=False)
+    last_entry_id = Column(Integer, nullable=False)
+    
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,416 @@
+"""
+ESCROW transactional outbox
+Transitions write a domain event into escrow_outbox in the same commit as the change,
+so the request path pays one extra INSERT. The dispatcher drains the outbox in batches
+and fans each event out to the sinks (in-app notifications, critical notifications and
+the audit log), retrying failed deliveries with exponential backoff.
+
+Events of one transaction are delivered in order: only the oldest pending event of a
+transaction can be claimed (FOR UPDATE SKIP LOCKED), and its followers are dispatched
+behind it in the same batch. Transitions of a transaction are serialized by the row
+lock of their guarded UPDATE, so event ids follow the order of the changes.
+
+Run in the API process (ESCROW_OUTBOX_DISPATCHER_ENABLED=true) or as a worker:
+    python -m escrow_service.outbox [--once]
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import and_, exists, insert, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.config import settings
+from shared.critical_notifications import CriticalNotificationManager
+from shared.models import Notification
+from shared.session_manager import SessionManager
+from .models import EscrowTransaction, EscrowOutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Event types
+TRANSACTION_CREATED = "transaction.created"
+STATUS_CHANGED = "transaction.status_changed"
+MESSAGE_ADDED = "transaction.message_added"
+# Processor payments or chargebacks that were not applied automatically (staff only)
+PAYMENT_ALERT = "transaction.payment_alert"
+
+
+def _value(value: Any) -> Any:
+    return value.value if hasattr(value, "value") else value
+
+
+def transaction_payload(transaction, **extra) -> Dict[str, Any]:
+    """Event payload identifying a transaction and its parties (ORM object or returned row)"""
+    return {
+        "transaction_id": transaction.transaction_id,
+        "buyer_id": transaction.buyer_id,
+        "seller_id": transaction.seller_id,
+        **{key: _value(value) for key, value in extra.items()}
+    }
+
+
+def record_event(db: AsyncSession, transaction, event_type: str, payload: Dict[str, Any]) -> EscrowOutboxEvent:
+    """
+    Add an outbox event for a transaction (committed with the caller's transaction).
+    transaction may be a pending EscrowTransaction, whose id is assigned on flush.
+    """
+    event = EscrowOutboxEvent(event_type=event_type, payload=payload)
+    if isinstance(transaction, EscrowTransaction):
+        event.transaction = transaction
+    else:
+        event.transaction_id = transaction.id
+    db.add(event)
+    return event
+
+
+async def record_events(db: AsyncSession, events: Sequence[Dict[str, Any]]):
+    """Insert many outbox events with one executemany (bulk transitions)"""
+    if events:
+        await db.execute(insert(EscrowOutboxEvent), list(events))
+
+
+def status_change_event(transaction, operation: str, from_status, to_status, actor_id: Optional[int], **extra) -> Dict[str, Any]:
+    """Row for record_events() describing a status change"""
+    return {
+        "transaction_id": transaction.id,
+        "event_type": STATUS_CHANGED,
+        "payload": transaction_payload(
+            transaction, operation=operation, from_status=from_status,
+            to_status=to_status, actor_id=actor_id, **extra
+        )
+    }
+
+
+class OutboxSink:
+    """Interface for event consumers. Raise to have the event retried."""
+
+    name = "sink"
+
+    async def deliver(self, db: AsyncSession, event: EscrowOutboxEvent):
+        raise NotImplementedError
+
+
+class NotificationSink(OutboxSink):
+    """
+    In-app notifications for the transaction parties, written to the notifications table
+    served by the notification service. Committed together with the event's delivery state.
+    """
+
+    name = "notifications"
+
+    def recipients(self, event: EscrowOutboxEvent) -> List[int]:
+        payload = event.payload
+        parties = [payload["buyer_id"], payload["seller_id"]]
+        if event.event_type == TRANSACTION_CREATED:
+            return [payload["seller_id"]]
+        if event.event_type == PAYMENT_ALERT:
+            return []
+        if event.event_type == MESSAGE_ADDED:
+            if payload.get("is_internal"):
+                return []
+            return [party for party in parties if party != payload.get("sender_id")]
+        return [party for party in parties if party != payload.get("actor_id")]
+
+    def content(self, event: EscrowOutboxEvent) -> Dict[str, str]:
+        payload = event.payload
+        transaction_id = payload["transaction_id"]
+        if event.event_type == TRANSACTION_CREATED:
+            return {
+                "title": "New ESCROW transaction",
+                "message": f"You have been added as seller to transaction {transaction_id}: {payload.get('item_title', '')}"
+            }
+        if event.event_type == MESSAGE_ADDED:
+            return {
+                "title": "New transaction message",
+                "message": f"There is a new message on transaction {transaction_id}."
+            }
+        return {
+            "title": "ESCROW transaction updated",
+            "message": f"Transaction {transaction_id} changed from {payload['from_status']} to {payload['to_status']}."
+        }
+
+    async def deliver(self, db: AsyncSession, event: EscrowOutboxEvent):
+        content = self.content(event)
+        for user_id in self.recipients(event):
+            db.add(Notification(
+                user_id=user_id,
+                title=content["title"],
+                message=content["message"],
+                notification_type="push",
+                notification_metadata={"event_id": event.id, "event_type": event.event_type, **event.payload}
+            ))
+
+
+class CriticalNotificationSink(OutboxSink):
+    """Status changes, disputes and payment alerts that need staff confirmation"""
+
+    name = "critical_notifications"
+
+    def __init__(self):
+        self.manager = CriticalNotificationManager(
+            SessionManager(user_id=0, role="system", session_id="escrow_outbox_dispatcher")
+        )
+
+    async def deliver(self, db: AsyncSession, event: EscrowOutboxEvent):
+        payload = event.payload
+        if event.event_type == PAYMENT_ALERT:
+            self.manager.handle_payment_alert(payload["transaction_id"], payload["alert"], {"event_id": event.id, **payload})
+            return
+        if event.event_type != STATUS_CHANGED:
+            return
+        context = {"actor_id": payload.get("actor_id"), "operation": payload["operation"], "event_id": event.id}
+        self.manager.handle_transaction_status_change(
+            payload["transaction_id"], payload["from_status"], payload["to_status"], context
+        )
+        if payload["operation"] == "dispute":
+            self.manager.handle_dispute_created(
+                str(payload["dispute_id"]), payload["transaction_id"], payload["reason"], context
+            )
+
+
+class AuditSink(OutboxSink):
+    """Audit log entry per domain event, in the format of the audit middleware"""
+
+    name = "audit"
+
+    async def deliver(self, db: AsyncSession, event: EscrowOutboxEvent):
+        log_data = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "event_id": event.id,
+            "event_type": event.event_type,
+            "occurred_at": event.created_at.isoformat() if event.created_at else None,
+            **event.payload
+        }
+        print(f"AUDIT EVENT: {json.dumps(log_data, default=str)}")
+
+
+def default_sinks() -> List[OutboxSink]:
+    return [NotificationSink(), CriticalNotificationSink(), AuditSink()]
+
+
+class OutboxMetrics:
+    """Thread-safe dispatcher counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"batches": 0, "dispatched": 0, "retried": 0, "failed": 0}
+        self.last_batch: Optional[Dict[str, Any]] = None
+
+    def record_batch(self, dispatched: int, retried: int, failed: int, lag_seconds: float, seconds: float):
+        with self._lock:
+            self.counters["batches"] += 1
+            self.counters["dispatched"] += dispatched
+            self.counters["retried"] += retried
+            self.counters["failed"] += failed
+            self.last_batch = {
+                "finished_at": datetime.utcnow().isoformat(),
+                "dispatched": dispatched,
+                "retried": retried,
+                "failed": failed,
+                "max_lag_seconds": round(lag_seconds, 3),
+                "duration_ms": round(seconds * 1000, 3)
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "last_batch": self.last_batch}
+
+
+outbox_metrics = OutboxMetrics()
+
+
+def naive_utc(moment: datetime) -> datetime:
+    """UTC wall time without tzinfo; aware values (PostgreSQL timestamptz) are converted first"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff after the given number of failed attempts"""
+    delay = settings.escrow_outbox_retry_base_seconds * (2 ** (attempts - 1))
+    return min(delay, settings.escrow_outbox_retry_max_seconds)
+
+
+async def claim_batch(db: AsyncSession, now: datetime, batch_size: int) -> List[EscrowOutboxEvent]:
+    """
+    Lock the oldest due event of up to batch_size transactions, then the pending events
+    queued behind them. Other dispatchers cannot claim those followers while the head
+    event is still pending, so each transaction's events go through one dispatcher.
+    """
+    earlier = aliased(EscrowOutboxEvent)
+    heads = (await db.execute(
+        select(EscrowOutboxEvent)
+        .where(
+            EscrowOutboxEvent.status == "pending",
+            EscrowOutboxEvent.available_at <= now,
+            ~exists().where(and_(
+                earlier.transaction_id == EscrowOutboxEvent.transaction_id,
+                earlier.status == "pending",
+                earlier.id < EscrowOutboxEvent.id
+            ))
+        )
+        .order_by(EscrowOutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+    if not heads or len(heads) >= batch_size:
+        return list(heads)
+
+    followers = (await db.execute(
+        select(EscrowOutboxEvent)
+        .where(
+            EscrowOutboxEvent.transaction_id.in_(list({event.transaction_id for event in heads})),
+            EscrowOutboxEvent.status == "pending",
+            EscrowOutboxEvent.id.notin_([event.id for event in heads])
+        )
+        .order_by(EscrowOutboxEvent.id)
+        .limit(batch_size - len(heads))
+        .with_for_update()
+    )).scalars().all()
+    return sorted([*heads, *followers], key=lambda event: event.id)
+
+
+async def dispatch_batch(db: AsyncSession, sinks: Sequence[OutboxSink], batch_size: int) -> int:
+    """
+    Deliver one batch of events and commit their delivery state.
+    Returns the number of events claimed.
+    """
+    now = datetime.utcnow()
+    events = await claim_batch(db, now, batch_size)
+    if not events:
+        await db.rollback()
+        return 0
+
+    started_at = time.perf_counter()
+    dispatched = retried = failed = 0
+    max_lag = 0.0
+    blocked = set()
+
+    for event in events:
+        # A failed event holds back the rest of its transaction until it is retried
+        if event.transaction_id in blocked:
+            continue
+
+        delivered = list(event.delivered_sinks or [])
+        error = None
+        for sink in sinks:
+            if sink.name in delivered:
+                continue
+            try:
+                await sink.deliver(db, event)
+                delivered.append(sink.name)
+            except Exception as exc:
+                error = f"{sink.name}: {exc}"
+                logger.warning("ESCROW outbox event %s failed in %s: %s", event.id, sink.name, exc)
+                break
+
+        event.delivered_sinks = delivered
+        event.attempts += 1
+        if error is None:
+            event.status = "dispatched"
+            event.dispatched_at = datetime.utcnow()
+            event.last_error = None
+            dispatched += 1
+            if event.created_at is not None:
+                max_lag = max(max_lag, (now - naive_utc(event.created_at)).total_seconds())
+            continue
+
+        event.last_error = error
+        blocked.add(event.transaction_id)
+        if event.attempts >= settings.escrow_outbox_max_attempts:
+            # Give up; later events of the transaction are released
+            event.status = "failed"
+            failed += 1
+            logger.error("ESCROW outbox event %s failed after %s attempts: %s", event.id, event.attempts, error)
+        else:
+            event.available_at = now + timedelta(seconds=retry_delay(event.attempts))
+            retried += 1
+
+    await db.commit()
+    outbox_metrics.record_batch(dispatched, retried, failed, max_lag, time.perf_counter() - started_at)
+    return len(events)
+
+
+class OutboxDispatcher:
+    """Drains the outbox on the event loop, polling when it is empty"""
+
+    def __init__(
+        self,
+        sinks: Optional[Sequence[OutboxSink]] = None,
+        poll_interval_seconds: Optional[float] = None,
+        batch_size: Optional[int] = None
+    ):
+        self._sinks = list(sinks) if sinks is not None else None
+        self.poll_interval_seconds = poll_interval_seconds or settings.escrow_outbox_poll_interval_seconds
+        self.batch_size = batch_size or settings.escrow_outbox_batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def sinks(self) -> List[OutboxSink]:
+        if self._sinks is None:
+            self._sinks = default_sinks()
+        return self._sinks
+
+    async def run_once(self) -> int:
+        """Dispatch until the outbox has no due events; returns the number of events claimed"""
+        from shared.database import AsyncSessionLocal
+
+        total = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                claimed = await dispatch_batch(db, self.sinks, self.batch_size)
+            total += claimed
+            if claimed < self.batch_size:
+                return total
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("ESCROW outbox dispatch failed")
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "poll_interval_seconds": self.poll_interval_seconds,
+            "batch_size": self.batch_size,
+            **outbox_metrics.snapshot()
+        }
+
+
+outbox_dispatcher = OutboxDispatcher()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ESCROW outbox dispatcher")
+    parser.add_argument("--once", action="store_true", help="Dispatch the due events once and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.once:
+        print(asyncio.run(outbox_dispatcher.run_once()))
+    else:
+        asyncio.run(outbox_dispatcher.run_forever())
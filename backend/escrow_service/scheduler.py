@@ -0,0 +1,244 @@
+"""
+ESCROW scheduler
+Moves transactions whose due date has passed: expired agreements to EXPIRED and
+finished inspection periods to BUYER_APPROVED (automatic release).
+
+Due rows are claimed in bounded batches with FOR UPDATE SKIP LOCKED, so several
+workers can run side by side without processing the same transaction twice.
+
+Run in the API process (ESCROW_SCHEDULER_ENABLED=true) or as a worker:
+    python -m escrow_service.scheduler [--once]
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional
+import argparse
+import asyncio
+import logging
+import threading
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.audit_middleware import ESCROW_TRANSITIONS
+from shared.config import settings
+from .ledger import RELEASED_STATUSES, post_releases
+from .models import EscrowTransaction, EscrowStatus
+from .outbox import record_events, status_change_event
+from .stats import apply_stats_delta
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ScheduledTransition:
+    """A transition applied to every transaction in from_status whose due column has passed"""
+    operation: str
+    from_status: EscrowStatus
+    due_column: Any
+
+    @property
+    def to_status(self) -> EscrowStatus:
+        return EscrowStatus(ESCROW_TRANSITIONS[self.from_status.value][self.operation])
+
+
+SCHEDULED_TRANSITIONS = [
+    ScheduledTransition("expire", EscrowStatus.PENDING_AGREEMENT, EscrowTransaction.expiry_date),
+    ScheduledTransition("auto_release", EscrowStatus.INSPECTION_PERIOD, EscrowTransaction.inspection_end_date),
+]
+
+
+class SchedulerMetrics:
+    """Thread-safe per-job run counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+
+    def record_run(self, operation: str, processed: int, batches: int, seconds: float):
+        with self._lock:
+            job = self.jobs.setdefault(operation, {
+                "runs": 0, "processed": 0, "batches": 0, "total_seconds": 0.0, "last_run": None
+            })
+            job["runs"] += 1
+            job["processed"] += processed
+            job["batches"] += batches
+            job["total_seconds"] += seconds
+            job["last_run"] = {
+                "finished_at": datetime.utcnow().isoformat(),
+                "processed": processed,
+                "batches": batches,
+                "duration_ms": round(seconds * 1000, 3),
+                "rows_per_second": round(processed / seconds, 1) if seconds > 0 else 0.0
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                operation: {**job, "total_seconds": round(job["total_seconds"], 3)}
+                for operation, job in self.jobs.items()
+            }
+
+
+scheduler_metrics = SchedulerMetrics()
+
+
+async def apply_due_batch(
+    db: AsyncSession,
+    transition: ScheduledTransition,
+    now: datetime,
+    batch_size: int
+) -> int:
+    """
+    Claim up to batch_size due transactions, transition them with one UPDATE, write their
+    ledger postings and outbox events in bulk and commit. Returns the number of transactions moved.
+    """
+    claimed = (await db.execute(
+        select(
+            EscrowTransaction.id,
+            EscrowTransaction.transaction_id,
+            EscrowTransaction.buyer_id,
+            EscrowTransaction.seller_id,
+            EscrowTransaction.item_category,
+            EscrowTransaction.price,
+            EscrowTransaction.escrow_fee
+        )
+        .where(
+            EscrowTransaction.status == transition.from_status,
+            transition.due_column <= now
+        )
+        .order_by(transition.due_column)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if not claimed:
+        await db.rollback()
+        return 0
+
+    await db.execute(
+        update(EscrowTransaction)
+        .where(
+            EscrowTransaction.id.in_([row.id for row in claimed]),
+            EscrowTransaction.status == transition.from_status
+        )
+        .values(status=transition.to_status, version=EscrowTransaction.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+    # One stats delta per category instead of one per transaction
+    totals = defaultdict(lambda: [0, Decimal("0"), Decimal("0")])
+    for row in claimed:
+        total = totals[row.item_category]
+        total[0] += 1
+        total[1] += row.price
+        total[2] += row.escrow_fee
+    for category, (count, value, fees) in totals.items():
+        await apply_stats_delta(db, transition.from_status, category, -count, -value, -fees)
+        await apply_stats_delta(db, transition.to_status, category, count, value, fees)
+
+    # Automatically released transactions post their fee and release like approved ones
+    if transition.to_status in RELEASED_STATUSES:
+        await post_releases(db, [(row.id, row.escrow_fee) for row in claimed])
+
+    # Both parties are notified through the outbox (no actor for scheduled transitions)
+    await record_events(db, [
+        status_change_event(row, transition.operation, transition.from_status, transition.to_status, None)
+        for row in claimed
+    ])
+
+    await db.commit()
+    return len(claimed)
+
+
+async def run_transition(
+    transition: ScheduledTransition,
+    batch_size: Optional[int] = None,
+    max_batches: Optional[int] = None
+) -> int:
+    """Process due transactions for one transition in bounded batches"""
+    from shared.database import AsyncSessionLocal
+
+    batch_size = batch_size or settings.escrow_scheduler_batch_size
+    max_batches = max_batches or settings.escrow_scheduler_max_batches
+    now = datetime.utcnow()
+    processed = 0
+    batches = 0
+    started_at = time.perf_counter()
+
+    while batches < max_batches:
+        async with AsyncSessionLocal() as db:
+            moved = await apply_due_batch(db, transition, now, batch_size)
+        if not moved:
+            break
+        processed += moved
+        batches += 1
+        if moved < batch_size:
+            break
+
+    scheduler_metrics.record_run(transition.operation, processed, batches, time.perf_counter() - started_at)
+    if processed:
+        logger.info("ESCROW scheduler %s: %s transactions in %s batches", transition.operation, processed, batches)
+    return processed
+
+
+async def run_due_transitions() -> Dict[str, int]:
+    """Run every scheduled transition once"""
+    results = {}
+    for transition in SCHEDULED_TRANSITIONS:
+        try:
+            results[transition.operation] = await run_transition(transition)
+        except Exception:
+            logger.exception("ESCROW scheduler %s failed", transition.operation)
+            results[transition.operation] = 0
+    return results
+
+
+class EscrowScheduler:
+    """Runs the scheduled transitions periodically on the event loop"""
+
+    def __init__(self, interval_seconds: Optional[float] = None):
+        self.interval_seconds = interval_seconds or settings.escrow_scheduler_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_forever(self):
+        while True:
+            await run_due_transitions()
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": self.interval_seconds,
+            "jobs": scheduler_metrics.snapshot()
+        }
+
+
+escrow_scheduler = EscrowScheduler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ESCROW scheduler")
+    parser.add_argument("--once", action="store_true", help="Process due transactions once and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.once:
+        print(asyncio.run(run_due_transitions()))
+    else:
+        asyncio.run(escrow_scheduler.run_forever())
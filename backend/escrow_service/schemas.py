@@ -78,6 +78,7 @@ class EscrowTransactionResponse(BaseModel):
     
     # Status and dates
     status: EscrowStatus
+    version: int
     created_at: datetime
     agreement_date: Optional[datetime] = None
     payment_date: Optional[datetime] = None
@@ -97,9 +98,6 @@ class EscrowTransactionResponse(BaseModel):
     inspection_evidence: Dict[str, Any]
     documents: List[Dict[str, Any]]
     
-    # Communication
-    messages: List[Dict[str, Any]]
-    
     # Dispute
     dispute_info: Dict[str, Any]
     
@@ -107,6 +105,38 @@ class EscrowTransactionResponse(BaseModel):
         from_attributes = True
 
 
+class EscrowTransactionSummary(BaseModel):
+    """List view of a transaction; every field maps to a column selected directly"""
+    id: int
+    transaction_id: str
+    buyer_id: int
+    seller_id: int
+    item_title: str
+    item_category: ItemCategory
+    item_condition: ItemCondition
+    price: Decimal
+    currency: Currency
+    escrow_fee: Decimal
+    total_amount: Decimal
+    delivery_method: DeliveryMethod
+    inspection_period_days: int
+    status: EscrowStatus
+    version: int
+    created_at: datetime
+    agreement_date: Optional[datetime] = None
+    payment_date: Optional[datetime] = None
+    shipping_date: Optional[datetime] = None
+    delivery_date: Optional[datetime] = None
+    inspection_end_date: Optional[datetime] = None
+    completion_date: Optional[datetime] = None
+    expiry_date: Optional[datetime] = None
+
+
+class EscrowTransactionSearchResult(EscrowTransactionSummary):
+    """Search hit: the list view plus its relevance (higher is better)"""
+    rank: float
+
+
 class EscrowMessageCreate(BaseModel):
     message: str
     is_internal: bool = False
@@ -179,3 +209,71 @@ class EscrowStats(BaseModel):
     disputed_transactions: int
     status_breakdown: Dict[str, int]
     category_breakdown: Dict[str, int]
+
+
+class FeeQuoteItem(BaseModel):
+    price: Decimal
+    category: ItemCategory = ItemCategory.OTHER
+    currency: Currency = Currency.MXN
+
+    @validator('price')
+    def validate_price(cls, v):
+        if v <= 0:
+            raise ValueError('Price must be greater than 0')
+        return v
+
+
+class FeeQuoteRequest(BaseModel):
+    items: List[FeeQuoteItem]
+
+
+class FeeQuote(BaseModel):
+    price: Decimal
+    category: ItemCategory
+    currency: Currency
+    fee_percentage: Decimal
+    escrow_fee: Decimal
+    total_amount: Decimal
+
+
+class FeeQuoteResponse(BaseModel):
+    quotes: List[FeeQuote]
+
+
+class EscrowExportFilters(BaseModel):
+    """Rows selected by an export; created_to is exclusive"""
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    status: Optional[EscrowStatus] = None
+    currency: Optional[Currency] = None
+
+    @validator('created_to')
+    def validate_date_range(cls, v, values):
+        if v and values.get('created_from') and v <= values['created_from']:
+            raise ValueError('created_to must be after created_from')
+        return v
+
+
+class EscrowExportJobCreate(EscrowExportFilters):
+    format: str = "csv"
+
+    @validator('format')
+    def validate_format(cls, v):
+        if v not in ("csv", "ndjson"):
+            raise ValueError('Format must be csv or ndjson')
+        return v
+
+
+class EscrowExportJobResponse(BaseModel):
+    id: str
+    format: str
+    filters: Dict[str, Any]
+    status: str
+    row_count: Optional[int] = None
+    file_size: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
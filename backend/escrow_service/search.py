@@ -0,0 +1,213 @@
+"""
+ESCROW full-text search
+Ranked search over transaction_id, item_title and item_description.
+
+PostgreSQL: a search_vector tsvector column kept current by a trigger that only fires
+when one of the searched columns changes (status transitions do not touch it), with a
+GIN index. SQLite (local development): an external-content FTS5 table kept current
+by triggers.
+
+The DDL is idempotent and runs after create_all; existing PostgreSQL rows are filled in with
+    python -m escrow_service.search --rebuild
+"""
+from typing import Any, List, Sequence
+import argparse
+import logging
+import re
+
+from sqlalchemy import column, event, func, literal_column, select, table, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.config import settings
+from shared.database import Base
+from .models import EscrowTransaction
+
+logger = logging.getLogger(__name__)
+
+# Text search configuration: no stemming, so transaction ids and mixed-language titles match as typed
+SEARCH_CONFIG = "simple"
+MAX_SEARCH_TERMS = 10
+
+escrow_transactions_fts = table("escrow_transactions_fts", column("rowid"))
+
+SEARCH_VECTOR_SQL = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.transaction_id, '')), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.item_title, '')), 'B') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.item_description, '')), 'C')"
+)
+
+POSTGRES_DDL = [
+    "ALTER TABLE escrow_transactions ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    f"""
+    CREATE OR REPLACE FUNCTION escrow_transactions_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {SEARCH_VECTOR_SQL};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'escrow_transactions_search_vector_update') THEN
+            CREATE TRIGGER escrow_transactions_search_vector_update
+            BEFORE INSERT OR UPDATE OF transaction_id, item_title, item_description ON escrow_transactions
+            FOR EACH ROW EXECUTE FUNCTION escrow_transactions_search_vector();
+        END IF;
+    END
+    $$
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_escrow_search_vector ON escrow_transactions USING GIN (search_vector)",
+]
+
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS escrow_transactions_fts USING fts5(
+        transaction_id, item_title, item_description,
+        content='escrow_transactions', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS escrow_transactions_fts_insert AFTER INSERT ON escrow_transactions BEGIN
+        INSERT INTO escrow_transactions_fts(rowid, transaction_id, item_title, item_description)
+        VALUES (new.id, new.transaction_id, new.item_title, new.item_description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS escrow_transactions_fts_delete AFTER DELETE ON escrow_transactions BEGIN
+        INSERT INTO escrow_transactions_fts(escrow_transactions_fts, rowid, transaction_id, item_title, item_description)
+        VALUES ('delete', old.id, old.transaction_id, old.item_title, old.item_description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS escrow_transactions_fts_update
+    AFTER UPDATE OF transaction_id, item_title, item_description ON escrow_transactions BEGIN
+        INSERT INTO escrow_transactions_fts(escrow_transactions_fts, rowid, transaction_id, item_title, item_description)
+        VALUES ('delete', old.id, old.transaction_id, old.item_title, old.item_description);
+        INSERT INTO escrow_transactions_fts(rowid, transaction_id, item_title, item_description)
+        VALUES (new.id, new.transaction_id, new.item_title, new.item_description);
+    END
+    """,
+]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_search_index(target, connection, **kw):
+    """Install the search column/table and its triggers once the tables exist"""
+    if EscrowTransaction.__tablename__ not in target.tables:
+        return
+    statements = {"postgresql": POSTGRES_DDL, "sqlite": SQLITE_DDL}.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+def search_terms(query: str) -> List[str]:
+    """Word tokens of a user query (operators and punctuation are dropped)"""
+    return re.findall(r"\w+", query.lower())[:MAX_SEARCH_TERMS]
+
+
+def _postgres_candidates(terms: List[str], filters: Sequence[Any], max_candidates: int):
+    # All terms must match; the last one is a prefix so results show up while typing
+    tsquery = func.to_tsquery(
+        literal_column(f"'{SEARCH_CONFIG}'::regconfig"),
+        " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+    )
+    search_vector = literal_column("escrow_transactions.search_vector")
+    return (
+        select(EscrowTransaction.id, func.ts_rank_cd(search_vector, tsquery).label("rank"))
+        .where(search_vector.op("@@")(tsquery), *filters)
+        .limit(max_candidates)
+        .subquery()
+    )
+
+
+def _sqlite_candidates(terms: List[str], filters: Sequence[Any], max_candidates: int):
+    match = " ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+    # bm25() is lower for better matches; negate it so both backends rank descending
+    return (
+        select(
+            EscrowTransaction.id,
+            (-literal_column("bm25(escrow_transactions_fts, 10.0, 4.0, 1.0)")).label("rank")
+        )
+        .select_from(escrow_transactions_fts)
+        .join(EscrowTransaction, EscrowTransaction.id == escrow_transactions_fts.c.rowid)
+        .where(text("escrow_transactions_fts MATCH :match").bindparams(match=match), *filters)
+        .limit(max_candidates)
+        .subquery()
+    )
+
+
+async def search_transactions(
+    db: AsyncSession,
+    query: str,
+    columns: Sequence[Any],
+    filters: Sequence[Any] = (),
+    limit: int = 20,
+    offset: int = 0
+) -> List[Any]:
+    """
+    Rows of the given columns plus "rank" for transactions matching every query term,
+    best match first. Ranking is applied to at most escrow_search_max_candidates filtered
+    matches, which bounds the cost of very common terms.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    max_candidates = settings.escrow_search_max_candidates
+    if db.get_bind().dialect.name == "sqlite":
+        candidates = _sqlite_candidates(terms, filters, max_candidates)
+    else:
+        candidates = _postgres_candidates(terms, filters, max_candidates)
+
+    result = await db.execute(
+        select(*columns, candidates.c.rank)
+        .join(candidates, candidates.c.id == EscrowTransaction.id)
+        .order_by(candidates.c.rank.desc(), EscrowTransaction.id.desc())
+        .offset(offset)
+        .limit(limit)
+    )
+    return result.all()
+
+
+def rebuild_search_index(batch_size: int = 10000) -> int:
+    """Fill the search index for rows written before it existed; returns rows indexed"""
+    from shared.database import SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if engine.dialect.name == "sqlite":
+            db.execute(text("INSERT INTO escrow_transactions_fts(escrow_transactions_fts) VALUES ('rebuild')"))
+            db.commit()
+            return db.query(EscrowTransaction).count()
+
+        # Touching a searched column fires the trigger; batches keep transactions short
+        indexed = 0
+        while True:
+            ids = select(EscrowTransaction.id).where(
+                literal_column("escrow_transactions.search_vector").is_(None)
+            ).limit(batch_size).scalar_subquery()
+            result = db.execute(
+                update(EscrowTransaction)
+                .where(EscrowTransaction.id.in_(ids))
+                .values(item_title=EscrowTransaction.item_title)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            indexed += result.rowcount
+            logger.info("Indexed %s transactions", indexed)
+            if result.rowcount < batch_size:
+                return indexed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the ESCROW search index")
+    parser.add_argument("--rebuild", action="store_true", help="Index rows written before the index existed")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.rebuild:
+        print(rebuild_search_index(args.batch_size))
+    else:
+        parser.print_help()
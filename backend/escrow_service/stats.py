@@ -0,0 +1,212 @@
+"""
+ESCROW statistics
+Running totals per (status, category) kept in escrow_stats_summary, so GET /stats
+reads a few dozen rows no matter how many transactions exist.
+
+Run the reconciliation job with:
+    python -m escrow_service.stats [--once]
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.config import settings
+from .models import EscrowTransaction, EscrowStatsSummary, EscrowStatus, ItemCategory
+from .schemas import EscrowStats
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = {
+    EscrowStatus.PENDING_AGREEMENT,
+    EscrowStatus.PENDING_PAYMENT,
+    EscrowStatus.PAYMENT_RECEIVED,
+    EscrowStatus.ITEM_SHIPPED,
+    EscrowStatus.ITEM_DELIVERED,
+    EscrowStatus.INSPECTION_PERIOD,
+    EscrowStatus.BUYER_APPROVED,
+    EscrowStatus.SELLER_APPROVED,
+}
+COMPLETED_STATUSES = {EscrowStatus.FUNDS_RELEASED, EscrowStatus.TRANSACTION_COMPLETED}
+
+UPSERT_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+
+async def apply_stats_delta(
+    db: AsyncSession,
+    status: EscrowStatus,
+    category: ItemCategory,
+    count: int,
+    value: Decimal,
+    fees: Decimal
+):
+    """Add a delta to one summary row with a single atomic upsert (joins the caller's transaction)"""
+    dialect = db.get_bind().dialect.name
+    insert = UPSERT_INSERTS.get(dialect)
+    now = datetime.utcnow()
+
+    if insert is not None:
+        statement = insert(EscrowStatsSummary).values(
+            status=status,
+            item_category=category,
+            transaction_count=count,
+            total_value=value,
+            total_fees=fees,
+            updated_at=now
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[EscrowStatsSummary.status, EscrowStatsSummary.item_category],
+            set_={
+                "transaction_count": EscrowStatsSummary.transaction_count + statement.excluded.transaction_count,
+                "total_value": EscrowStatsSummary.total_value + statement.excluded.total_value,
+                "total_fees": EscrowStatsSummary.total_fees + statement.excluded.total_fees,
+                "updated_at": statement.excluded.updated_at
+            }
+        )
+        await db.execute(statement)
+        return
+
+    # Generic fallback: update, and create the row the first time this pair is seen
+    result = await db.execute(
+        update(EscrowStatsSummary)
+        .where(EscrowStatsSummary.status == status, EscrowStatsSummary.item_category == category)
+        .values(
+            transaction_count=EscrowStatsSummary.transaction_count + count,
+            total_value=EscrowStatsSummary.total_value + value,
+            total_fees=EscrowStatsSummary.total_fees + fees,
+            updated_at=now
+        )
+    )
+    if result.rowcount == 0:
+        db.add(EscrowStatsSummary(
+            status=status, item_category=category, transaction_count=count,
+            total_value=value, total_fees=fees, updated_at=now
+        ))
+
+
+async def record_transaction_created(db: AsyncSession, transaction: EscrowTransaction):
+    """Count a new transaction in its initial status"""
+    await apply_stats_delta(
+        db, transaction.status, transaction.item_category,
+        1, transaction.price, transaction.escrow_fee
+    )
+
+
+async def record_status_change(
+    db: AsyncSession,
+    transaction: EscrowTransaction,
+    from_status: EscrowStatus,
+    to_status: Optional[EscrowStatus] = None
+):
+    """Move a transaction's totals from one status bucket to another"""
+    to_status = to_status or transaction.status
+    if from_status == to_status:
+        return
+    await apply_stats_delta(
+        db, from_status, transaction.item_category,
+        -1, -transaction.price, -transaction.escrow_fee
+    )
+    await apply_stats_delta(
+        db, to_status, transaction.item_category,
+        1, transaction.price, transaction.escrow_fee
+    )
+
+
+async def get_stats(db: AsyncSession) -> EscrowStats:
+    """Build the dashboard statistics from the summary rows"""
+    result = await db.execute(select(EscrowStatsSummary))
+    rows = result.scalars().all()
+
+    status_breakdown = {}
+    category_breakdown = {}
+    total_value = Decimal("0")
+    total_fees = Decimal("0")
+    for row in rows:
+        if not row.transaction_count:
+            continue
+        status_breakdown[row.status.value] = status_breakdown.get(row.status.value, 0) + row.transaction_count
+        category_breakdown[row.item_category.value] = (
+            category_breakdown.get(row.item_category.value, 0) + row.transaction_count
+        )
+        total_value += Decimal(row.total_value or 0)
+        total_fees += Decimal(row.total_fees or 0)
+
+    def count_in(statuses):
+        return sum(count for status, count in status_breakdown.items() if EscrowStatus(status) in statuses)
+
+    return EscrowStats(
+        total_transactions=sum(status_breakdown.values()),
+        total_value=total_value,
+        total_fees=total_fees,
+        active_transactions=count_in(ACTIVE_STATUSES),
+        completed_transactions=count_in(COMPLETED_STATUSES),
+        disputed_transactions=status_breakdown.get(EscrowStatus.DISPUTED.value, 0),
+        status_breakdown=status_breakdown,
+        category_breakdown=category_breakdown
+    )
+
+
+async def reconcile_stats(db: AsyncSession) -> int:
+    """
+    Recompute the summary from escrow_transactions in one GROUP BY pass and replace it.
+    Returns the number of summary rows written.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # Blocks concurrent deltas until the rebuilt totals are committed
+        await db.execute(text("LOCK TABLE escrow_stats_summary IN EXCLUSIVE MODE"))
+
+    result = await db.execute(
+        select(
+            EscrowTransaction.status,
+            EscrowTransaction.item_category,
+            func.count(EscrowTransaction.id),
+            func.coalesce(func.sum(EscrowTransaction.price), 0),
+            func.coalesce(func.sum(EscrowTransaction.escrow_fee), 0)
+        ).group_by(EscrowTransaction.status, EscrowTransaction.item_category)
+    )
+    groups = result.all()
+    now = datetime.utcnow()
+
+    await db.execute(delete(EscrowStatsSummary))
+    db.add_all([
+        EscrowStatsSummary(
+            status=status, item_category=category, transaction_count=count,
+            total_value=value, total_fees=fees, updated_at=now
+        )
+        for status, category, count, value, fees in groups
+    ])
+    await db.commit()
+    return len(groups)
+
+
+async def run_reconciliation(interval_seconds: Optional[int] = None, once: bool = False):
+    """Reconcile the summary table now and then every interval_seconds"""
+    from shared.database import AsyncSessionLocal
+
+    interval_seconds = interval_seconds or settings.escrow_stats_reconcile_interval_seconds
+    while True:
+        async with AsyncSessionLocal() as db:
+            started_at = asyncio.get_running_loop().time()
+            rows = await reconcile_stats(db)
+            elapsed = asyncio.get_running_loop().time() - started_at
+            logger.info("Reconciled escrow stats: %s summary rows in %.3fs", rows, elapsed)
+        if once:
+            return
+        await asyncio.sleep(interval_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile ESCROW statistics")
+    parser.add_argument("--once", action="store_true", help="Reconcile once and exit")
+    parser.add_argument("--interval", type=int, default=None, help="Seconds between runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_reconciliation(args.interval, args.once))
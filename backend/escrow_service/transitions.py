@@ -0,0 +1,174 @@
+"""
+ESCROW state transition engine
+Each transition is one conditional UPDATE guarded by the current status, the acting
+party and (optionally) the version the client last saw, so concurrent requests cannot
+both apply the same transition. Each applied transition also writes its outbox event.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import DateTime, String, cast, func, literal, literal_column, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.audit_middleware import ESCROW_TRANSITIONS
+from .models import EscrowTransaction, EscrowStatus
+from .outbox import STATUS_CHANGED, record_event, transaction_payload
+from .stats import record_status_change
+
+# Parties allowed to perform each operation
+OPERATION_ACTORS = {
+    "accept": ("seller_id",),
+    "pay": ("buyer_id",),
+    "ship": ("seller_id",),
+    "deliver": ("buyer_id",),
+    "approve": ("buyer_id",),
+    "seller_approve": ("seller_id",),
+    "dispute": ("buyer_id", "seller_id"),
+}
+
+# Columns returned by a transition (enough for stats, messages, events and follow-up updates)
+RETURNED_COLUMNS = [
+    EscrowTransaction.id,
+    EscrowTransaction.transaction_id,
+    EscrowTransaction.status,
+    EscrowTransaction.version,
+    EscrowTransaction.buyer_id,
+    EscrowTransaction.seller_id,
+    EscrowTransaction.item_category,
+    EscrowTransaction.price,
+    EscrowTransaction.escrow_fee,
+    EscrowTransaction.inspection_period_days,
+]
+
+
+def transition_sources(operation: str) -> List[EscrowStatus]:
+    """Statuses from which an operation is allowed"""
+    return [
+        EscrowStatus(from_status)
+        for from_status, operations in ESCROW_TRANSITIONS.items()
+        if operation in operations
+    ]
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Read the expected version from an If-Match header ("3", "\"3\"" or W/"3")"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="If-Match must be a transaction version"
+        )
+
+
+def days_after(db: AsyncSession, moment: datetime, days_column):
+    """SQL for moment plus a row's number of days, so a transition's UPDATE can compute it"""
+    start = literal(moment, DateTime())
+    if db.get_bind().dialect.name == "sqlite":
+        return func.datetime(start, "+" + cast(days_column, String) + " days")
+    return start + days_column * literal_column("INTERVAL '1 day'")
+
+
+async def apply_transition(
+    db: AsyncSession,
+    transaction_id: int,
+    operation: str,
+    actor_id: int,
+    expected_version: Optional[int] = None,
+    values: Optional[Dict[str, Any]] = None,
+    event_details: Optional[Dict[str, Any]] = None
+):
+    """
+    Apply an ESCROW operation with a compare-and-swap UPDATE.
+    Returns the updated row; raises 404/403/409 when the guard does not match.
+    event_details are added to the status change event's payload.
+    Runs in the caller's DB transaction, which must be committed by the caller.
+    """
+    actor_condition = or_(*(getattr(EscrowTransaction, field) == actor_id for field in OPERATION_ACTORS[operation]))
+    supports_returning = db.get_bind().dialect.update_returning
+
+    for from_status in transition_sources(operation):
+        to_status = EscrowStatus(ESCROW_TRANSITIONS[from_status.value][operation])
+        conditions = [
+            EscrowTransaction.id == transaction_id,
+            EscrowTransaction.status == from_status,
+            actor_condition,
+        ]
+        if expected_version is not None:
+            conditions.append(EscrowTransaction.version == expected_version)
+
+        statement = (
+            update(EscrowTransaction)
+            .where(*conditions)
+            .values(status=to_status, version=EscrowTransaction.version + 1, **(values or {}))
+            .execution_options(synchronize_session=False)
+        )
+        if supports_returning:
+            row = (await db.execute(statement.returning(*RETURNED_COLUMNS))).first()
+        else:
+            result = await db.execute(statement)
+            row = None
+            if result.rowcount:
+                row = (await db.execute(
+                    select(*RETURNED_COLUMNS).where(EscrowTransaction.id == transaction_id)
+                )).first()
+
+        if row is not None:
+            await record_status_change(db, row, from_status, to_status)
+            record_event(db, row, STATUS_CHANGED, transaction_payload(
+                row, operation=operation, from_status=from_status, to_status=to_status, actor_id=actor_id,
+                **(event_details or {})
+            ))
+            return row
+
+    await _raise_transition_error(db, transaction_id, operation, actor_id, expected_version)
+
+
+async def _raise_transition_error(
+    db: AsyncSession,
+    transaction_id: int,
+    operation: str,
+    actor_id: int,
+    expected_version: Optional[int]
+):
+    """Explain why a transition's guard did not match (only runs on the failure path)"""
+    current = (await db.execute(
+        select(
+            EscrowTransaction.status,
+            EscrowTransaction.version,
+            EscrowTransaction.buyer_id,
+            EscrowTransaction.seller_id
+        ).where(EscrowTransaction.id == transaction_id)
+    )).first()
+
+    if current is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Transaction not found"
+        )
+
+    actor_fields = OPERATION_ACTORS[operation]
+    if all(getattr(current, field) != actor_id for field in actor_fields):
+        party = " or ".join("seller" if field == "seller_id" else "buyer" for field in actor_fields)
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Only {party} can perform '{operation}' on this transaction"
+        )
+
+    if expected_version is not None and current.version != expected_version:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Transaction was modified (current version {current.version})"
+        )
+
+    current_status = current.status.value if hasattr(current.status, "value") else current.status
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Operation '{operation}' not allowed for status '{current_status}'"
+    )
@@ -162,6 +162,20 @@ CREATE TABLE IF NOT EXISTS notifications (
     read_at TIMESTAMP WITH TIME ZONE
 );
 
+-- Create idempotency_keys table (stored responses for retried requests)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(64) PRIMARY KEY,
+    fingerprint VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+    
+    response_status INTEGER,
+    response_headers JSONB,
+    response_body TEXT,
+    
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
 -- Create escrow_transactions table
 CREATE TABLE IF NOT EXISTS escrow_transactions (
     id SERIAL PRIMARY KEY,
@@ -192,6 +206,10 @@ CREATE TABLE IF NOT EXISTS escrow_transactions (
     
     -- Transaction status
     status escrow_status DEFAULT 'pending_agreement' NOT NULL,
+    version INTEGER DEFAULT 1 NOT NULL,
+    
+    -- Full-text search document (transaction_id, item_title, item_description), set by trigger
+    search_vector TSVECTOR,
     
     -- Important dates
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -263,6 +281,172 @@ CREATE TABLE IF NOT EXISTS escrow_disputes (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Create escrow_stats_summary table (running totals per status and category for GET /stats)
+CREATE TABLE IF NOT EXISTS escrow_stats_summary (
+    status escrow_status NOT NULL,
+    item_category item_category NOT NULL,
+    
+    transaction_count BIGINT NOT NULL DEFAULT 0,
+    total_value DECIMAL(18,2) NOT NULL DEFAULT 0,
+    total_fees DECIMAL(18,2) NOT NULL DEFAULT 0,
+    
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (status, item_category)
+);
+
+-- Create escrow_id_worker_leases table (worker ids of processes issuing transaction ids)
+CREATE TABLE IF NOT EXISTS escrow_id_worker_leases (
+    worker_id INTEGER PRIMARY KEY,
+    owner VARCHAR(100) NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Create custody ledger tables (append-only double-entry journals and per-account balance snapshots)
+CREATE TABLE IF NOT EXISTS ledger_journals (
+    id SERIAL PRIMARY KEY,
+    reference VARCHAR(255) UNIQUE NOT NULL,
+    kind VARCHAR(20) NOT NULL,
+    currency VARCHAR(3) NOT NULL,
+    escrow_transaction_id INTEGER REFERENCES escrow_transactions(id),
+    payment_intent_id VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    id SERIAL PRIMARY KEY,
+    journal_id INTEGER NOT NULL REFERENCES ledger_journals(id),
+    account VARCHAR(40) NOT NULL,
+    currency VARCHAR(3) NOT NULL,
+    amount DECIMAL(15,2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ledger_balance_snapshots (
+    id SERIAL PRIMARY KEY,
+    account VARCHAR(40) NOT NULL,
+    currency VARCHAR(3) NOT NULL,
+    balance DECIMAL(18,2) NOT NULL,
+    last_entry_id INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    CONSTRAINT uq_ledger_snapshots_account_currency UNIQUE (account, currency)
+);
+
+-- Create escrow_export_jobs table (background transaction exports written as gzip chunks)
+CREATE TABLE IF NOT EXISTS escrow_export_jobs (
+    id VARCHAR(36) PRIMARY KEY,
+    requested_by_id INTEGER NOT NULL REFERENCES users(id),
+    
+    format VARCHAR(10) NOT NULL,
+    filters JSONB DEFAULT '{}',
+    
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    row_count BIGINT,
+    file_size BIGINT,
+    error TEXT,
+    
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    completed_at TIMESTAMP WITH TIME ZONE
+);
+
+ALTER TABLE escrow_export_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE;
+
+-- Create escrow_export_chunks table (export files, so any replica can serve the download)
+CREATE TABLE IF NOT EXISTS escrow_export_chunks (
+    job_id VARCHAR(36) NOT NULL REFERENCES escrow_export_jobs(id) ON DELETE CASCADE,
+    sequence INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (job_id, sequence)
+);
+
+-- Create escrow_outbox table (domain events written with each transition, drained by the dispatcher)
+CREATE TABLE IF NOT EXISTS escrow_outbox (
+    id SERIAL PRIMARY KEY,
+    transaction_id INTEGER NOT NULL REFERENCES escrow_transactions(id),
+    
+    event_type VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    delivered_sinks JSONB DEFAULT '[]',
+    last_error TEXT,
+    available_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    dispatched_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Create payment_webhook_events table (verified processor webhooks, applied by the webhook worker)
+CREATE TABLE IF NOT EXISTS payment_webhook_events (
+    id SERIAL PRIMARY KEY,
+    event_id VARCHAR(255) UNIQUE NOT NULL,
+    event_type VARCHAR(100) NOT NULL,
+    object_id VARCHAR(255),
+    payload JSONB NOT NULL,
+    event_created INTEGER NOT NULL,
+    
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result VARCHAR(100),
+    last_error TEXT,
+    available_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    processed_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Create payments table (local record of every processor operation, served as payment history)
+CREATE TABLE IF NOT EXISTS payments (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    performed_by_id INTEGER REFERENCES users(id),
+    escrow_transaction_id INTEGER REFERENCES escrow_transactions(id),
+    
+    operation VARCHAR(20) NOT NULL,
+    payment_intent_id VARCHAR(255) NOT NULL,
+    processor_object_id VARCHAR(255) NOT NULL,
+    status VARCHAR(30) NOT NULL,
+    amount DECIMAL(15,2) NOT NULL,
+    currency VARCHAR(3) NOT NULL,
+    reason VARCHAR(100),
+    
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Create payout run tables (checkpointed batch captures of approved ESCROW transactions)
+CREATE TABLE IF NOT EXISTS payout_runs (
+    id SERIAL PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    started_by_id INTEGER REFERENCES users(id),
+    rate_per_second DECIMAL(10,2) NOT NULL,
+    concurrency INTEGER NOT NULL,
+    
+    total_items INTEGER NOT NULL DEFAULT 0,
+    captured INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    captured_amount DECIMAL(15,2) NOT NULL DEFAULT 0,
+    resumes INTEGER NOT NULL DEFAULT 0,
+    report JSONB,
+    
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE TABLE IF NOT EXISTS payout_run_items (
+    id SERIAL PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES payout_runs(id),
+    escrow_transaction_id INTEGER NOT NULL REFERENCES escrow_transactions(id),
+    payment_intent_id VARCHAR(255) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    amount DECIMAL(15,2),
+    error TEXT,
+    captured_at TIMESTAMP WITH TIME ZONE,
+    CONSTRAINT uq_payout_run_items_run_escrow UNIQUE (run_id, escrow_transaction_id)
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone);
@@ -280,19 +464,62 @@ CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications(user_id);
 CREATE INDEX IF NOT EXISTS idx_notifications_type ON notifications(notification_type);
 CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(is_read);
 
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
+
 CREATE INDEX IF NOT EXISTS idx_escrow_transaction_id ON escrow_transactions(transaction_id);
 CREATE INDEX IF NOT EXISTS idx_escrow_buyer_id ON escrow_transactions(buyer_id);
 CREATE INDEX IF NOT EXISTS idx_escrow_seller_id ON escrow_transactions(seller_id);
 CREATE INDEX IF NOT EXISTS idx_escrow_status ON escrow_transactions(status);
 CREATE INDEX IF NOT EXISTS idx_escrow_category ON escrow_transactions(item_category);
 CREATE INDEX IF NOT EXISTS idx_escrow_created_at ON escrow_transactions(created_at);
+CREATE INDEX IF NOT EXISTS idx_escrow_buyer_created ON escrow_transactions(buyer_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_escrow_seller_created ON escrow_transactions(seller_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_escrow_status_expiry ON escrow_transactions(status, expiry_date);
+CREATE INDEX IF NOT EXISTS idx_escrow_status_inspection_end ON escrow_transactions(status, inspection_end_date);
+CREATE INDEX IF NOT EXISTS idx_escrow_payment_transaction_id ON escrow_transactions(payment_transaction_id);
+CREATE INDEX IF NOT EXISTS idx_escrow_search_vector ON escrow_transactions USING GIN (search_vector);
 
 CREATE INDEX IF NOT EXISTS idx_escrow_messages_transaction_id ON escrow_messages(transaction_id);
+CREATE INDEX IF NOT EXISTS idx_escrow_messages_transaction_created ON escrow_messages(transaction_id, created_at, id);
 CREATE INDEX IF NOT EXISTS idx_escrow_messages_sender_id ON escrow_messages(sender_id);
 
 CREATE INDEX IF NOT EXISTS idx_escrow_disputes_transaction_id ON escrow_disputes(transaction_id);
 CREATE INDEX IF NOT EXISTS idx_escrow_disputes_status ON escrow_disputes(status);
 
+CREATE INDEX IF NOT EXISTS idx_escrow_outbox_status_available ON escrow_outbox(status, available_at, id);
+CREATE INDEX IF NOT EXISTS idx_escrow_outbox_transaction ON escrow_outbox(transaction_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_ledger_journals_escrow_transaction_id ON ledger_journals(escrow_transaction_id);
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_account_currency_id ON ledger_entries(account, currency, id);
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_journal_id ON ledger_entries(journal_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_payment_webhook_status_available ON payment_webhook_events(status, available_at, event_created, id);
+CREATE INDEX IF NOT EXISTS idx_payment_webhook_object_id ON payment_webhook_events(object_id);
+
+CREATE INDEX IF NOT EXISTS idx_payments_user_created ON payments(user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_payments_user_status_created ON payments(user_id, status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_payments_escrow_created ON payments(escrow_transaction_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_payments_payment_intent_id ON payments(payment_intent_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_payout_runs_running ON payout_runs(status) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_payout_run_items_run_status ON payout_run_items(run_id, status);
+
+-- Keep escrow_transactions.search_vector current; only fires when a searched column changes
+CREATE OR REPLACE FUNCTION escrow_transactions_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.transaction_id, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.item_title, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.item_description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS escrow_transactions_search_vector_update ON escrow_transactions;
+CREATE TRIGGER escrow_transactions_search_vector_update
+    BEFORE INSERT OR UPDATE OF transaction_id, item_title, item_description ON escrow_transactions
+    FOR EACH ROW EXECUTE FUNCTION escrow_transactions_search_vector();
+
 -- Insert sample admin user
 INSERT INTO users (
     email, first_name, last_name, hashed_password, role, status,
@@ -384,19 +611,40 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Create a trigger to auto-calculate total amount
+-- Create a trigger to fill in fees for rows inserted without them
+-- (the ESCROW service computes fees from its fee schedule; those are kept as given)
 CREATE OR REPLACE FUNCTION set_total_amount()
 RETURNS TRIGGER AS $$
 BEGIN
-    NEW.escrow_fee := calculate_escrow_fee(NEW.price);
-    NEW.total_amount := NEW.price + NEW.escrow_fee;
+    IF NEW.escrow_fee IS NULL THEN
+        NEW.escrow_fee := calculate_escrow_fee(NEW.price);
+    END IF;
+    IF NEW.total_amount IS NULL THEN
+        NEW.total_amount := NEW.price + NEW.escrow_fee;
+    END IF;
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER set_escrow_total_amount BEFORE INSERT OR UPDATE ON escrow_transactions
+-- (replaces the BEFORE INSERT OR UPDATE trigger of existing databases)
+DROP TRIGGER IF EXISTS set_escrow_total_amount ON escrow_transactions;
+CREATE TRIGGER set_escrow_total_amount BEFORE INSERT ON escrow_transactions
     FOR EACH ROW EXECUTE FUNCTION set_total_amount();
 
+-- Keep the custody ledger append-only (corrections are posted as new journals)
+CREATE OR REPLACE FUNCTION reject_ledger_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION '% is append-only', TG_TABLE_NAME;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER ledger_journals_append_only BEFORE UPDATE OR DELETE ON ledger_journals
+    FOR EACH ROW EXECUTE FUNCTION reject_ledger_change();
+
+CREATE TRIGGER ledger_entries_append_only BEFORE UPDATE OR DELETE ON ledger_entries
+    FOR EACH ROW EXECUTE FUNCTION reject_ledger_change();
+
 -- Grant permissions
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA public TO fintech_user;
 GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA public TO fintech_user;
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Script para migrar los mensajes guardados en escrow_transactions.messages (JSON)
+a la tabla escrow_messages
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shared.database import SessionLocal, init_db
+from escrow_service.models import EscrowTransaction, EscrowMessage
+from datetime import datetime
+
+BATCH_SIZE = 500
+
+
+def parse_timestamp(value):
+    """Convierte el timestamp ISO del mensaje legado"""
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def migrate_escrow_messages():
+    """Copia los mensajes JSON a escrow_messages y vacía la columna legada"""
+    init_db()
+    db = SessionLocal()
+    migrated = 0
+    last_id = 0
+
+    try:
+        while True:
+            transactions = (
+                db.query(EscrowTransaction)
+                .filter(EscrowTransaction.id > last_id)
+                .order_by(EscrowTransaction.id)
+                .limit(BATCH_SIZE)
+                .all()
+            )
+            if not transactions:
+                break
+
+            for transaction in transactions:
+                for legacy in transaction.messages or []:
+                    db.add(EscrowMessage(
+                        transaction_id=transaction.id,
+                        sender_id=legacy.get("sender_id"),
+                        message=legacy.get("message", ""),
+                        is_internal=bool(legacy.get("is_internal", False)),
+                        attachments=legacy.get("attachments") or [],
+                        created_at=parse_timestamp(legacy.get("timestamp")) or transaction.created_at
+                    ))
+                    migrated += 1
+                if transaction.messages:
+                    transaction.messages = []
+
+            # Un commit por lote: cada lote se migra completo o no se migra
+            db.commit()
+            last_id = transactions[-1].id
+
+        print(f"✅ {migrated} mensajes migrados a escrow_messages")
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error al migrar mensajes: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print("Migrando mensajes de transacciones ESCROW...")
+    migrate_escrow_messages()
@@ -2,8 +2,10 @@
 Notification Microservice
 Handles email, SMS, push notifications, and real-time communication
 """
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import List, Dict, Any, Optional
@@ -16,7 +18,8 @@ from sendgrid.helpers.mail import Mail
 import firebase_admin
 from firebase_admin import credentials, messaging
 
-from shared.database import get_db, init_db
+from shared.database import get_db, get_read_db, init_db, get_pool_metrics
+from shared.etag import etag_cache, etag_matches, not_modified, set_etag
 from shared.models import User, Notification
 from shared.auth import get_current_user, require_roles, UserRole
 from shared.schemas import SuccessResponse, ErrorResponse
@@ -35,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # Initialize external services
@@ -88,7 +92,7 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 
-class NotificationCreate:
+class NotificationCreate(BaseModel):
     user_id: int
     title: str
     message: str
@@ -96,14 +100,14 @@ class NotificationCreate:
     metadata: Optional[Dict[str, Any]] = None
 
 
-class EmailNotification:
+class EmailNotification(BaseModel):
     to: str
     subject: str
     html_content: str
     template_id: Optional[str] = None
 
 
-class SMSNotification:
+class SMSNotification(BaseModel):
     to: str
     message: str
 
@@ -176,14 +180,30 @@ async def create_notification(
 
 @app.get("/notifications")
 async def get_notifications(
+    response: Response,
     page: int = 1,
     limit: int = 10,
     unread_only: bool = False,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get user's notifications"""
+    """Get user's notifications (supports If-None-Match)"""
     try:
+        # New, deleted and newly read notifications all change this aggregate
+        state = db.query(
+            func.count(Notification.id),
+            func.max(Notification.id),
+            func.max(Notification.read_at)
+        ).filter(Notification.user_id == current_user.id).one()
+        etag = etag_cache.etag(
+            f"notifications:{current_user.id}:{page}:{limit}:{unread_only}",
+            tuple(state)
+        )
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+        
         query = db.query(Notification).filter(Notification.user_id == current_user.id)
         
         if unread_only:
@@ -405,7 +425,12 @@ async def send_push_notification(user_id: int, title: str, body: str):
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "notification-service"}
+    return {
+        "status": "healthy",
+        "service": "notification-service",
+        "db_pool": get_pool_metrics(),
+        "etag_cache": etag_cache.stats()
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+"""
+Local fake payment processor
+Implements the Stripe endpoints the payment service uses (payment intents and refunds)
+in memory, with configurable latency, failure rate and rate limit, so the gateway can
+be exercised and benchmarked offline:
+    python -m payment_service.fake_processor --port 12111 --latency-ms 150 --failure-rate 0.05 --rate-limit 25
+    STRIPE_API_BASE=http://localhost:12111 uvicorn main:app --port 8003
+Honours Idempotency-Key like Stripe: a repeated POST returns the stored response.
+"""
+from typing import Any, Dict, Optional, Tuple
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def _id(prefix: str) -> str:
+    return f"{prefix}_{secrets.token_hex(12)}"
+
+
+def _error(status_code: int, message: str, code: Optional[str] = None, retry: Optional[bool] = None) -> JSONResponse:
+    headers = {"Stripe-Should-Retry": "true" if retry else "false"} if retry is not None else None
+    return JSONResponse(
+        {"error": {"type": "invalid_request_error", "message": message, "code": code}},
+        status_code=status_code,
+        headers=headers
+    )
+
+
+def _unflatten(form) -> Dict[str, Any]:
+    """metadata[user_id]=1 -> {"metadata": {"user_id": "1"}} (one level, like the gateway sends)"""
+    data: Dict[str, Any] = {}
+    for key, value in form.multi_items():
+        if "[" in key:
+            name, sub = key[:-1].split("[", 1)
+            data.setdefault(name, {})[sub] = value
+        else:
+            data[key] = value
+    return data
+
+
+def create_app(latency_ms: float = 0, failure_rate: float = 0.0, rate_limit: int = 0) -> FastAPI:
+    app = FastAPI(title="Fake payment processor")
+    app.state.latency_ms = latency_ms
+    app.state.failure_rate = failure_rate
+    # Requests per second per API key, like Stripe's quota; 0 disables it
+    app.state.rate_limit = rate_limit
+    app.state.rate_limited = 0
+    window = {"second": 0, "requests": 0}
+    intents: Dict[str, Dict[str, Any]] = {}
+    idempotent: Dict[Tuple[str, str], Tuple[int, Any]] = {}
+
+    @app.middleware("http")
+    async def simulate_network(request: Request, call_next):
+        if app.state.rate_limit:
+            second = int(time.monotonic())
+            if window["second"] != second:
+                window["second"], window["requests"] = second, 0
+            window["requests"] += 1
+            if window["requests"] > app.state.rate_limit:
+                app.state.rate_limited += 1
+                return _error(429, "Too many requests hit the API too quickly", code="rate_limit")
+        if app.state.latency_ms:
+            await asyncio.sleep(app.state.latency_ms / 1000)
+        if app.state.failure_rate and random.random() < app.state.failure_rate:
+            return _error(503, "Simulated processor outage", retry=True)
+
+        key = request.headers.get("Idempotency-Key")
+        if request.method != "POST" or not key:
+            return await call_next(request)
+        stored = idempotent.get((request.url.path, key))
+        if stored is not None:
+            return JSONResponse(stored[1], status_code=stored[0], headers={"Idempotent-Replayed": "true"})
+        response = await call_next(request)
+        body = json.loads(b"".join([chunk async for chunk in response.body_iterator]))
+        idempotent[(request.url.path, key)] = (response.status_code, body)
+        return JSONResponse(body, status_code=response.status_code)
+
+    @app.post("/v1/payment_intents")
+    async def create_payment_intent(request: Request):
+        data = _unflatten(await request.form())
+        if not data.get("amount", "").isdigit() or int(data["amount"]) <= 0:
+            return _error(400, "Invalid positive integer", code="parameter_invalid_integer")
+        intent_id = _id("pi")
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(data["amount"]),
+            "amount_received": 0,
+            "currency": data.get("currency", "usd"),
+            "capture_method": data.get("capture_method", "automatic"),
+            "client_secret": f"{intent_id}_secret_{secrets.token_hex(8)}",
+            "metadata": data.get("metadata", {}),
+            "payment_method_types": list(data.get("payment_method_types", {"0": "card"}).values()),
+            "status": "requires_confirmation",
+        }
+        intents[intent_id] = intent
+        return intent
+
+    @app.get("/v1/payment_intents/{intent_id}")
+    async def retrieve_payment_intent(intent_id: str):
+        if intent_id not in intents:
+            return _error(404, f"No such payment_intent: '{intent_id}'", code="resource_missing")
+        return intents[intent_id]
+
+    @app.post("/v1/payment_intents/{intent_id}/confirm")
+    async def confirm_payment_intent(intent_id: str):
+        intent = intents.get(intent_id)
+        if intent is None:
+            return _error(404, f"No such payment_intent: '{intent_id}'", code="resource_missing")
+        if intent["status"] != "requires_confirmation":
+            return _error(400, f"PaymentIntent status is {intent['status']}", code="payment_intent_unexpected_state")
+        intent["status"] = "requires_capture" if intent["capture_method"] == "manual" else "succeeded"
+        return intent
+
+    @app.post("/v1/payment_intents/{intent_id}/capture")
+    async def capture_payment_intent(intent_id: str):
+        intent = intents.get(intent_id)
+        if intent is None:
+            return _error(404, f"No such payment_intent: '{intent_id}'", code="resource_missing")
+        if intent["status"] != "requires_capture":
+            return _error(400, f"PaymentIntent status is {intent['status']}", code="payment_intent_unexpected_state")
+        intent["status"] = "succeeded"
+        intent["amount_received"] = intent["amount"]
+        return intent
+
+    @app.post("/v1/refunds")
+    async def create_refund(request: Request):
+        data = _unflatten(await request.form())
+        intent = intents.get(data.get("payment_intent", ""))
+        if intent is None:
+            return _error(404, "No such payment_intent", code="resource_missing")
+        if intent["status"] != "succeeded":
+            return _error(400, "PaymentIntent has not been captured", code="charge_not_captured")
+        amount = int(data.get("amount") or intent["amount_received"])
+        if amount > intent["amount_received"]:
+            return _error(400, "Refund amount is greater than the captured amount", code="amount_too_large")
+        return {
+            "id": _id("re"),
+            "object": "refund",
+            "amount": amount,
+            "currency": intent["currency"],
+            "payment_intent": intent["id"],
+            "reason": data.get("reason"),
+            "status": "succeeded",
+        }
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the fake payment processor")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=0, help="Requests per second (0: unlimited)")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.latency_ms, args.failure_rate, args.rate_limit), host=args.host, port=args.port)
@@ -0,0 +1,232 @@
+"""
+Async payment gateway for the Stripe REST API
+One pooled keep-alive HTTP client per process, per-call timeouts, a bound on calls in
+flight to the processor, and retries with full jitter for network errors, 429 and 5xx
+responses. Every POST carries an idempotency key (the caller's or a generated one that
+is reused across retries), so retrying a write never charges or refunds twice.
+
+STRIPE_API_BASE can point at the local fake processor for offline benchmarks:
+    python -m payment_service.fake_processor --port 12111
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import random
+import uuid
+
+import httpx
+
+from shared.config import settings
+
+logger = logging.getLogger(__name__)
+
+STRIPE_API_VERSION = "2023-10-16"
+RETRY_STATUS_CODES = {409, 429, 500, 502, 503, 504}
+
+
+class PaymentGatewayError(Exception):
+    """The processor rejected the request (card declined, invalid request, ...)"""
+
+    def __init__(self, message: str, status_code: int = 400, code: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+class PaymentGatewayUnavailable(PaymentGatewayError):
+    """The processor did not answer successfully within the timeouts and retries"""
+
+
+def encode_form(params: Dict[str, Any], prefix: str = "") -> Dict[str, str]:
+    """Flatten nested params into Stripe's bracket form encoding (metadata[key], list[0])"""
+    encoded = {}
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            encoded.update(encode_form(value, name))
+        elif isinstance(value, (list, tuple)):
+            encoded.update(encode_form(dict(enumerate(value)), name))
+        elif isinstance(value, bool):
+            encoded[name] = "true" if value else "false"
+        else:
+            encoded[name] = str(value)
+    return encoded
+
+
+class StripeGateway:
+    """Non-blocking Stripe client; create once per process and close on shutdown"""
+
+    def __init__(
+        self,
+        api_key: str,
+        api_base: str = "https://api.stripe.com",
+        timeout: float = 10.0,
+        connect_timeout: float = 3.0,
+        max_connections: int = 20,
+        max_concurrency: int = 20,
+        max_retries: int = 2,
+        retry_base_seconds: float = 0.5,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.metrics = {"requests": 0, "retries": 0, "errors": 0, "unavailable": 0, "in_flight": 0}
+
+    @classmethod
+    def from_settings(cls) -> "StripeGateway":
+        return cls(
+            api_key=settings.stripe_secret_key,
+            api_base=settings.stripe_api_base,
+            timeout=settings.stripe_timeout_seconds,
+            connect_timeout=settings.stripe_connect_timeout_seconds,
+            max_connections=settings.stripe_max_connections,
+            max_concurrency=settings.stripe_max_concurrency,
+            max_retries=settings.stripe_max_retries,
+            retry_base_seconds=settings.stripe_retry_base_seconds,
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use so the pool belongs to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base,
+                auth=(self.api_key, ""),
+                headers={"Stripe-Version": STRIPE_API_VERSION},
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self.transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return float(response.headers["Retry-After"])
+        # Full jitter keeps retries from many workers from arriving together
+        return random.uniform(0, self.retry_base_seconds * 2 ** attempt)
+
+    @staticmethod
+    def _should_retry(response: httpx.Response) -> bool:
+        should_retry = response.headers.get("Stripe-Should-Retry")
+        if should_retry is not None:
+            return should_retry == "true"
+        return response.status_code in RETRY_STATUS_CODES
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Call the API and return the decoded object; raises PaymentGatewayError"""
+        client = self.client
+        headers = {}
+        if method == "POST":
+            headers["Idempotency-Key"] = idempotency_key or str(uuid.uuid4())
+        data = encode_form(params or {})
+        request_timeout = httpx.Timeout(timeout, connect=self.timeout.connect) if timeout else self.timeout
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            error: Optional[str] = None
+            async with self._semaphore:
+                self.metrics["requests"] += 1
+                self.metrics["in_flight"] += 1
+                try:
+                    if method == "GET":
+                        response = await client.get(path, params=data, headers=headers, timeout=request_timeout)
+                    else:
+                        response = await client.request(method, path, data=data, headers=headers, timeout=request_timeout)
+                except httpx.TransportError as exc:
+                    error = f"{exc.__class__.__name__}: {exc}"
+                finally:
+                    self.metrics["in_flight"] -= 1
+
+            if response is not None and response.status_code < 400:
+                return response.json()
+            if response is not None and not self._should_retry(response):
+                self.metrics["errors"] += 1
+                try:
+                    body = response.json().get("error", {})
+                except ValueError:
+                    body = {}
+                raise PaymentGatewayError(
+                    body.get("message") or f"HTTP {response.status_code}",
+                    status_code=response.status_code,
+                    code=body.get("code")
+                )
+            if attempt < self.max_retries:
+                self.metrics["retries"] += 1
+                await asyncio.sleep(self._retry_delay(attempt, response))
+            elif response is not None:
+                error = f"HTTP {response.status_code}"
+
+        self.metrics["unavailable"] += 1
+        logger.warning("Payment processor unavailable for %s %s: %s", method, path, error)
+        raise PaymentGatewayUnavailable(f"Payment processor unavailable: {error}", status_code=503)
+
+    async def create_payment_intent(
+        self,
+        amount: int,
+        currency: str,
+        metadata: Dict[str, str],
+        capture_method: str = "manual",
+        idempotency_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self.request("POST", "/v1/payment_intents", {
+            "amount": amount,
+            "currency": currency,
+            "metadata": metadata,
+            "payment_method_types": ["card"],
+            "capture_method": capture_method,
+        }, idempotency_key=idempotency_key)
+
+    async def retrieve_payment_intent(self, payment_intent_id: str) -> Dict[str, Any]:
+        return await self.request("GET", f"/v1/payment_intents/{payment_intent_id}")
+
+    async def confirm_payment_intent(self, payment_intent_id: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        return await self.request("POST", f"/v1/payment_intents/{payment_intent_id}/confirm", idempotency_key=idempotency_key)
+
+    async def capture_payment_intent(self, payment_intent_id: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        return await self.request("POST", f"/v1/payment_intents/{payment_intent_id}/capture", idempotency_key=idempotency_key)
+
+    async def create_refund(
+        self,
+        payment_intent_id: str,
+        amount: Optional[int] = None,
+        reason: Optional[str] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self.request("POST", "/v1/refunds", {
+            "payment_intent": payment_intent_id,
+            "amount": amount,
+            "reason": reason,
+        }, idempotency_key=idempotency_key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            "max_concurrency": self.max_concurrency,
+            "max_connections": self.limits.max_connections,
+        }
+
+
+payment_gateway = StripeGateway.from_settings()
@@ -2,19 +2,32 @@
 Payment Microservice
 Handles payment processing, Stripe integration, and financial transactions
 """
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import List, Optional
+from pydantic import BaseModel
+import hashlib
 import os
-import stripe
 
-from shared.database import get_db, init_db
+from shared.config import settings
+from shared.database import get_db, get_async_db, get_async_read_db, init_db, get_pool_metrics, dispose_async_engines
 from shared.models import User
 from shared.auth import get_current_user, require_verification, require_roles, UserRole
+from shared.idempotency import IdempotencyMiddleware, IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from shared.pagination import NEXT_CURSOR_HEADER, encode_cursor, keyset_after
+from shared.responses import FastJSONResponse
 from shared.schemas import SuccessResponse, ErrorResponse
+from escrow_service.models import EscrowTransaction
+from .gateway import payment_gateway, PaymentGatewayError, PaymentGatewayUnavailable
+from .models import Payment, PaymentOperation, PayoutRun
+from .payouts import PayoutRunInProgress, open_run, payout_runner
+from .records import HISTORY_COLUMNS, record_ledger_postings, record_payment
+from .webhooks import EVENT_HANDLERS, verify_event, webhook_ingest_guard, webhook_worker
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -23,6 +36,13 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Replay responses for retried payment calls that carry an Idempotency-Key
+# (added before CORS so CORS wraps it and its own 400/409/422 responses get CORS headers)
+app.add_middleware(
+    IdempotencyMiddleware,
+    routes=[("POST", r"^/create-payment-intent$"), ("POST", r"^/capture-payment$")]
+)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -30,23 +50,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[REPLAYED_HEADER],
 )
 
-# Initialize Stripe
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
-
 # Initialize database
 init_db()
 
 
-class PaymentIntentCreate:
+@app.on_event("startup")
+async def start_workers():
+    """Run the webhook worker in this process when enabled"""
+    if settings.payment_webhook_worker_enabled:
+        webhook_worker.start()
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    """Stop the workers and close the pooled processor and database connections"""
+    await webhook_worker.stop()
+    await payout_runner.stop()
+    await payment_gateway.close()
+    await dispose_async_engines()
+
+
+class PaymentIntentCreate(BaseModel):
     amount: int
     currency: str
     metadata: dict
     payment_method_types: list = ["card"]
 
 
-class PaymentIntentResponse:
+class PaymentIntentResponse(BaseModel):
     client_secret: str
     payment_intent_id: str
     amount: int
@@ -54,13 +88,22 @@ class PaymentIntentResponse:
     status: str
 
 
+def stripe_idempotency_key(operation: str, user_id: int, idempotency_key: Optional[str]) -> Optional[str]:
+    """Derive the key sent to Stripe from the client's Idempotency-Key"""
+    if not idempotency_key:
+        return None
+    digest = hashlib.sha256(idempotency_key.encode()).hexdigest()
+    return f"{operation}:{user_id}:{digest}"
+
+
 @app.post("/create-payment-intent")
 async def create_payment_intent(
     amount: int,
     currency: str = "mxn",
     transaction_id: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a Stripe Payment Intent"""
     try:
@@ -68,7 +111,7 @@ async def create_payment_intent(
         amount_cents = int(amount * 100)
         
         # Create payment intent
-        intent = stripe.PaymentIntent.create(
+        intent = await payment_gateway.create_payment_intent(
             amount=amount_cents,
             currency=currency,
             metadata={
@@ -77,19 +120,28 @@ async def create_payment_intent(
                 "transaction_id": transaction_id or "",
                 "service": "fintech_escrow"
             },
-            payment_method_types=["card"],
-            capture_method="manual"  # Manual capture for ESCROW
+            capture_method="manual",  # Manual capture for ESCROW
+            # Stripe also deduplicates retries that reach it
+            idempotency_key=stripe_idempotency_key("create", current_user.id, idempotency_key)
         )
+        await record_payment(db, PaymentOperation.INTENT, intent, current_user.id)
         
         return PaymentIntentResponse(
-            client_secret=intent.client_secret,
-            payment_intent_id=intent.id,
+            client_secret=intent["client_secret"],
+            payment_intent_id=intent["id"],
             amount=amount_cents,
             currency=currency,
-            status=intent.status
+            status=intent["status"]
         )
         
-    except stripe.error.StripeError as e:
+    except HTTPException:
+        raise
+    except PaymentGatewayUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except PaymentGatewayError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Stripe error: {str(e)}"
@@ -105,32 +157,40 @@ async def create_payment_intent(
 async def confirm_payment(
     payment_intent_id: str,
     current_user: User = Depends(require_verification),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Confirm a payment intent"""
     try:
         # Retrieve payment intent
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        intent = await payment_gateway.retrieve_payment_intent(payment_intent_id)
         
         # Verify user owns this payment
-        if intent.metadata.get("user_id") != str(current_user.id):
+        if intent.get("metadata", {}).get("user_id") != str(current_user.id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Payment does not belong to user"
             )
         
         # Confirm the payment
-        confirmed_intent = stripe.PaymentIntent.confirm(payment_intent_id)
+        confirmed_intent = await payment_gateway.confirm_payment_intent(payment_intent_id)
+        await record_payment(db, PaymentOperation.CONFIRMATION, confirmed_intent, current_user.id)
         
         return {
             "success": True,
-            "payment_intent_id": confirmed_intent.id,
-            "status": confirmed_intent.status,
-            "amount": confirmed_intent.amount,
-            "currency": confirmed_intent.currency
+            "payment_intent_id": confirmed_intent["id"],
+            "status": confirmed_intent["status"],
+            "amount": confirmed_intent["amount"],
+            "currency": confirmed_intent["currency"]
         }
         
-    except stripe.error.StripeError as e:
+    except HTTPException:
+        raise
+    except PaymentGatewayUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except PaymentGatewayError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Stripe error: {str(e)}"
@@ -145,16 +205,19 @@ async def confirm_payment(
 @app.post("/capture-payment")
 async def capture_payment(
     payment_intent_id: str,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
     current_user: User = Depends(require_roles([UserRole.ADMIN, UserRole.ADVISOR])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Capture a payment (release funds to seller)"""
     try:
-        # Retrieve payment intent
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-        
-        # Capture the payment
-        captured_intent = stripe.PaymentIntent.capture(payment_intent_id)
+        # Capture the payment; the processor rejects intents that cannot be captured
+        captured_intent = await payment_gateway.capture_payment_intent(
+            payment_intent_id,
+            idempotency_key=stripe_idempotency_key("capture", current_user.id, idempotency_key)
+        )
+        await record_payment(db, PaymentOperation.CAPTURE, captured_intent, current_user.id)
+        await record_ledger_postings(db, intent=captured_intent)
         
         # TODO: Update transaction status in ESCROW service
         # TODO: Send notification to seller
@@ -162,13 +225,20 @@ async def capture_payment(
         
         return {
             "success": True,
-            "payment_intent_id": captured_intent.id,
-            "status": captured_intent.status,
-            "amount": captured_intent.amount,
-            "currency": captured_intent.currency
+            "payment_intent_id": captured_intent["id"],
+            "status": captured_intent["status"],
+            "amount": captured_intent["amount"],
+            "currency": captured_intent["currency"]
         }
         
-    except stripe.error.StripeError as e:
+    except HTTPException:
+        raise
+    except PaymentGatewayUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except PaymentGatewayError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Stripe error: {str(e)}"
@@ -185,20 +255,21 @@ async def refund_payment(
     payment_intent_id: str,
     amount: Optional[int] = None,
     reason: str = "requested_by_customer",
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
     current_user: User = Depends(require_roles([UserRole.ADMIN, UserRole.ADVISOR])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Refund a payment"""
     try:
-        # Retrieve payment intent
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-        
         # Create refund
-        refund = stripe.Refund.create(
-            payment_intent=payment_intent_id,
+        refund = await payment_gateway.create_refund(
+            payment_intent_id,
             amount=amount,  # If None, full refund
-            reason=reason
+            reason=reason,
+            idempotency_key=stripe_idempotency_key("refund", current_user.id, idempotency_key)
         )
+        await record_payment(db, PaymentOperation.REFUND, refund, current_user.id, payment_intent_id=payment_intent_id)
+        await record_ledger_postings(db, refund=refund)
         
         # TODO: Update transaction status in ESCROW service
         # TODO: Send notification to buyer
@@ -206,13 +277,20 @@ async def refund_payment(
         
         return {
             "success": True,
-            "refund_id": refund.id,
-            "amount": refund.amount,
-            "status": refund.status,
-            "reason": refund.reason
+            "refund_id": refund["id"],
+            "amount": refund["amount"],
+            "status": refund["status"],
+            "reason": refund["reason"]
         }
         
-    except stripe.error.StripeError as e:
+    except HTTPException:
+        raise
+    except PaymentGatewayUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except PaymentGatewayError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Stripe error: {str(e)}"
@@ -248,66 +326,144 @@ async def get_payment_methods(
 
 @app.get("/transactions")
 async def get_payment_transactions(
-    page: int = 1,
-    limit: int = 10,
+    status_filter: Optional[List[str]] = Query(None, alias="status", description="Processor statuses to include"),
+    operation: Optional[PaymentOperation] = Query(None),
+    escrow_transaction_id: Optional[int] = Query(None),
+    user_id: Optional[int] = Query(None, description="Payer to list (admin and advisor only)"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """Get user's payment transaction history"""
-    try:
-        # TODO: Implement payment transaction history
-        # This would require storing payment records in the database
-        
-        return {
-            "transactions": [],
-            "pagination": {
-                "page": page,
-                "limit": limit,
-                "total": 0
-            },
-            "message": "Transaction history feature coming soon"
+    """
+    Get a payer's payment history (intents, confirmations, captures and refunds), newest
+    first, from the local payment records.
+    The X-Next-Cursor response header holds the cursor for the next page, if any.
+    """
+    payer_id = current_user.id
+    if user_id is not None and user_id != current_user.id:
+        if current_user.role not in [UserRole.ADMIN, UserRole.ADVISOR]:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not authorized to view other users' payments"
+            )
+        payer_id = user_id
+    
+    filters = [Payment.user_id == payer_id]
+    if status_filter:
+        filters.append(Payment.status.in_(status_filter))
+    if operation:
+        filters.append(Payment.operation == operation.value)
+    if escrow_transaction_id is not None:
+        filters.append(Payment.escrow_transaction_id == escrow_transaction_id)
+    if cursor:
+        filters.append(keyset_after(Payment.created_at, Payment.id, cursor))
+    
+    # Served by idx_payments_user_created / idx_payments_user_status_created
+    result = await db.execute(
+        select(*HISTORY_COLUMNS)
+        .outerjoin(EscrowTransaction, EscrowTransaction.id == Payment.escrow_transaction_id)
+        .where(*filters)
+        .order_by(Payment.created_at.desc(), Payment.id.desc())
+        .limit(limit + 1)
+    )
+    rows = result.all()
+    
+    headers = {}
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    return FastJSONResponse({
+        "transactions": [row._asdict() for row in rows],
+        "pagination": {
+            "limit": limit,
+            "next_cursor": next_cursor
         }
-        
-    except Exception as e:
+    }, headers=headers)
+
+
+@app.post("/payout-runs", status_code=status.HTTP_202_ACCEPTED)
+async def start_payout_run(
+    limit: Optional[int] = Query(None, ge=1, description="Transactions in a new run (default: all awaiting capture)"),
+    current_user: User = Depends(require_roles([UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Capture the payments of every approved ESCROW transaction in a background payout run,
+    or resume the interrupted run. Progress and the report are at GET /payout-runs/{run_id}.
+    """
+    try:
+        run_id = await open_run(db, started_by_id=current_user.id, limit=limit)
+        payout_runner.start(run_id)
+    except PayoutRunInProgress as e:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to retrieve transactions: {str(e)}"
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
         )
+    
+    return {"run_id": run_id, "status": "running"}
 
 
-@app.post("/webhook")
-async def stripe_webhook(request: dict):
-    """Handle Stripe webhooks"""
-    try:
-        # TODO: Implement webhook signature verification
-        # TODO: Handle different webhook events
-        # TODO: Update transaction statuses based on payment events
-        
-        event_type = request.get("type")
-        
-        if event_type == "payment_intent.succeeded":
-            # Handle successful payment
-            pass
-        elif event_type == "payment_intent.payment_failed":
-            # Handle failed payment
-            pass
-        elif event_type == "charge.dispute.created":
-            # Handle dispute
-            pass
-        
-        return {"received": True}
-        
-    except Exception as e:
+@app.get("/payout-runs/{run_id}")
+async def get_payout_run(
+    run_id: int,
+    current_user: User = Depends(require_roles([UserRole.ADMIN, UserRole.ADVISOR])),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get a payout run's progress and, once completed, its report"""
+    run = await db.get(PayoutRun, run_id)
+    if not run:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Webhook processing failed: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payout run not found"
         )
+    
+    return FastJSONResponse({
+        "run_id": run.id,
+        "status": run.status,
+        "total_items": run.total_items,
+        "captured": run.captured,
+        "failed": run.failed,
+        "captured_amount": str(run.captured_amount),
+        "resumes": run.resumes,
+        "started_at": run.started_at,
+        "heartbeat_at": run.heartbeat_at,
+        "finished_at": run.finished_at,
+        "report": run.report
+    })
+
+
+@app.post("/webhook")
+async def stripe_webhook(
+    request: Request,
+    stripe_signature: Optional[str] = Header(None, alias="Stripe-Signature")
+):
+    """Handle Stripe webhooks (stored for the webhook worker; applied asynchronously)"""
+    event = verify_event(await request.body(), stripe_signature)
+    
+    # Acknowledge event types we do not act on without storing them
+    if event["type"] not in EVENT_HANDLERS:
+        return {"received": True}
+    
+    stored = await webhook_ingest_guard.ingest(event)
+    return {"received": True, "duplicate": not stored}
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "payment-service"}
+    return {
+        "status": "healthy",
+        "service": "payment-service",
+        "db_pool": get_pool_metrics(),
+        "payment_gateway": payment_gateway.stats(),
+        "webhooks": webhook_worker.stats(),
+        "payouts": payout_runner.stats()
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""
+Payment Service Models
+"""
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Numeric, Index, UniqueConstraint
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func, text
+from datetime import datetime
+from enum import Enum as PyEnum
+from shared.database import Base
+
+
+class PaymentWebhookEvent(Base):
+    """Verified processor webhook event, stored on receipt and applied later by the webhook worker"""
+    __tablename__ = "payment_webhook_events"
+    __table_args__ = (
+        # Worker claim query: pending events that are due, in processor order
+        Index("idx_payment_webhook_status_available", "status", "available_at", "event_created", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # Processor event id; retried deliveries of an event are stored once
+    event_id = Column(String(255), unique=True, nullable=False)
+    event_type = Column(String(100), nullable=False)
+    # Payment intent or dispute the event is about
+    object_id = Column(String(255), nullable=True, index=True)
+    payload = Column(JSON, nullable=False)
+    event_created = Column(Integer, nullable=False)  # processor timestamp (epoch seconds)
+
+    # Processing state
+    status = Column(String(20), nullable=False, default="pending")  # pending, processed, ignored, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    result = Column(String(100), nullable=True)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+    received_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class PaymentOperation(str, PyEnum):
+    INTENT = "intent"
+    CONFIRMATION = "confirmation"
+    CAPTURE = "capture"
+    REFUND = "refund"
+
+
+class Payment(Base):
+    """One processor operation (intent, confirmation, capture or refund) on behalf of a payer"""
+    __tablename__ = "payments"
+    __table_args__ = (
+        # Keyset pagination of a payer's history ordered by (created_at, id), optionally per status
+        Index("idx_payments_user_created", "user_id", "created_at", "id"),
+        Index("idx_payments_user_status_created", "user_id", "status", "created_at", "id"),
+        Index("idx_payments_escrow_created", "escrow_transaction_id", "created_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # Payer whose history lists the operation, and the user who performed it
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    performed_by_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    escrow_transaction_id = Column(Integer, ForeignKey("escrow_transactions.id"), nullable=True)
+    
+    operation = Column(String(20), nullable=False)
+    payment_intent_id = Column(String(255), nullable=False, index=True)
+    # Refund id for refunds, the payment intent id otherwise
+    processor_object_id = Column(String(255), nullable=False)
+    status = Column(String(30), nullable=False)
+    amount = Column(Numeric(15, 2), nullable=False)
+    currency = Column(String(3), nullable=False)
+    reason = Column(String(100), nullable=True)
+    
+    # Python-side default gives sub-second, consistently formatted sort keys on every backend
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    user = relationship("User", foreign_keys=[user_id])
+    performed_by = relationship("User", foreign_keys=[performed_by_id])
+    escrow_transaction = relationship("EscrowTransaction")
+
+
+class PayoutRun(Base):
+    """Batch capture of the authorized payments of approved ESCROW transactions"""
+    __tablename__ = "payout_runs"
+    __table_args__ = (
+        # At most one running run: concurrent starts cannot capture the same transactions twice
+        Index(
+            "uq_payout_runs_running", "status", unique=True,
+            postgresql_where=text("status = 'running'"), sqlite_where=text("status = 'running'")
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String(20), nullable=False, default="running")  # running, completed
+    started_by_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    rate_per_second = Column(Numeric(10, 2), nullable=False)
+    concurrency = Column(Integer, nullable=False)
+
+    # Progress, updated at every checkpoint
+    total_items = Column(Integer, nullable=False, default=0)
+    captured = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    captured_amount = Column(Numeric(15, 2), nullable=False, default=0)
+    resumes = Column(Integer, nullable=False, default=0)
+    report = Column(JSON, nullable=True)
+
+    started_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    # A running run whose heartbeat is older than PAYOUT_STALE_SECONDS was interrupted and can be resumed
+    heartbeat_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    started_by = relationship("User")
+    items = relationship("PayoutRunItem", back_populates="run")
+
+
+class PayoutRunItem(Base):
+    """One ESCROW transaction of a payout run; pending until its capture is checkpointed"""
+    __tablename__ = "payout_run_items"
+    __table_args__ = (
+        UniqueConstraint("run_id", "escrow_transaction_id", name="uq_payout_run_items_run_escrow"),
+        # Resume query: the run's items that are still pending
+        Index("idx_payout_run_items_run_status", "run_id", "status"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey("payout_runs.id"), nullable=False)
+    escrow_transaction_id = Column(Integer, ForeignKey("escrow_transactions.id"), nullable=False)
+    payment_intent_id = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending, captured, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    amount = Column(Numeric(15, 2), nullable=True)
+    error = Column(Text, nullable=True)
+    captured_at = Column(DateTime(timezone=True), nullable=True)
+
+    run = relationship("PayoutRun", back_populates="items")
+    escrow_transaction = relationship("EscrowTransaction")
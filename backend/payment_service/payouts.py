@@ -0,0 +1,458 @@
+"""
+Payout runs
+Captures the authorized payments of every ESCROW transaction the buyer approved
+(BUYER_APPROVED or FUNDS_RELEASED with payment_status "authorized") in one job,
+instead of one /capture-payment call per transaction.
+
+Captures run concurrently (PAYOUT_CONCURRENCY) and start at most PAYOUT_RATE_PER_SECOND
+times per second, so a run stays inside the processor's API quota. Results are
+checkpointed every PAYOUT_CHECKPOINT_SIZE captures: the items' status, the transactions'
+payment status, the payment records and the ledger postings are written in one commit.
+
+A run interrupted by a crash keeps its pending items and is resumed by the next start
+once its heartbeat is older than PAYOUT_STALE_SECONDS. Each capture uses an idempotency
+key derived from its payment intent, so a capture that went through before the crash
+is replayed by the processor instead of repeated. The run's totals and failures are
+stored as its report.
+
+Transient errors (the processor unavailable after the gateway's retries, lock timeouts,
+rate limits) leave the item pending; it is retried in a later round of the same run, up
+to PAYOUT_MAX_ATTEMPTS attempts. Permanent errors fail the item at once and take the
+transaction out of later runs: an intent the processor canceled (an expired
+authorization) is voided in the ledger and marked "canceled", any other is marked
+"capture_failed" for staff to review.
+
+Started by an admin (POST /payout-runs) or as a job:
+    python -m payment_service.payouts [--limit N] [--report PATH]
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.config import settings
+from escrow_service.ledger import post_intent
+from escrow_service.models import EscrowTransaction, EscrowStatus
+from .gateway import PaymentGatewayError, PaymentGatewayUnavailable, StripeGateway, payment_gateway
+from .models import PaymentOperation, PayoutRun, PayoutRunItem
+from .records import payment_from_processor
+
+logger = logging.getLogger(__name__)
+
+PAYOUT_STATUSES = [EscrowStatus.BUYER_APPROVED, EscrowStatus.FUNDS_RELEASED]
+# Failed items listed in a run report (the counters include all of them)
+REPORT_MAX_FAILURES = 100
+# Processor error codes worth another attempt later in the run
+RETRYABLE_CODES = {"lock_timeout", "rate_limit"}
+
+# (intent, error, retryable): the captured intent with no error, or the error, with the
+# intent as last retrieved if the processor reported it in an unexpected state
+CaptureResult = Tuple[Optional[Dict[str, Any]], Optional[str], bool]
+
+
+class PayoutRunInProgress(Exception):
+    """Another payout run is running and checkpointed recently"""
+
+
+class RateLimiter:
+    """Token bucket spacing request starts at rate_per_second (0 disables it)"""
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate_per_second <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second)
+            self._updated_at = now
+            if self._tokens < 1:
+                # Waiters queue on the lock, so starts stay evenly spaced
+                await asyncio.sleep((1 - self._tokens) / self.rate_per_second)
+                self._tokens = 1.0
+                self._updated_at = time.monotonic()
+            self._tokens -= 1
+
+
+async def open_run(
+    db: AsyncSession,
+    started_by_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    rate_per_second: Optional[float] = None,
+    concurrency: Optional[int] = None
+) -> int:
+    """
+    Resume the interrupted payout run, or start one with every transaction awaiting
+    capture. Returns the run id; raises PayoutRunInProgress if a run is active.
+    """
+    now = datetime.utcnow()
+    running = (await db.execute(
+        select(PayoutRun.id).where(PayoutRun.status == "running")
+    )).scalar()
+    if running is not None:
+        # Only one of several processes resuming at once claims the run
+        claimed = await db.execute(
+            update(PayoutRun)
+            .where(
+                PayoutRun.id == running,
+                PayoutRun.status == "running",
+                PayoutRun.heartbeat_at < now - timedelta(seconds=settings.payout_stale_seconds)
+            )
+            .values(heartbeat_at=now, resumes=PayoutRun.resumes + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if claimed.rowcount != 1:
+            raise PayoutRunInProgress(f"Payout run {running} is in progress")
+        logger.info("Resuming payout run %s", running)
+        return running
+
+    run = PayoutRun(
+        status="running",
+        started_by_id=started_by_id,
+        rate_per_second=rate_per_second if rate_per_second is not None else settings.payout_rate_per_second,
+        concurrency=concurrency or settings.payout_concurrency,
+        heartbeat_at=now
+    )
+    db.add(run)
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise PayoutRunInProgress("A payout run is in progress")
+
+    query = (
+        select(EscrowTransaction.id, EscrowTransaction.payment_transaction_id)
+        .where(
+            EscrowTransaction.status.in_(PAYOUT_STATUSES),
+            EscrowTransaction.payment_status == "authorized",
+            EscrowTransaction.payment_transaction_id.isnot(None)
+        )
+        .order_by(EscrowTransaction.id)
+    )
+    if limit:
+        query = query.limit(limit)
+    candidates = (await db.execute(query)).all()
+    if candidates:
+        await db.execute(insert(PayoutRunItem), [
+            {
+                "run_id": run.id,
+                "escrow_transaction_id": candidate.id,
+                "payment_intent_id": candidate.payment_transaction_id,
+                "status": "pending",
+                "attempts": 0
+            }
+            for candidate in candidates
+        ])
+    run.total_items = len(candidates)
+    run_id = run.id
+    await db.commit()
+    logger.info("Started payout run %s with %s transactions", run_id, len(candidates))
+    return run_id
+
+
+def is_retryable(exc: PaymentGatewayError) -> bool:
+    """
+    Whether a capture error may clear up within the run. The gateway already retried
+    what the processor marked retryable, so only its give-ups and throttling qualify.
+    """
+    return isinstance(exc, PaymentGatewayUnavailable) or exc.code in RETRYABLE_CODES
+
+
+async def capture_item(gateway: StripeGateway, limiter: RateLimiter, payment_intent_id: str) -> CaptureResult:
+    """Capture one intent (see CaptureResult)"""
+    try:
+        await limiter.acquire()
+        # Same key on every attempt and resume: a capture that went through is replayed, not repeated
+        intent = await gateway.capture_payment_intent(
+            payment_intent_id, idempotency_key=f"payout-capture:{payment_intent_id}"
+        )
+        return intent, None, False
+    except PaymentGatewayError as exc:
+        if exc.code != "payment_intent_unexpected_state":
+            return None, str(exc), is_retryable(exc)
+        error = str(exc)
+
+    # Captured outside this run, or before the processor forgot the idempotency key
+    try:
+        await limiter.acquire()
+        intent = await gateway.retrieve_payment_intent(payment_intent_id)
+    except PaymentGatewayError as exc:
+        return None, f"{error}; {exc}", is_retryable(exc)
+    if intent.get("status") == "succeeded":
+        return intent, None, False
+    # Canceled, expired or never authorized: capturing again cannot succeed
+    return intent, f"{error} (intent status {intent.get('status')})", False
+
+
+async def checkpoint(db: AsyncSession, run: PayoutRun, results: Sequence[Tuple[Any, CaptureResult]]):
+    """Write a slice of capture results and the run's progress in one commit"""
+    now = datetime.utcnow()
+    item_rows = []
+    captured_ids = []
+    captured_amount = Decimal("0")
+    failed = 0
+    unpayable: Dict[str, List[int]] = {"canceled": [], "capture_failed": []}
+    for item, (intent, error, retryable) in results:
+        row = {"id": item.id, "attempts": item.attempts + 1, "status": "failed",
+               "amount": None, "captured_at": None, "error": error}
+        if error is None:
+            amount = Decimal(intent.get("amount_received") or intent.get("amount") or 0).scaleb(-2)
+            row.update(status="captured", amount=amount, captured_at=now, error=None)
+            captured_ids.append(item.escrow_transaction_id)
+            captured_amount += amount
+            db.add(payment_from_processor(
+                PaymentOperation.CAPTURE, intent, item.buyer_id, run.started_by_id, item.escrow_transaction_id
+            ))
+            await post_intent(db, intent, item.escrow_transaction_id, item.escrow_status, item.escrow_fee)
+        elif retryable and row["attempts"] < settings.payout_max_attempts:
+            row["status"] = "pending"
+        else:
+            failed += 1
+            # A transient error that outlasted the run leaves the payment authorized for the next run
+            if not retryable:
+                canceled = intent is not None and intent.get("status") == "canceled"
+                unpayable["canceled" if canceled else "capture_failed"].append(item.escrow_transaction_id)
+                if canceled:
+                    await post_intent(db, intent, item.escrow_transaction_id, item.escrow_status, item.escrow_fee)
+        item_rows.append(row)
+
+    if item_rows:
+        await db.execute(update(PayoutRunItem), item_rows)
+    if captured_ids:
+        await db.execute(
+            update(EscrowTransaction)
+            .where(EscrowTransaction.id.in_(captured_ids), EscrowTransaction.payment_status != "completed")
+            .values(
+                payment_status="completed",
+                payment_processed_at=func.coalesce(EscrowTransaction.payment_processed_at, now),
+                version=EscrowTransaction.version + 1
+            )
+            .execution_options(synchronize_session=False)
+        )
+    for payment_status, escrow_ids in unpayable.items():
+        if escrow_ids:
+            # Out of later runs; a capture reported by webhook still completes the payment
+            await db.execute(
+                update(EscrowTransaction)
+                .where(EscrowTransaction.id.in_(escrow_ids), EscrowTransaction.payment_status == "authorized")
+                .values(payment_status=payment_status, version=EscrowTransaction.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+    await db.execute(
+        update(PayoutRun)
+        .where(PayoutRun.id == run.id)
+        .values(
+            captured=PayoutRun.captured + len(captured_ids),
+            failed=PayoutRun.failed + failed,
+            captured_amount=PayoutRun.captured_amount + captured_amount,
+            heartbeat_at=now
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def finish_run(db: AsyncSession, run_id: int, seconds: float, processed: int) -> Dict[str, Any]:
+    """Mark the run completed and store its report"""
+    run = (await db.execute(
+        select(PayoutRun).where(PayoutRun.id == run_id).execution_options(populate_existing=True)
+    )).scalar_one()
+    failures = (await db.execute(
+        select(EscrowTransaction.transaction_id, PayoutRunItem.payment_intent_id, PayoutRunItem.error)
+        .join(EscrowTransaction, EscrowTransaction.id == PayoutRunItem.escrow_transaction_id)
+        .where(PayoutRunItem.run_id == run_id, PayoutRunItem.status == "failed")
+        .order_by(PayoutRunItem.id)
+        .limit(REPORT_MAX_FAILURES)
+    )).all()
+
+    now = datetime.utcnow()
+    report = {
+        "run_id": run.id,
+        "status": "completed",
+        "started_at": run.started_at.isoformat() if run.started_at else None,
+        "finished_at": now.isoformat(),
+        "resumes": run.resumes,
+        "items": run.total_items,
+        "captured": run.captured,
+        "failed": run.failed,
+        "captured_amount": str(run.captured_amount),
+        "rate_per_second": float(run.rate_per_second),
+        "concurrency": run.concurrency,
+        # This execution only (a resumed run reports the items left at resume)
+        "processed": processed,
+        "duration_seconds": round(seconds, 3),
+        "captures_per_second": round(processed / seconds, 1) if seconds > 0 else 0.0,
+        "failures": [
+            {"transaction_id": row.transaction_id, "payment_intent_id": row.payment_intent_id, "error": row.error}
+            for row in failures
+        ]
+    }
+    await db.execute(
+        update(PayoutRun)
+        .where(PayoutRun.id == run_id)
+        .values(status="completed", finished_at=now, heartbeat_at=now, report=report)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    logger.info(
+        "Payout run %s completed: %s captured, %s failed in %.1fs",
+        run_id, run.captured, run.failed, seconds
+    )
+    return report
+
+
+async def pending_items(db: AsyncSession, run_id: int) -> List[Any]:
+    """The run's items still to capture, with what the checkpoint needs of their transactions"""
+    items = (await db.execute(
+        select(
+            PayoutRunItem.id,
+            PayoutRunItem.escrow_transaction_id,
+            PayoutRunItem.payment_intent_id,
+            PayoutRunItem.attempts,
+            EscrowTransaction.buyer_id,
+            EscrowTransaction.status.label("escrow_status"),
+            EscrowTransaction.escrow_fee
+        )
+        .join(EscrowTransaction, EscrowTransaction.id == PayoutRunItem.escrow_transaction_id)
+        .where(PayoutRunItem.run_id == run_id, PayoutRunItem.status == "pending")
+        .order_by(PayoutRunItem.id)
+    )).all()
+    await db.commit()
+    return items
+
+
+async def execute_run(run_id: int, gateway: Optional[StripeGateway] = None) -> Dict[str, Any]:
+    """Capture the run's pending items, in rounds until none is left, and return its report"""
+    from shared.database import AsyncSessionLocal
+
+    gateway = gateway or payment_gateway
+    async with AsyncSessionLocal() as db:
+        run = await db.get(PayoutRun, run_id)
+        limiter = RateLimiter(float(run.rate_per_second))
+        semaphore = asyncio.Semaphore(run.concurrency)
+
+        async def capture(item):
+            async with semaphore:
+                return item, await capture_item(gateway, limiter, item.payment_intent_id)
+
+        started_at = time.perf_counter()
+        pending = await pending_items(db, run_id)
+        processed = len(pending)
+        rounds = 0
+        while pending:
+            if rounds:
+                # Items left pending hit a transient error; give the processor time to recover
+                await asyncio.sleep(settings.payout_retry_base_seconds * 2 ** (rounds - 1))
+            rounds += 1
+            tasks = [asyncio.create_task(capture(item)) for item in pending]
+            results: List[Tuple[Any, CaptureResult]] = []
+            try:
+                # Captures keep running while a checkpoint is written
+                for completed in asyncio.as_completed(tasks):
+                    results.append(await completed)
+                    if len(results) >= settings.payout_checkpoint_size:
+                        await checkpoint(db, run, results)
+                        results = []
+                await checkpoint(db, run, results)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            pending = await pending_items(db, run_id)
+        return await finish_run(db, run_id, time.perf_counter() - started_at, processed)
+
+
+async def run_payouts(
+    started_by_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    rate_per_second: Optional[float] = None,
+    concurrency: Optional[int] = None,
+    gateway: Optional[StripeGateway] = None
+) -> Dict[str, Any]:
+    """Resume the interrupted payout run or start a new one, and run it to completion"""
+    from shared.database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        run_id = await open_run(db, started_by_id, limit, rate_per_second, concurrency)
+    return await execute_run(run_id, gateway)
+
+
+class PayoutRunner:
+    """Executes payout runs started from the API on the event loop"""
+
+    def __init__(self):
+        self.run_id: Optional[int] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _execute(self, run_id: int):
+        try:
+            self.last_report = await execute_run(run_id)
+        except Exception:
+            logger.exception("Payout run %s failed; it is resumed by the next start", run_id)
+
+    def start(self, run_id: int):
+        if self.running:
+            raise PayoutRunInProgress(f"Payout run {self.run_id} is in progress")
+        self.run_id = run_id
+        self._task = asyncio.get_running_loop().create_task(self._execute(run_id))
+
+    async def stop(self):
+        # The run keeps its checkpoint and is resumed by the next start
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "run_id": self.run_id,
+            "last_report": self.last_report
+        }
+
+
+payout_runner = PayoutRunner()
+
+
+async def main(args) -> Dict[str, Any]:
+    try:
+        return await run_payouts(limit=args.limit, rate_per_second=args.rate, concurrency=args.concurrency)
+    finally:
+        await payment_gateway.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture approved ESCROW payments in a payout run")
+    parser.add_argument("--limit", type=int, help="Transactions in a new run (default: all awaiting capture)")
+    parser.add_argument("--rate", type=float, help="Captures started per second (default: PAYOUT_RATE_PER_SECOND)")
+    parser.add_argument("--concurrency", type=int, help="Captures in flight (default: PAYOUT_CONCURRENCY)")
+    parser.add_argument("--report", help="Also write the run report to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(main(args))
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    print(json.dumps(report, indent=2))
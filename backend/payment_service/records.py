@@ -0,0 +1,149 @@
+"""
+Local payment records
+Every intent, confirmation, capture and refund the payment service performs is written
+to the payments table, linked to the payer and the ESCROW transaction, so payment
+history is served from indexed local rows instead of calls to the processor API.
+Webhook events keep the status of intent records current. Captures and refunds are
+also posted to the ESCROW custody ledger.
+"""
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from escrow_service.ledger import post_intent, post_refund
+from escrow_service.models import EscrowTransaction
+from .models import Payment, PaymentOperation
+
+logger = logging.getLogger(__name__)
+
+# Columns served by the payment history endpoint
+HISTORY_COLUMNS = [
+    Payment.id,
+    Payment.operation,
+    Payment.payment_intent_id,
+    Payment.processor_object_id,
+    Payment.status,
+    Payment.amount,
+    Payment.currency,
+    Payment.reason,
+    Payment.escrow_transaction_id,
+    EscrowTransaction.transaction_id.label("escrow_reference"),
+    Payment.created_at,
+    Payment.updated_at,
+]
+
+
+async def _parties(
+    db: AsyncSession,
+    payment_intent_id: str,
+    metadata: Optional[Dict[str, Any]]
+) -> Tuple[Optional[int], Optional[int]]:
+    """(payer user id, ESCROW transaction id) from intent metadata, else from the intent's local record"""
+    if metadata and metadata.get("user_id"):
+        escrow_transaction_id = None
+        if metadata.get("transaction_id"):
+            escrow_transaction_id = (await db.execute(
+                select(EscrowTransaction.id).where(EscrowTransaction.transaction_id == metadata["transaction_id"])
+            )).scalar()
+        return int(metadata["user_id"]), escrow_transaction_id
+
+    recorded = (await db.execute(
+        select(Payment.user_id, Payment.escrow_transaction_id)
+        .where(Payment.payment_intent_id == payment_intent_id)
+        .order_by(Payment.id)
+        .limit(1)
+    )).first()
+    return (recorded.user_id, recorded.escrow_transaction_id) if recorded else (None, None)
+
+
+def payment_from_processor(
+    operation: PaymentOperation,
+    processor_object: Dict[str, Any],
+    user_id: int,
+    performed_by_id: Optional[int],
+    escrow_transaction_id: Optional[int],
+    payment_intent_id: Optional[str] = None
+) -> Payment:
+    """Payment record for an intent (or refund) returned by the processor"""
+    return Payment(
+        user_id=user_id,
+        performed_by_id=performed_by_id,
+        escrow_transaction_id=escrow_transaction_id,
+        operation=operation.value,
+        payment_intent_id=payment_intent_id or processor_object["id"],
+        processor_object_id=processor_object["id"],
+        status=processor_object.get("status") or "unknown",
+        # Processor amounts are in the currency's minor unit
+        amount=Decimal(processor_object.get("amount") or 0).scaleb(-2),
+        currency=(processor_object.get("currency") or "").upper()[:3],
+        reason=processor_object.get("reason"),
+    )
+
+
+async def record_payment(
+    db: AsyncSession,
+    operation: PaymentOperation,
+    processor_object: Dict[str, Any],
+    performed_by_id: int,
+    payment_intent_id: Optional[str] = None
+) -> Optional[Payment]:
+    """
+    Record a successful processor operation and commit. processor_object is the intent
+    (or refund) returned by the processor. The operation already happened at the
+    processor, so a failure to record it is logged rather than raised.
+    """
+    payment_intent_id = payment_intent_id or processor_object["id"]
+    try:
+        user_id, escrow_transaction_id = await _parties(db, payment_intent_id, processor_object.get("metadata"))
+        payment = payment_from_processor(
+            operation, processor_object, user_id or performed_by_id, performed_by_id,
+            escrow_transaction_id, payment_intent_id
+        )
+        db.add(payment)
+        await db.commit()
+        return payment
+    except Exception:
+        await db.rollback()
+        logger.exception("Could not record %s of payment intent %s", operation.value, payment_intent_id)
+        return None
+
+
+async def record_ledger_postings(
+    db: AsyncSession,
+    intent: Optional[Dict[str, Any]] = None,
+    refund: Optional[Dict[str, Any]] = None
+):
+    """
+    Post a captured intent or a refund to the custody ledger and commit. Like
+    record_payment, failures are logged; the webhook for the intent posts it again.
+    """
+    payment_intent_id = refund["payment_intent"] if refund else intent["id"]
+    try:
+        transaction = (await db.execute(
+            select(EscrowTransaction.id, EscrowTransaction.status, EscrowTransaction.escrow_fee)
+            .where(EscrowTransaction.payment_transaction_id == payment_intent_id)
+        )).first()
+        if transaction is None:
+            return
+        if refund:
+            await post_refund(db, refund, transaction.id)
+        else:
+            await post_intent(db, intent, transaction.id, transaction.status, transaction.escrow_fee)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        logger.exception("Could not post payment intent %s to the ledger", payment_intent_id)
+
+
+async def update_intent_status(db: AsyncSession, intent: Dict[str, Any]):
+    """Refresh the status of an intent's record (joins the caller's transaction)"""
+    if intent.get("id") and intent.get("status"):
+        await db.execute(
+            update(Payment)
+            .where(Payment.payment_intent_id == intent["id"], Payment.operation == PaymentOperation.INTENT.value)
+            .values(status=intent["status"])
+            .execution_options(synchronize_session=False)
+        )
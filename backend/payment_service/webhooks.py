@@ -0,0 +1,547 @@
+"""
+Processor webhook inbox
+POST /webhook verifies the Stripe-Signature header, stores the event in
+payment_webhook_events (one row per processor event id, so redelivered events are
+dropped by the unique index) and acknowledges. Nothing else runs on the request path.
+
+The webhook worker applies stored events to their ESCROW transactions in batches:
+one claim query (FOR UPDATE SKIP LOCKED), one query for every referenced transaction
+and one commit per batch. If a batch fails, its events are applied one at a time so a
+bad event is retried with backoff without holding back the others.
+
+During processor incidents redeliveries can arrive in bursts. Deliveries beyond
+PAYMENT_WEBHOOK_MAX_IN_FLIGHT concurrent requests, or while the pending backlog exceeds
+PAYMENT_WEBHOOK_MAX_BACKLOG, get 503 with Retry-After and are redelivered by the
+processor later; the worker drains the inbox at its own pace either way.
+
+Payment intent events also refresh the status of the intent's local payment record.
+An intent only pays for a transaction if its amount, currency and payer (metadata.user_id)
+match the transaction and it is the transaction's first intent; other intents naming the
+transaction are ignored and staff are alerted. A canceled authorization (including one
+the processor cancels when it expires) voids the hold in the ledger, and staff are
+alerted if the transaction had already moved on from PENDING_PAYMENT. Chargebacks on
+transactions that cannot be disputed in their current status are recorded and alerted
+without changing the status.
+
+Run in the API process (PAYMENT_WEBHOOK_WORKER_ENABLED=true) or as a worker:
+    python -m payment_service.webhooks [--once]
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import stripe
+from fastapi import HTTPException, status
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.audit_middleware import ESCROW_TRANSITIONS
+from shared.config import settings
+from escrow_service.ledger import post_intent
+from escrow_service.models import Currency, EscrowTransaction, EscrowDispute, EscrowStatus
+from escrow_service.outbox import PAYMENT_ALERT, STATUS_CHANGED, record_event, transaction_payload
+from escrow_service.stats import record_status_change
+from .models import PaymentWebhookEvent
+from .records import update_intent_status
+
+logger = logging.getLogger(__name__)
+
+# Event types
+PAYMENT_AUTHORIZED = "payment_intent.amount_capturable_updated"
+PAYMENT_SUCCEEDED = "payment_intent.succeeded"
+PAYMENT_FAILED = "payment_intent.payment_failed"
+PAYMENT_CANCELED = "payment_intent.canceled"
+DISPUTE_CREATED = "charge.dispute.created"
+
+# Results of events that were received but deliberately not applied
+IGNORED_RESULTS = {"no_matching_transaction", "payment_mismatch", "other_intent_canceled"}
+
+UPSERT_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+
+def verify_event(payload: bytes, signature: Optional[str]) -> Dict[str, Any]:
+    """Check the Stripe-Signature header against the webhook secret and decode the event"""
+    if not settings.stripe_webhook_secret:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Webhook secret is not configured"
+        )
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"), signature or "", settings.stripe_webhook_secret,
+            settings.payment_webhook_tolerance_seconds
+        )
+        event = json.loads(payload)
+    except (stripe.error.SignatureVerificationError, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid webhook signature"
+        )
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid webhook event"
+        )
+    return event
+
+
+def event_object(event: Dict[str, Any]) -> Dict[str, Any]:
+    return (event.get("data") or {}).get("object") or {}
+
+
+class WebhookMetrics:
+    """Thread-safe ingestion and worker counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "received": 0, "duplicates": 0, "shed": 0,
+            "batches": 0, "processed": 0, "ignored": 0, "retried": 0, "failed": 0
+        }
+        self.backlog = 0
+        self.last_batch: Optional[Dict[str, Any]] = None
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_batch(self, events: Sequence[PaymentWebhookEvent], seconds: float):
+        with self._lock:
+            self.counters["batches"] += 1
+            for event in events:
+                if event.status == "pending":
+                    self.counters["retried"] += 1
+                else:
+                    self.counters[event.status] += 1
+            self.last_batch = {
+                "finished_at": datetime.utcnow().isoformat(),
+                "events": len(events),
+                "duration_ms": round(seconds * 1000, 3)
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "backlog": self.backlog, "last_batch": self.last_batch}
+
+
+webhook_metrics = WebhookMetrics()
+
+
+class WebhookIngestGuard:
+    """Admission control for webhook deliveries; rejected deliveries are redelivered by the processor"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self._backlog_checked_at = 0.0
+
+    def _shed(self, reason: str):
+        webhook_metrics.increment("shed")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=reason,
+            headers={"Retry-After": str(int(settings.payment_webhook_backlog_check_seconds) or 1)}
+        )
+
+    async def _backlog_full(self, db: AsyncSession) -> bool:
+        # Counted at most every backlog_check_seconds, not per delivery
+        if time.monotonic() - self._backlog_checked_at >= settings.payment_webhook_backlog_check_seconds:
+            self._backlog_checked_at = time.monotonic()
+            webhook_metrics.backlog = (await db.execute(
+                select(func.count()).select_from(PaymentWebhookEvent).where(PaymentWebhookEvent.status == "pending")
+            )).scalar()
+        return webhook_metrics.backlog >= settings.payment_webhook_max_backlog
+
+    async def ingest(self, event: Dict[str, Any]) -> bool:
+        """Store a verified event; returns False for a redelivery of a stored event"""
+        from shared.database import AsyncSessionLocal
+
+        if self.in_flight >= settings.payment_webhook_max_in_flight:
+            self._shed("Too many webhook deliveries in progress")
+        self.in_flight += 1
+        try:
+            async with AsyncSessionLocal() as db:
+                if await self._backlog_full(db):
+                    self._shed("Webhook backlog is full")
+                stored = await store_event(db, event)
+        finally:
+            self.in_flight -= 1
+        webhook_metrics.increment("received" if stored else "duplicates")
+        return stored
+
+
+webhook_ingest_guard = WebhookIngestGuard()
+
+
+async def store_event(db: AsyncSession, event: Dict[str, Any]) -> bool:
+    """Insert the event unless its id is already stored, and commit"""
+    values = {
+        "event_id": event["id"],
+        "event_type": event["type"],
+        "object_id": event_object(event).get("id"),
+        "payload": event,
+        "event_created": int(event.get("created") or time.time()),
+        "status": "pending",
+        "attempts": 0,
+        "available_at": datetime.utcnow(),
+        "received_at": datetime.utcnow(),
+    }
+    insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is not None:
+        result = await db.execute(
+            insert(PaymentWebhookEvent).values(**values).on_conflict_do_nothing(
+                index_elements=[PaymentWebhookEvent.event_id]
+            )
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+    try:
+        db.add(PaymentWebhookEvent(**values))
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return False
+    return True
+
+
+def _references(event: PaymentWebhookEvent) -> Tuple[Optional[str], Optional[str]]:
+    """(ESCROW transaction_id, payment intent id) an event refers to"""
+    obj = event_object(event.payload)
+    if event.event_type == DISPUTE_CREATED:
+        return None, obj.get("payment_intent")
+    return (obj.get("metadata") or {}).get("transaction_id") or None, obj.get("id")
+
+
+def payment_mismatches(transaction: EscrowTransaction, intent: Dict[str, Any]) -> List[str]:
+    """Why an intent cannot pay for a transaction (empty if it can)"""
+    mismatches = []
+    if transaction.payment_transaction_id and transaction.payment_transaction_id != intent.get("id"):
+        mismatches.append("payment_intent")
+    if Decimal(intent.get("amount") or 0) != transaction.total_amount * 100:
+        mismatches.append("amount")
+    if (intent.get("currency") or "").upper() != Currency(transaction.currency).value:
+        mismatches.append("currency")
+    if (intent.get("metadata") or {}).get("user_id") != str(transaction.buyer_id):
+        mismatches.append("payer")
+    return mismatches
+
+
+def alert_staff(db: AsyncSession, transaction: EscrowTransaction, alert: str, **details):
+    """Staff are alerted by the critical notification sink of the outbox dispatcher"""
+    logger.warning("ESCROW transaction %s: %s %s", transaction.transaction_id, alert, details)
+    record_event(db, transaction, PAYMENT_ALERT, transaction_payload(transaction, alert=alert, **details))
+
+
+def reject_intent(db: AsyncSession, transaction: EscrowTransaction, intent: Dict[str, Any]) -> Optional[str]:
+    """Alert about an intent that does not match its transaction; returns the event result if it does not"""
+    mismatches = payment_mismatches(transaction, intent)
+    if not mismatches:
+        return None
+    alert_staff(
+        db, transaction, "payment_mismatch", payment_intent_id=intent.get("id"), mismatches=mismatches,
+        intent_status=intent.get("status")
+    )
+    return "payment_mismatch"
+
+
+async def apply_payment_held(db: AsyncSession, transaction: EscrowTransaction, intent: Dict[str, Any], payment_status: str) -> str:
+    """Funds authorized (manual capture) or captured: record them, post them to the ledger and leave PENDING_PAYMENT"""
+    rejected = reject_intent(db, transaction, intent)
+    if rejected:
+        return rejected
+    now = datetime.utcnow()
+    transaction.payment_transaction_id = intent["id"]
+    if transaction.payment_status != "completed":
+        transaction.payment_status = payment_status
+    transaction.payment_processed_at = transaction.payment_processed_at or now
+    await post_intent(db, intent, transaction.id, transaction.status, transaction.escrow_fee)
+    if transaction.status != EscrowStatus.PENDING_PAYMENT:
+        return "payment_recorded"
+
+    transaction.status = EscrowStatus.PAYMENT_RECEIVED
+    transaction.payment_date = now
+    await record_status_change(db, transaction, EscrowStatus.PENDING_PAYMENT)
+    record_event(db, transaction, STATUS_CHANGED, transaction_payload(
+        transaction, operation="pay", from_status=EscrowStatus.PENDING_PAYMENT,
+        to_status=EscrowStatus.PAYMENT_RECEIVED, actor_id=None, payment_intent_id=intent["id"]
+    ))
+    return "payment_received"
+
+
+async def apply_payment_authorized(db: AsyncSession, transaction: EscrowTransaction, intent: Dict[str, Any]) -> str:
+    return await apply_payment_held(db, transaction, intent, "authorized")
+
+
+async def apply_payment_succeeded(db: AsyncSession, transaction: EscrowTransaction, intent: Dict[str, Any]) -> str:
+    return await apply_payment_held(db, transaction, intent, "completed")
+
+
+async def apply_payment_failed(db: AsyncSession, transaction: EscrowTransaction, intent: Dict[str, Any]) -> str:
+    rejected = reject_intent(db, transaction, intent)
+    if rejected:
+        return rejected
+    # A failed attempt delivered after a later successful one changes nothing
+    if transaction.payment_status in ("authorized", "completed"):
+        return "stale_failure"
+    transaction.payment_status = "failed"
+    return "payment_failed"
+
+
+async def apply_payment_canceled(db: AsyncSession, transaction: EscrowTransaction, intent: Dict[str, Any]) -> str:
+    """The transaction's authorization was canceled: the held funds are gone, so void the hold"""
+    if transaction.payment_transaction_id != intent.get("id"):
+        # An abandoned intent that never paid for the transaction
+        return "other_intent_canceled"
+    # Captured intents cannot be canceled; an out-of-order event changes nothing
+    if transaction.payment_status == "completed":
+        return "stale_cancel"
+    transaction.payment_status = "canceled"
+    await post_intent(db, intent, transaction.id, transaction.status, transaction.escrow_fee)
+    if transaction.status != EscrowStatus.PENDING_PAYMENT:
+        alert_staff(
+            db, transaction, "authorization_canceled", payment_intent_id=intent.get("id"),
+            cancellation_reason=intent.get("cancellation_reason"), status=EscrowStatus(transaction.status).value
+        )
+    return "payment_canceled"
+
+
+async def apply_dispute_created(db: AsyncSession, transaction: EscrowTransaction, dispute: Dict[str, Any]) -> str:
+    """
+    A chargeback opens an ESCROW dispute on behalf of the buyer (the cardholder) where the
+    lifecycle allows a dispute; otherwise it is recorded on the transaction for staff
+    """
+    if transaction.status == EscrowStatus.DISPUTED:
+        transaction.dispute_info = {**(transaction.dispute_info or {}), "processor_dispute_id": dispute.get("id")}
+        return "already_disputed"
+
+    reason = f"chargeback: {dispute.get('reason') or 'unknown'}"[:100]
+    amount = (dispute.get("amount") or 0) / 100
+    if "dispute" not in ESCROW_TRANSITIONS.get(EscrowStatus(transaction.status).value, {}):
+        chargeback = {
+            "processor_dispute_id": dispute.get("id"),
+            "reason": reason,
+            "amount": f"{amount:.2f}",
+            "currency": (dispute.get("currency") or "").upper(),
+            "status": EscrowStatus(transaction.status).value,
+            "created_at": datetime.utcnow().isoformat()
+        }
+        dispute_info = transaction.dispute_info or {}
+        transaction.dispute_info = {**dispute_info, "chargebacks": [*dispute_info.get("chargebacks", []), chargeback]}
+        alert_staff(db, transaction, "chargeback", **chargeback)
+        return "chargeback_recorded"
+    escrow_dispute = EscrowDispute(
+        transaction_id=transaction.id,
+        initiated_by_id=transaction.buyer_id,
+        reason=reason,
+        description=f"Processor dispute {dispute.get('id')} for {amount:.2f} {(dispute.get('currency') or '').upper()}"
+    )
+    db.add(escrow_dispute)
+    await db.flush()
+
+    previous_status = transaction.status
+    transaction.status = EscrowStatus.DISPUTED
+    transaction.dispute_info = {
+        "is_disputed": True,
+        "dispute_id": escrow_dispute.id,
+        "initiated_by": transaction.buyer_id,
+        "reason": reason,
+        "processor_dispute_id": dispute.get("id"),
+        "created_at": datetime.utcnow().isoformat()
+    }
+    await record_status_change(db, transaction, previous_status)
+    record_event(db, transaction, STATUS_CHANGED, transaction_payload(
+        transaction, operation="dispute", from_status=previous_status, to_status=EscrowStatus.DISPUTED,
+        actor_id=None, dispute_id=escrow_dispute.id, reason=reason
+    ))
+    return "disputed"
+
+
+EVENT_HANDLERS = {
+    PAYMENT_AUTHORIZED: apply_payment_authorized,
+    PAYMENT_SUCCEEDED: apply_payment_succeeded,
+    PAYMENT_FAILED: apply_payment_failed,
+    PAYMENT_CANCELED: apply_payment_canceled,
+    DISPUTE_CREATED: apply_dispute_created,
+}
+
+
+async def apply_events(db: AsyncSession, events: Sequence[PaymentWebhookEvent]):
+    """Apply claimed events in order; the caller commits"""
+    references = [_references(event) for event in events]
+    transaction_ids = {transaction_id for transaction_id, _ in references if transaction_id}
+    intent_ids = {intent_id for _, intent_id in references if intent_id}
+
+    conditions = []
+    if transaction_ids:
+        conditions.append(EscrowTransaction.transaction_id.in_(transaction_ids))
+    if intent_ids:
+        conditions.append(EscrowTransaction.payment_transaction_id.in_(intent_ids))
+    by_transaction_id: Dict[str, EscrowTransaction] = {}
+    by_intent_id: Dict[str, EscrowTransaction] = {}
+    if conditions:
+        transactions = (await db.execute(
+            select(EscrowTransaction).where(or_(*conditions)).with_for_update()
+        )).scalars().all()
+        for transaction in transactions:
+            by_transaction_id[transaction.transaction_id] = transaction
+            if transaction.payment_transaction_id:
+                by_intent_id[transaction.payment_transaction_id] = transaction
+
+    now = datetime.utcnow()
+    for event, (transaction_id, intent_id) in zip(events, references):
+        transaction = by_transaction_id.get(transaction_id) or by_intent_id.get(intent_id)
+        event.attempts += 1
+        event.processed_at = now
+        if event.event_type != DISPUTE_CREATED:
+            await update_intent_status(db, event_object(event.payload))
+        if transaction is None:
+            event.status = "ignored"
+            event.result = "no_matching_transaction"
+            continue
+        event.result = await EVENT_HANDLERS[event.event_type](db, transaction, event_object(event.payload))
+        event.status = "ignored" if event.result in IGNORED_RESULTS else "processed"
+        event.last_error = None
+        if transaction.payment_transaction_id:
+            by_intent_id[transaction.payment_transaction_id] = transaction
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff after the given number of failed attempts"""
+    delay = settings.payment_webhook_retry_base_seconds * (2 ** (attempts - 1))
+    return min(delay, settings.payment_webhook_retry_max_seconds)
+
+
+async def claim_events(db: AsyncSession, batch_size: int, event_ids: Optional[List[int]] = None) -> List[PaymentWebhookEvent]:
+    """Lock due pending events in processor order"""
+    query = select(PaymentWebhookEvent).where(
+        PaymentWebhookEvent.status == "pending",
+        PaymentWebhookEvent.available_at <= datetime.utcnow()
+    )
+    if event_ids is not None:
+        query = query.where(PaymentWebhookEvent.id.in_(event_ids))
+    return list((await db.execute(
+        query
+        .order_by(PaymentWebhookEvent.event_created, PaymentWebhookEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).scalars().all())
+
+
+async def process_batch(session_factory, batch_size: int) -> int:
+    """Claim and apply one batch of events; returns the number of events claimed"""
+    started_at = time.perf_counter()
+    async with session_factory() as db:
+        events = await claim_events(db, batch_size)
+        if not events:
+            await db.rollback()
+            return 0
+        event_ids = [event.id for event in events]
+        try:
+            await apply_events(db, events)
+            await db.commit()
+            webhook_metrics.record_batch(events, time.perf_counter() - started_at)
+            return len(events)
+        except Exception:
+            await db.rollback()
+            logger.warning("Webhook batch failed; applying its %s events one at a time", len(event_ids), exc_info=True)
+
+    applied = []
+    for event_id in event_ids:
+        async with session_factory() as db:
+            claimed = await claim_events(db, 1, [event_id])
+            if not claimed:
+                continue
+            try:
+                await apply_events(db, claimed)
+                await db.commit()
+            except Exception as exc:
+                await db.rollback()
+                claimed = await claim_events(db, 1, [event_id])
+                if not claimed:
+                    continue
+                event = claimed[0]
+                event.attempts += 1
+                event.last_error = f"{exc.__class__.__name__}: {exc}"
+                if event.attempts >= settings.payment_webhook_max_attempts:
+                    event.status = "failed"
+                    logger.error("Webhook event %s failed after %s attempts: %s", event.event_id, event.attempts, exc)
+                else:
+                    event.available_at = datetime.utcnow() + timedelta(seconds=retry_delay(event.attempts))
+                await db.commit()
+            applied.extend(claimed)
+    webhook_metrics.record_batch(applied, time.perf_counter() - started_at)
+    return len(event_ids)
+
+
+class WebhookWorker:
+    """Drains the webhook inbox on the event loop, polling when it is empty"""
+
+    def __init__(self, poll_interval_seconds: Optional[float] = None, batch_size: Optional[int] = None):
+        self.poll_interval_seconds = poll_interval_seconds or settings.payment_webhook_poll_interval_seconds
+        self.batch_size = batch_size or settings.payment_webhook_batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        """Apply events until none are due; returns the number of events claimed"""
+        from shared.database import AsyncSessionLocal
+
+        total = 0
+        while True:
+            claimed = await process_batch(AsyncSessionLocal, self.batch_size)
+            total += claimed
+            if claimed < self.batch_size:
+                return total
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Webhook processing failed")
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "poll_interval_seconds": self.poll_interval_seconds,
+            "batch_size": self.batch_size,
+            "ingest_in_flight": webhook_ingest_guard.in_flight,
+            **webhook_metrics.snapshot()
+        }
+
+
+webhook_worker = WebhookWorker()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply stored processor webhook events")
+    parser.add_argument("--once", action="store_true", help="Apply the due events once and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.once:
+        print(asyncio.run(webhook_worker.run_once()))
+    else:
+        asyncio.run(webhook_worker.run_forever())
@@ -14,6 +14,17 @@ from .auth import get_current_user
 from .database import get_db
 from sqlalchemy.orm import Session
 
+# ESCROW lifecycle: status -> {operation: resulting status}
+ESCROW_TRANSITIONS: Dict[str, Dict[str, str]] = {
+    "pending_agreement": {"accept": "pending_payment", "cancel": "cancelled", "expire": "expired"},
+    "pending_payment": {"pay": "payment_received", "cancel": "cancelled"},
+    "payment_received": {"ship": "item_shipped"},
+    "item_shipped": {"deliver": "inspection_period"},
+    "inspection_period": {"approve": "buyer_approved", "dispute": "disputed", "auto_release": "buyer_approved"},
+    "buyer_approved": {"seller_approve": "funds_released"},
+    "funds_released": {}
+}
+
 class AuditMiddleware(BaseHTTPMiddleware):
     """Middleware for audit logging and compliance tracking"""
     
@@ -253,23 +264,13 @@ class ComplianceValidator:
     
     def validate_escrow_flow(self, transaction_status: str, operation: str) -> Dict[str, Any]:
         """Validate ESCROW flow compliance"""
-        valid_transitions = {
-            "pending_agreement": ["accept", "cancel"],
-            "pending_payment": ["pay", "cancel"],
-            "payment_received": ["ship"],
-            "item_shipped": ["deliver"],
-            "inspection_period": ["approve", "dispute"],
-            "buyer_approved": ["seller_approve"],
-            "funds_released": []
-        }
-        
-        if transaction_status not in valid_transitions:
+        if transaction_status not in ESCROW_TRANSITIONS:
             return {
                 "valid": False,
                 "error": f"Invalid transaction status: {transaction_status}"
             }
         
-        allowed_operations = valid_transitions[transaction_status]
+        allowed_operations = list(ESCROW_TRANSITIONS[transaction_status])
         if operation not in allowed_operations:
             return {
                 "valid": False,
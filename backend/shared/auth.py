@@ -1,17 +1,23 @@
 """
 Authentication and authorization utilities
 """
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Any, Dict, Optional, Tuple, Union
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
-from .database import get_db
-from .models import User, UserRole
+from .cache import InMemoryTTLCache, create_cache
+from .config import settings
+from .database import get_db, get_read_db
+from .models import User, UserRole, UserStatus
 from .schemas import TokenData
+import hashlib
 import os
+import time
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
@@ -19,12 +25,64 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing; hashes made with a different cost are flagged for rehash on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+    bcrypt__max_rounds=settings.bcrypt_rounds
+)
 
 # Security scheme
 security = HTTPBearer()
 
+# Cache of decoded tokens keyed by a digest of the token; entries never outlive the token's exp
+token_cache = InMemoryTTLCache(
+    max_entries=settings.token_cache_max_entries,
+    default_ttl=settings.token_cache_max_ttl_seconds
+)
+
+# Cache of slim authenticated principals keyed by user id. Committed user changes evict the
+# entry (see _invalidate_stale_principals); with the in-process "memory" backend only this
+# process's entry, so other services see the change after up to principal_cache_ttl_seconds
+principal_cache = create_cache(
+    settings.principal_cache_backend,
+    namespace="principal",
+    default_ttl=settings.principal_cache_ttl_seconds,
+    max_entries=settings.principal_cache_max_entries
+)
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """Authenticated user fields needed for authorization checks"""
+    id: int
+    email: str
+    role: UserRole
+    status: UserStatus
+    is_email_verified: bool
+    is_phone_verified: bool
+    is_identity_verified: bool
+    is_kyc_verified: bool
+
+    def to_cache(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["role"] = self.role.value
+        data["status"] = self.status.value
+        return data
+
+    @classmethod
+    def from_cache(cls, data: Dict[str, Any]) -> "UserPrincipal":
+        return cls(**{**data, "role": UserRole(data["role"]), "status": UserStatus(data["status"])})
+
+
+# Columns loaded for a principal (and whose changes invalidate the cache)
+PRINCIPAL_ATTRIBUTES = [
+    "email", "role", "status", "is_email_verified",
+    "is_phone_verified", "is_identity_verified", "is_kyc_verified"
+]
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
@@ -58,13 +116,46 @@ def create_refresh_token(data: dict) -> str:
     return encoded_jwt
 
 
-def verify_token(token: str, token_type: str = "access") -> TokenData:
-    """Verify and decode a token"""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def verify_token(token: str, token_type: str = "access") -> TokenData:
+    """Verify and decode a token, reusing the result for repeated tokens until they expire"""
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    cached = token_cache.get(cache_key)
+    if cached is not None:
+        cached_type, token_data = cached
+        if cached_type != token_type:
+            raise _credentials_exception()
+        return token_data
+    
+    token_data, expires_at = decode_token(token, token_type)
+    ttl = token_cache.default_ttl
+    if expires_at is not None:
+        ttl = min(expires_at - time.time(), ttl)
+    token_cache.set(cache_key, (token_type, token_data), ttl=ttl)
+    return token_data
+
+
+def user_id_from_authorization(authorization: Optional[str]) -> Optional[str]:
+    """User id (token subject) of a valid bearer access token, or None"""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    try:
+        return str(verify_token(token.strip()).user_id)
+    except HTTPException:
+        return None
+
+
+def decode_token(token: str, token_type: str = "access") -> Tuple[TokenData, Optional[float]]:
+    """Verify and decode a token without caching; returns the token data and its exp timestamp"""
+    credentials_exception = _credentials_exception()
     
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -72,6 +163,7 @@ def verify_token(token: str, token_type: str = "access") -> TokenData:
         email: str = payload.get("email")
         role: str = payload.get("role")
         token_type_from_payload: str = payload.get("type")
+        expires_at = payload.get("exp")
         
         if user_id is None or email is None or token_type_from_payload != token_type:
             raise credentials_exception
@@ -81,16 +173,105 @@ def verify_token(token: str, token_type: str = "access") -> TokenData:
             email=email,
             role=UserRole(role) if role else None
         )
-        return token_data
+        return token_data, float(expires_at) if expires_at is not None else None
     except JWTError:
         raise credentials_exception
 
 
+def load_principal(db: Session, user_id: int) -> Optional[UserPrincipal]:
+    """Load a user's principal from the cache, falling back to a narrow column query"""
+    if principal_cache is not None:
+        cached = principal_cache.get(str(user_id))
+        if cached is not None:
+            return UserPrincipal.from_cache(cached)
+    
+    columns = [getattr(User, attribute) for attribute in PRINCIPAL_ATTRIBUTES]
+    row = db.query(User.id, *columns).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    
+    principal = UserPrincipal(
+        id=row.id,
+        email=row.email,
+        role=UserRole(row.role),
+        status=UserStatus(row.status),
+        is_email_verified=bool(row.is_email_verified),
+        is_phone_verified=bool(row.is_phone_verified),
+        is_identity_verified=bool(row.is_identity_verified),
+        is_kyc_verified=bool(row.is_kyc_verified)
+    )
+    if principal_cache is not None:
+        principal_cache.set(str(user_id), principal.to_cache())
+    return principal
+
+
+def invalidate_principal(user_id: int):
+    """Drop a user's cached principal"""
+    if principal_cache is not None:
+        principal_cache.delete(str(user_id))
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_stale_principals(session, flush_context):
+    """Remember users whose status, role or verification flags changed in this flush"""
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, User) or obj.id is None:
+            continue
+        state = inspect(obj)
+        if obj in session.deleted or any(
+            state.attrs[attribute].history.has_changes() for attribute in PRINCIPAL_ATTRIBUTES
+        ):
+            session.info.setdefault("stale_principals", set()).add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_stale_principals(session):
+    """Invalidate cached principals once their changes are committed"""
+    for user_id in session.info.pop("stale_principals", ()):
+        invalidate_principal(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stale_principals(session):
+    session.info.pop("stale_principals", None)
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
+) -> UserPrincipal:
+    """Get current authenticated user as a cached principal"""
+    token_data = verify_token(credentials.credentials)
+    
+    principal = load_principal(db, token_data.user_id)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found"
+        )
+    
+    _check_user_can_access(principal.status)
+    return principal
+
+
+def get_current_db_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
 ) -> User:
-    """Get current authenticated user"""
+    """Get current authenticated user as a full database row (for endpoints that modify it)"""
+    return _load_authenticated_user(credentials, db)
+
+
+def get_current_user_readonly(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_read_db)
+) -> User:
+    """Get current authenticated user from the read replica (for read-only endpoints)"""
+    return _load_authenticated_user(credentials, db)
+
+
+def _load_authenticated_user(credentials: HTTPAuthorizationCredentials, db: Session) -> User:
+    """Load the user behind a bearer token and check that the account can access"""
     token = credentials.credentials
     token_data = verify_token(token)
     
@@ -101,9 +282,14 @@ def get_current_user(
             detail="User not found"
         )
     
+    _check_user_can_access(user.status)
+    return user
+
+
+def _check_user_can_access(user_status: Union[UserStatus, str]):
+    """Reject users whose status does not allow access"""
     # Check if user can access - allow various verified states
-    from shared.models import UserStatus
-    user_status = user.status.value if hasattr(user.status, 'value') else str(user.status)
+    user_status = user_status.value if hasattr(user_status, 'value') else str(user_status)
     # Allow access for active, fully_verified, email_verified, and verified states
     allowed_statuses = [
         UserStatus.ACTIVE.value, 
@@ -118,11 +304,9 @@ def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"User account is not active (status: {user_status})"
         )
-    
-    return user
 
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+def get_current_active_user(current_user: UserPrincipal = Depends(get_current_user)) -> UserPrincipal:
     """Get current active user"""
     if current_user.status != "active":
         raise HTTPException(
@@ -134,7 +318,7 @@ def get_current_active_user(current_user: User = Depends(get_current_user)) -> U
 
 def require_roles(allowed_roles: list[UserRole]):
     """Decorator to require specific roles"""
-    def role_checker(current_user: User = Depends(get_current_active_user)) -> User:
+    def role_checker(current_user: UserPrincipal = Depends(get_current_active_user)) -> UserPrincipal:
         if current_user.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -144,7 +328,7 @@ def require_roles(allowed_roles: list[UserRole]):
     return role_checker
 
 
-def require_admin(current_user: User = Depends(get_current_active_user)) -> User:
+def require_admin(current_user: UserPrincipal = Depends(get_current_active_user)) -> UserPrincipal:
     """Require admin role"""
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(
@@ -154,7 +338,7 @@ def require_admin(current_user: User = Depends(get_current_active_user)) -> User
     return current_user
 
 
-def require_verification(current_user: User = Depends(get_current_active_user)) -> User:
+def require_verification(current_user: UserPrincipal = Depends(get_current_active_user)) -> UserPrincipal:
     """Require verified user"""
     if not current_user.is_identity_verified:
         raise HTTPException(
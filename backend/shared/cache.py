@@ -0,0 +1,168 @@
+"""
+Cache backends shared by all microservices
+Values must be JSON serializable so every backend can store them
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import json
+import logging
+import threading
+import time
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """Interface for key/value caches with per-entry expiry"""
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemoryTTLCache(CacheBackend):
+    """Bounded in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 10000, default_ttl: float = 60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache stored in Redis (or any client exposing get/set(ex=)/delete), shared by every
+    process. While Redis is unreachable lookups are misses and writes are skipped.
+    """
+
+    def __init__(self, client, namespace: str, default_ttl: float = 60):
+        self.client = client
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _failed(self, operation: str, key: str):
+        self.errors += 1
+        logger.warning("Redis cache %s of %s failed", operation, self._key(key), exc_info=True)
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self.client.get(self._key(key))
+        except Exception:
+            self._failed("get", key)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        try:
+            self.client.set(self._key(key), json.dumps(value, default=str), ex=max(int(ttl), 1))
+        except Exception:
+            self._failed("set", key)
+
+    def delete(self, key: str):
+        # A failed delete leaves the entry until its TTL expires
+        try:
+            self.client.delete(self._key(key))
+        except Exception:
+            self._failed("delete", key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def create_cache(backend: str, namespace: str, default_ttl: float,
+                 max_entries: int = 10000) -> Optional[CacheBackend]:
+    """
+    Create a cache for the configured backend: "memory", "redis" or "none"
+    """
+    backend = (backend or "none").lower()
+    if backend == "memory":
+        return InMemoryTTLCache(max_entries=max_entries, default_ttl=default_ttl)
+    if backend == "redis":
+        import redis
+        # Short timeouts: an unreachable Redis degrades to cache misses instead of stalling requests
+        client = redis.Redis.from_url(settings.redis_url, socket_connect_timeout=1, socket_timeout=1)
+        return RedisCache(client, namespace=namespace, default_ttl=default_ttl)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown cache backend: {backend}")
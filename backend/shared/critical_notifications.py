@@ -194,6 +194,29 @@ class CriticalNotificationManager:
         
         return notification
     
+    def handle_payment_alert(self, 
+                           transaction_id: str,
+                           alert: str,
+                           context: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle processor payments, cancellations or chargebacks that need staff review"""
+        
+        notification = self.create_critical_notification(
+            notification_type=NotificationType.CRITICAL_CHANGE,
+            title="Payment Requires Review",
+            message=f"Processor {alert} for transaction {transaction_id} requires review.",
+            context={
+                "transaction_id": transaction_id,
+                "alert": alert,
+                **context
+            },
+            requires_confirmation=True
+        )
+        
+        # Send immediate notification
+        self._send_immediate_notification(notification)
+        
+        return notification
+    
     def handle_document_requires_review(self, 
                                       document_id: str,
                                       document_type: str,
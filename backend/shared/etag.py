@@ -0,0 +1,67 @@
+"""
+ETag helpers for conditional GET requests shared by all microservices
+ETags are computed from a cheap state token (row version, counters, timestamps)
+so a 304 can be returned before the full resource is loaded or serialized.
+"""
+from typing import Any, Dict, Optional
+import hashlib
+
+from fastapi import Response, status
+
+from .cache import InMemoryTTLCache
+
+# Revalidate on every request; browsers then send If-None-Match automatically
+ETAG_CACHE_CONTROL = "private, no-cache"
+
+
+class ETagCache:
+    """Computed ETags keyed by resource, reused while the resource's state token is unchanged"""
+
+    def __init__(self, max_entries: int = 50000, ttl_seconds: float = 3600):
+        self._cache = InMemoryTTLCache(max_entries=max_entries, default_ttl=ttl_seconds)
+
+    def etag(self, resource: str, state: Any) -> str:
+        """Get the strong ETag for a resource in the given state"""
+        token = str(state)
+        cached = self._cache.get(resource)
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        digest = hashlib.sha256(f"{resource}|{token}".encode()).hexdigest()[:32]
+        etag = f'"{digest}"'
+        self._cache.set(resource, (token, etag))
+        return etag
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+etag_cache = ETagCache()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    """Empty 304 response carrying the current ETag"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL}
+    )
+
+
+def set_etag(response: Response, etag: str):
+    """Attach an ETag to a full response"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = ETAG_CACHE_CONTROL
@@ -0,0 +1,403 @@
+"""
+Idempotency-Key support for retried POST/PUT requests
+The first request with a key runs; retries with the same key and payload get the
+stored response replayed, and concurrent duplicates wait for the in-flight one.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import time
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from .config import settings
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Headers that are recomputed or must not be replayed
+SKIPPED_RESPONSE_HEADERS = {"content-length", "set-cookie", "date", "server"}
+
+
+class IdempotencyStore:
+    """
+    Interface for idempotency records.
+    begin() atomically claims a key and returns None, or returns the existing record.
+    """
+
+    async def begin(self, key: str, fingerprint: str, ttl: float) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def complete(self, key: str, response: Dict[str, Any], ttl: float):
+        raise NotImplementedError
+
+    async def release(self, key: str):
+        raise NotImplementedError
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """Process-local store (tests and single-process deployments)"""
+
+    def __init__(self):
+        self._records: Dict[str, Tuple[Dict[str, Any], float]] = {}
+
+    def _live(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        record, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._records[key]
+            return None
+        return record
+
+    async def begin(self, key: str, fingerprint: str, ttl: float) -> Optional[Dict[str, Any]]:
+        existing = self._live(key)
+        if existing is not None:
+            return existing
+        self._records[key] = ({"fingerprint": fingerprint, "status": "in_progress"}, time.monotonic() + ttl)
+        return None
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._live(key)
+
+    async def complete(self, key: str, response: Dict[str, Any], ttl: float):
+        record = self._live(key)
+        if record is not None:
+            self._records[key] = ({**record, "status": "completed", "response": response}, time.monotonic() + ttl)
+
+    async def release(self, key: str):
+        self._records.pop(key, None)
+
+
+class RedisIdempotencyStore(IdempotencyStore):
+    """Store in Redis (or any asyncio client exposing get/set(nx=, ex=)/delete)"""
+
+    def __init__(self, client, namespace: str = "idempotency"):
+        self.client = client
+        self.namespace = namespace
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def begin(self, key: str, fingerprint: str, ttl: float) -> Optional[Dict[str, Any]]:
+        record = json.dumps({"fingerprint": fingerprint, "status": "in_progress"})
+        if await self.client.set(self._key(key), record, nx=True, ex=max(int(ttl), 1)):
+            return None
+        return await self.get(key)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self.client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def complete(self, key: str, response: Dict[str, Any], ttl: float):
+        record = await self.get(key) or {}
+        record.update({"status": "completed", "response": response})
+        await self.client.set(self._key(key), json.dumps(record), ex=max(int(ttl), 1))
+
+    async def release(self, key: str):
+        await self.client.delete(self._key(key))
+
+
+class DatabaseIdempotencyStore(IdempotencyStore):
+    """Store in the idempotency_keys table; the primary key makes begin() atomic"""
+
+    def __init__(self, session_factory=None):
+        self._session_factory = session_factory
+
+    @property
+    def session_factory(self):
+        if self._session_factory is None:
+            from .database import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    @staticmethod
+    def _to_record(row) -> Dict[str, Any]:
+        record = {"fingerprint": row.fingerprint, "status": row.status}
+        if row.status == "completed":
+            record["response"] = {
+                "status": row.response_status,
+                "headers": row.response_headers or [],
+                "body": row.response_body or ""
+            }
+        return record
+
+    async def begin(self, key: str, fingerprint: str, ttl: float) -> Optional[Dict[str, Any]]:
+        from .models import IdempotencyKey
+
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            # Expired keys can be reused
+            await db.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.expires_at <= now)
+            )
+            db.add(IdempotencyKey(
+                key=key,
+                fingerprint=fingerprint,
+                status="in_progress",
+                expires_at=now + timedelta(seconds=ttl)
+            ))
+            try:
+                await db.commit()
+                return None
+            except IntegrityError:
+                await db.rollback()
+        return await self.get(key)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        from .models import IdempotencyKey
+
+        async with self.session_factory() as db:
+            row = (await db.execute(
+                select(IdempotencyKey).where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.expires_at > datetime.utcnow()
+                )
+            )).scalar_one_or_none()
+            return self._to_record(row) if row is not None else None
+
+    async def complete(self, key: str, response: Dict[str, Any], ttl: float):
+        from .models import IdempotencyKey
+
+        async with self.session_factory() as db:
+            await db.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.key == key)
+                .values(
+                    status="completed",
+                    response_status=response["status"],
+                    response_headers=response["headers"],
+                    response_body=response["body"],
+                    expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+                )
+            )
+            await db.commit()
+
+    async def release(self, key: str):
+        from .models import IdempotencyKey
+
+        async with self.session_factory() as db:
+            await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+            await db.commit()
+
+    async def purge_expired(self) -> int:
+        """Delete expired keys; returns the number removed"""
+        from .models import IdempotencyKey
+
+        async with self.session_factory() as db:
+            result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.utcnow()))
+            await db.commit()
+            return result.rowcount
+
+
+def create_idempotency_store(backend: Optional[str] = None) -> IdempotencyStore:
+    """Create the store for the configured backend: "database", "redis" or "memory" """
+    backend = (backend or settings.idempotency_backend).lower()
+    if backend == "database":
+        return DatabaseIdempotencyStore()
+    if backend == "redis":
+        import redis.asyncio
+        return RedisIdempotencyStore(redis.asyncio.Redis.from_url(settings.redis_url))
+    if backend == "memory":
+        return InMemoryIdempotencyStore()
+    raise ValueError(f"Unknown idempotency backend: {backend}")
+
+
+def _caller_scope(headers: Headers) -> str:
+    """User a key belongs to; requests without a valid token are scoped to their header"""
+    from .auth import user_id_from_authorization
+
+    authorization = headers.get("authorization")
+    user_id = user_id_from_authorization(authorization)
+    if user_id is not None:
+        return f"user:{user_id}"
+    return "anonymous:" + hashlib.sha256((authorization or "").encode()).hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware applying Idempotency-Key semantics to selected routes.
+    Keys are scoped to the authenticated user (the token subject), so they survive token
+    refreshes; a key reused with a different method, path or body is rejected with 422.
+    """
+
+    def __init__(self, app, routes: Iterable[Tuple[str, str]], store: Optional[IdempotencyStore] = None,
+                 ttl_seconds: Optional[float] = None, wait_seconds: Optional[float] = None):
+        self.app = app
+        self.routes = [(method.upper(), re.compile(pattern)) for method, pattern in routes]
+        self.store = store or create_idempotency_store()
+        self.ttl_seconds = ttl_seconds or settings.idempotency_ttl_seconds
+        self.wait_seconds = wait_seconds or settings.idempotency_wait_seconds
+        self._in_flight: Dict[Tuple[int, str], asyncio.Future] = {}
+
+    def _applies(self, scope) -> bool:
+        return any(
+            scope["method"] == method and pattern.match(scope["path"])
+            for method, pattern in self.routes
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._applies(scope):
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        client_key = headers.get(IDEMPOTENCY_HEADER)
+        if client_key is None:
+            return await self.app(scope, receive, send)
+        if not client_key or len(client_key) > MAX_KEY_LENGTH:
+            return await JSONResponse(
+                {"detail": f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters"}, status_code=400
+            )(scope, receive, send)
+
+        body = await _read_body(receive)
+        key = hashlib.sha256(f"{_caller_scope(headers)}:{client_key}".encode()).hexdigest()
+        fingerprint = _request_fingerprint(scope, body)
+
+        # Duplicates arriving on this event loop while the original runs share its result
+        in_flight_key = (id(asyncio.get_running_loop()), key)
+        in_flight = self._in_flight.get(in_flight_key)
+        if in_flight is not None:
+            try:
+                response = await asyncio.wait_for(asyncio.shield(in_flight), self.wait_seconds)
+            except asyncio.TimeoutError:
+                response = None
+            return await self._respond_with(response, fingerprint, scope, receive, send)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[in_flight_key] = future
+        response = None
+        claimed = False
+        try:
+            existing = await self.store.begin(key, fingerprint, self.ttl_seconds)
+            if existing is not None:
+                # Started earlier or by another process
+                if existing["fingerprint"] == fingerprint and existing["status"] != "completed":
+                    existing = await self._wait_for_completion(key)
+                if existing is not None:
+                    response = {**existing.get("response", {}), "fingerprint": existing["fingerprint"]}
+                return await self._respond_with(response, fingerprint, scope, receive, send)
+
+            claimed = True
+            response = await self._run(scope, body, receive, send)
+            response["fingerprint"] = fingerprint
+            if response["status"] < 500:
+                await self.store.complete(key, response, self.ttl_seconds)
+            else:
+                # Server errors are not stored so the client can retry
+                await self.store.release(key)
+        except BaseException:
+            response = None
+            if claimed:
+                await self.store.release(key)
+            raise
+        finally:
+            self._in_flight.pop(in_flight_key, None)
+            future.set_result(response)
+
+    async def _respond_with(self, response: Optional[Dict[str, Any]], fingerprint: str, scope, receive, send):
+        """Replay a stored response, or explain why it cannot be replayed"""
+        if response is None:
+            return await _in_progress_response()(scope, receive, send)
+        if response["fingerprint"] != fingerprint:
+            return await _mismatch_response()(scope, receive, send)
+        if "status" not in response:
+            return await _in_progress_response()(scope, receive, send)
+        return await _replay(response, scope, receive, send)
+
+    async def _run(self, scope, body: bytes, receive, send) -> Dict[str, Any]:
+        """Run the endpoint, streaming its response to the client while capturing it"""
+        captured: Dict[str, Any] = {"status": 500, "headers": [], "chunks": []}
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", [])
+                    if name.decode("latin-1").lower() not in SKIPPED_RESPONSE_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                captured["chunks"].append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, replay_receive, capture_send)
+        return {
+            "status": captured["status"],
+            "headers": captured["headers"],
+            "body": base64.b64encode(b"".join(captured["chunks"])).decode()
+        }
+
+    async def _wait_for_completion(self, key: str) -> Optional[Dict[str, Any]]:
+        """Poll the store while another process finishes the original request"""
+        deadline = time.monotonic() + self.wait_seconds
+        delay = 0.05
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            record = await self.store.get(key)
+            if record is None:
+                return None
+            if record["status"] == "completed":
+                return record
+            delay = min(delay * 2, 0.5)
+        return None
+
+
+def _request_fingerprint(scope, body: bytes) -> str:
+    return hashlib.sha256(b"\n".join([
+        scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body
+    ])).hexdigest()
+
+
+async def _read_body(receive) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.request":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+        elif message["type"] == "http.disconnect":
+            return b"".join(chunks)
+
+
+async def _replay(response: Dict[str, Any], scope, receive, send):
+    body = base64.b64decode(response["body"])
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response["headers"]]
+    headers.append((b"content-length", str(len(body)).encode()))
+    headers.append((REPLAYED_HEADER.lower().encode(), b"true"))
+    await send({"type": "http.response.start", "status": response["status"], "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _mismatch_response() -> JSONResponse:
+    return JSONResponse(
+        {"detail": f"{IDEMPOTENCY_HEADER} was already used with a different request"},
+        status_code=422
+    )
+
+
+def _in_progress_response() -> JSONResponse:
+    return JSONResponse(
+        {"detail": "A request with this Idempotency-Key is still being processed. Please retry"},
+        status_code=409
+    )
@@ -197,3 +197,20 @@ class Notification(Base):
     
     # Relationships
     user = relationship("User", back_populates="notifications")
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # sha256 of the caller and the client's Idempotency-Key header
+    key = Column(String(64), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False, default="in_progress")  # in_progress, completed
+    
+    # Stored response, replayed for retries
+    response_status = Column(Integer, nullable=True)
+    response_headers = Column(JSON, nullable=True)
+    response_body = Column(Text, nullable=True)  # base64
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,44 @@
+"""
+Keyset (cursor) pagination helpers shared by all microservices
+Cursors are opaque URL-safe tokens encoding the sort key of the last row on a page
+"""
+from datetime import datetime
+from typing import Any, Tuple
+import base64
+import json
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode a (created_at, id) sort key as an opaque cursor"""
+    payload = {"c": created_at.isoformat(), "i": row_id}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["c"]), int(payload["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+
+def keyset_after(created_at_column: Any, id_column: Any, cursor: str):
+    """
+    Filter for rows after a cursor when ordering by (created_at DESC, id DESC)
+    """
+    created_at, row_id = decode_cursor(cursor)
+    return or_(
+        created_at_column < created_at,
+        and_(created_at_column == created_at, id_column < row_id)
+    )
@@ -0,0 +1,116 @@
+"""
+Bounded worker pool for bcrypt password hashing and verification
+Keeps CPU-heavy password work off the event loop
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import threading
+import time
+
+from fastapi import HTTPException, status
+
+from .auth import pwd_context
+from .config import settings
+
+
+class PasswordHashPool:
+    """Runs passlib operations in a dedicated thread pool with a bounded wait queue"""
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    async def run(self, func, *args) -> Any:
+        """Run a password operation in the pool, rejecting work when the queue is full"""
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many concurrent authentication requests. Please try again later"
+                )
+            self.queued += 1
+
+        job = {"submitted_at": time.perf_counter(), "dequeued": False}
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._timed, func, job, args)
+        finally:
+            with self._lock:
+                if not job["dequeued"]:
+                    # Cancelled before a worker picked it up
+                    job["dequeued"] = True
+                    self.queued -= 1
+                self.completed += 1
+
+    def _timed(self, func, job: Dict[str, Any], args: tuple) -> Any:
+        started_at = time.perf_counter()
+        with self._lock:
+            if not job["dequeued"]:
+                job["dequeued"] = True
+                self.queued -= 1
+            self.running += 1
+            wait = started_at - job["submitted_at"]
+            self.total_wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self._lock:
+                self.running -= 1
+                self.total_run_seconds += elapsed
+                self.max_run_seconds = max(self.max_run_seconds, elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get queue depth and latency metrics"""
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "bcrypt_rounds": settings.bcrypt_rounds,
+                "avg_wait_ms": round(self.total_wait_seconds / completed * 1000, 3),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "avg_run_ms": round(self.total_run_seconds / completed * 1000, 3),
+                "max_run_ms": round(self.max_run_seconds * 1000, 3)
+            }
+
+
+password_pool = PasswordHashPool(
+    max_workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_max_queue
+)
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password in the worker pool"""
+    return await password_pool.run(pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password in the worker pool"""
+    return await password_pool.run(pwd_context.verify, plain_password, hashed_password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password in the worker pool.
+    Returns a replacement hash when the stored one does not match the configured cost.
+    """
+    return await password_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
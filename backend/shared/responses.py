@@ -0,0 +1,30 @@
+"""
+Response classes shared by all microservices
+"""
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+def _orjson_default(value: Any) -> Any:
+    # Decimals are sent as strings, matching the pydantic JSON output of the other endpoints
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any, option: int = 0) -> bytes:
+    """orjson serialization used by the API responses (Decimals as strings)"""
+    return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS | option)
+
+
+class FastJSONResponse(ORJSONResponse):
+    """
+    orjson response for content that is already plain dicts/lists.
+    Return it directly from an endpoint to skip response_model validation.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
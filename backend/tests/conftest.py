@@ -0,0 +1,128 @@
+"""
+Backend test configuration
+Tests run against a throwaway SQLite database per test (no services or network needed):
+    cd backend && python -m pytest tests
+"""
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+import itertools
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/escrow_tests.db")
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from shared.database import Base
+from shared.models import User, UserRole, UserStatus
+from escrow_service.models import (
+    Currency, DeliveryMethod, EscrowStatus, EscrowTransaction, ItemCategory, ItemCondition
+)
+import payment_service.models  # noqa: F401 (registers the payment tables)
+
+
+@pytest_asyncio.fixture
+async def session_factory(tmp_path):
+    """Async session factory over a fresh database with every table"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def users(session_factory):
+    """Buyer, seller and an unrelated verified client"""
+    async with session_factory() as db:
+        created = {
+            name: User(
+                email=f"{name}@test.local", first_name=name, last_name="Test", hashed_password="x",
+                role=UserRole.CLIENT, status=UserStatus.ACTIVE, is_identity_verified=True
+            )
+            for name in ("buyer", "seller", "other")
+        }
+        db.add_all(created.values())
+        await db.commit()
+        return created
+
+
+@pytest.fixture
+def make_transaction(session_factory, users):
+    """Create a 1,000 MXN transaction (25 fee) between buyer and seller in the given status"""
+    numbers = itertools.count(1)
+
+    async def create(status=EscrowStatus.PENDING_PAYMENT, payment_transaction_id=None) -> EscrowTransaction:
+        async with session_factory() as db:
+            transaction = EscrowTransaction(
+                transaction_id=f"TEST-{next(numbers):06d}",
+                buyer_id=users["buyer"].id,
+                seller_id=users["seller"].id,
+                item_title="Test item",
+                item_description="Test item",
+                item_category=ItemCategory.ELECTRONICS,
+                item_condition=ItemCondition.GOOD,
+                item_estimated_value=Decimal("1000"),
+                price=Decimal("1000"),
+                currency=Currency.MXN,
+                escrow_fee=Decimal("25"),
+                total_amount=Decimal("1025"),
+                delivery_method=DeliveryMethod.PICKUP,
+                status=status,
+                payment_transaction_id=payment_transaction_id
+            )
+            db.add(transaction)
+            await db.commit()
+            return transaction
+
+    return create
+
+
+@pytest_asyncio.fixture
+async def service_database():
+    """
+    The services' own engines (module level, bound to DATABASE_URL above). Their pooled
+    aiosqlite connections belong to the test's event loop, so they are disposed after it.
+    The tables are created as the services do on import.
+    """
+    from shared import database
+
+    database.init_db()
+    yield database
+    await database.dispose_async_engines()
+
+
+_service_user_numbers = itertools.count(1)
+
+
+@pytest.fixture
+def service_users(service_database):
+    """Verified admin, broker, buyer and seller in the services' database, with bearer headers"""
+    from shared.auth import create_access_token
+
+    number = next(_service_user_numbers)
+    with service_database.SessionLocal() as db:
+        created = {
+            name: User(
+                email=f"{name}{number}@service.test.local", first_name=name, last_name="Test", hashed_password="x",
+                role=role, status=UserStatus.ACTIVE, is_identity_verified=True
+            )
+            for name, role in (
+                ("admin", UserRole.ADMIN), ("broker", UserRole.BROKER),
+                ("buyer", UserRole.CLIENT), ("seller", UserRole.CLIENT)
+            )
+        }
+        db.add_all(created.values())
+        db.commit()
+        return {
+            name: SimpleNamespace(id=user.id, headers={"Authorization": "Bearer " + create_access_token(
+                {"sub": str(user.id), "email": user.email, "role": user.role.value}
+            )})
+            for name, user in created.items()
+        }
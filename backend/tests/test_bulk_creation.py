@@ -0,0 +1,43 @@
+"""Bulk escrow creation through the escrow service app"""
+import httpx
+import pytest
+from sqlalchemy import func, select
+
+from escrow_service.main import app
+from escrow_service.models import EscrowTransaction
+from shared.database import AsyncSessionLocal
+from shared.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER
+
+pytestmark = pytest.mark.asyncio
+
+
+def row(seller_id: int, number: int):
+    return {
+        "seller_id": seller_id,
+        "item": {"title": f"Bulk item {number}", "description": "Bulk item", "category": "electronics",
+                 "condition": "good", "estimated_value": "1500"},
+        "terms": {"price": "1500", "delivery_method": "pickup"}
+    }
+
+
+async def created_by(buyer_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(func.count()).select_from(EscrowTransaction).where(EscrowTransaction.buyer_id == buyer_id)
+        )).scalar()
+
+
+async def test_retried_bulk_request_is_replayed(service_users):
+    headers = service_users["broker"].headers
+    rows = [row(service_users["seller"].id, number) for number in range(3)]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        missing_key = await client.post("/transactions/bulk", json=rows, headers=headers)
+        first = await client.post("/transactions/bulk", json=rows, headers={**headers, IDEMPOTENCY_HEADER: "inventory-1"})
+        retried = await client.post("/transactions/bulk", json=rows, headers={**headers, IDEMPOTENCY_HEADER: "inventory-1"})
+
+    assert missing_key.status_code == 428
+    assert first.status_code == retried.status_code == 200
+    assert retried.headers.get(REPLAYED_HEADER) == "true"
+    assert retried.json() == first.json()
+    assert await created_by(service_users["broker"].id) == 3
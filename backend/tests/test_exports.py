@@ -0,0 +1,107 @@
+"""Background export jobs: chunks stored in the database and abandoned jobs"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+import asyncio
+import csv
+import gzip
+import io
+import uuid
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from escrow_service import exports
+from escrow_service.main import app
+from escrow_service.models import (
+    Currency, DeliveryMethod, EscrowExportChunk, EscrowExportJob, EscrowStatus, EscrowTransaction, ItemCategory,
+    ItemCondition
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_job_file_is_stored_in_the_database_and_downloaded(service_database, service_users):
+    async with service_database.AsyncSessionLocal() as db:
+        db.add_all([
+            EscrowTransaction(
+                transaction_id=f"EXPORT-{service_users['buyer'].id}-{number}",
+                buyer_id=service_users["buyer"].id,
+                seller_id=service_users["seller"].id,
+                item_title="Test item",
+                item_description="Test item",
+                item_category=ItemCategory.ELECTRONICS,
+                item_condition=ItemCondition.GOOD,
+                item_estimated_value=Decimal("1000"),
+                price=Decimal("1000"),
+                currency=Currency.MXN,
+                escrow_fee=Decimal("25"),
+                total_amount=Decimal("1025"),
+                delivery_method=DeliveryMethod.PICKUP,
+                status=EscrowStatus.TRANSACTION_COMPLETED
+            )
+            for number in range(20)
+        ])
+        await db.commit()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        created = await client.post("/exports/transactions/jobs", json={"format": "csv"}, headers=service_users["admin"].headers)
+        await asyncio.gather(*exports._running_jobs)
+        job = await client.get(f"/exports/transactions/jobs/{created.json()['id']}", headers=service_users["admin"].headers)
+        download = await client.get(
+            f"/exports/transactions/jobs/{created.json()['id']}/download", headers=service_users["admin"].headers
+        )
+
+    assert job.json()["status"] == "completed"
+    assert len(download.content) == job.json()["file_size"]
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(download.content).decode())))
+    assert len(rows) == job.json()["row_count"] >= 20
+    assert sum(row["transaction_id"].startswith(f"EXPORT-{service_users['buyer'].id}-") for row in rows) == 20
+
+
+async def test_download_joins_the_chunks_in_order(service_database, service_users):
+    content = gzip.compress(b"id,transaction_id\n" * 100)
+    chunks = [content[:20], content[20:40], content[40:]]
+    job_id = str(uuid.uuid4())
+    async with service_database.AsyncSessionLocal() as db:
+        db.add(EscrowExportJob(
+            id=job_id, requested_by_id=service_users["admin"].id, format="csv", status="completed",
+            row_count=99, file_size=len(content)
+        ))
+        await db.flush()
+        # Inserted out of order; sequence decides
+        for sequence in (2, 0, 1):
+            db.add(EscrowExportChunk(job_id=job_id, sequence=sequence, data=chunks[sequence]))
+        await db.commit()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        download = await client.get(f"/exports/transactions/jobs/{job_id}/download", headers=service_users["admin"].headers)
+
+    assert download.headers["content-type"] == "application/gzip"
+    assert download.content == content
+
+
+async def test_jobs_without_recent_heartbeats_are_failed_and_their_chunks_dropped(service_database, service_users):
+    now = datetime.utcnow()
+    abandoned, alive = str(uuid.uuid4()), str(uuid.uuid4())
+    async with service_database.AsyncSessionLocal() as db:
+        for job_id, heartbeat_at in ((abandoned, now - timedelta(hours=1)), (alive, now)):
+            db.add(EscrowExportJob(
+                id=job_id, requested_by_id=service_users["admin"].id, format="csv", status="running",
+                heartbeat_at=heartbeat_at
+            ))
+            db.add(EscrowExportChunk(job_id=job_id, sequence=0, data=b"partial"))
+        await db.commit()
+
+        await exports.fail_stale_export_jobs(db)
+
+        jobs = {job.id: job for job in (await db.execute(
+            select(EscrowExportJob).where(EscrowExportJob.id.in_([abandoned, alive]))
+        )).scalars()}
+        chunk_jobs = (await db.execute(
+            select(EscrowExportChunk.job_id).where(EscrowExportChunk.job_id.in_([abandoned, alive]))
+        )).scalars().all()
+
+    assert jobs[abandoned].status == "failed"
+    assert jobs[alive].status == "running"
+    assert chunk_jobs == [alive]
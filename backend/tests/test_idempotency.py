@@ -0,0 +1,70 @@
+"""Idempotency-Key middleware: key scoping and CORS on its own responses"""
+import importlib
+import os
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+from shared.auth import create_access_token
+from shared.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, IdempotencyMiddleware, InMemoryIdempotencyStore
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_app():
+    app = FastAPI()
+    app.state.calls = 0
+    app.add_middleware(IdempotencyMiddleware, routes=[("POST", r"^/things$")], store=InMemoryIdempotencyStore())
+    app.add_middleware(CORSMiddleware, allow_origins=["http://app.local"], allow_methods=["*"], allow_headers=["*"])
+
+    @app.post("/things", status_code=201)
+    async def create_thing():
+        app.state.calls += 1
+        return {"call": app.state.calls}
+
+    return app
+
+
+def token(user_id: int) -> str:
+    return create_access_token({"sub": str(user_id), "email": f"user{user_id}@test.local", "role": "client"})
+
+
+async def post(client, access_token, key="key-1"):
+    return await client.post("/things", json={}, headers={
+        "Authorization": f"Bearer {access_token}", IDEMPOTENCY_HEADER: key, "Origin": "http://app.local"
+    })
+
+
+async def test_retry_after_token_refresh_is_replayed():
+    app = make_app()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = await post(client, token(1))
+        time.sleep(1.1)  # a refreshed token differs from the first one (new exp)
+        refreshed = token(1)
+        retried = await post(client, refreshed)
+        other_user = await post(client, token(2))
+
+    assert (first.status_code, retried.status_code) == (201, 201)
+    assert retried.json() == first.json() == {"call": 1}
+    assert retried.headers.get(REPLAYED_HEADER) == "true"
+    assert other_user.json() == {"call": 2}
+    assert app.state.calls == 2
+
+
+@pytest.mark.parametrize("service, path", [
+    ("escrow_service.main", "/transactions"),
+    ("payment_service.main", "/capture-payment"),
+])
+async def test_rejections_carry_cors_headers(service, path):
+    app = importlib.import_module(service).app
+    origin = os.getenv("ALLOWED_ORIGINS", "http://localhost:4200").split(",")[0]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post(path, json={}, headers={
+            "Authorization": f"Bearer {token(1)}", IDEMPOTENCY_HEADER: "x" * 300, "Origin": origin
+        })
+
+    assert response.status_code == 400
+    assert response.headers["access-control-allow-origin"] == origin
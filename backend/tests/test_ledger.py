@@ -0,0 +1,115 @@
+"""Custody ledger: postings over a transaction's lifecycle and balances"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from escrow_service.ledger import (
+    BUYER_AUTHORIZATIONS, ESCROW_CUSTODY, FEE_REVENUE, SELLER_PAYABLE, get_balances, post_intent, post_releases,
+    verify_ledger
+)
+from escrow_service.models import EscrowStatus, EscrowTransaction, LedgerJournal
+from escrow_service.scheduler import SCHEDULED_TRANSITIONS, apply_due_batch
+
+pytestmark = pytest.mark.asyncio
+
+AUTO_RELEASE = next(transition for transition in SCHEDULED_TRANSITIONS if transition.operation == "auto_release")
+
+
+def intent(status, amount=102500, amount_received=None):
+    return {
+        "id": "pi_1", "status": status, "currency": "mxn", "amount": amount,
+        "amount_received": amount_received if amount_received is not None else (amount if status == "succeeded" else 0)
+    }
+
+
+async def balances(db):
+    return {row["account"]: row["balance"] for row in await get_balances(db, "MXN")}
+
+
+async def kinds(db):
+    return sorted((await db.execute(select(LedgerJournal.kind))).scalars().all())
+
+
+async def test_capture_before_approval_is_released_on_approval(session_factory, make_transaction):
+    transaction = await make_transaction(EscrowStatus.INSPECTION_PERIOD, "pi_1")
+    async with session_factory() as db:
+        await post_intent(db, intent("requires_capture"), transaction.id, transaction.status, transaction.escrow_fee)
+        assert await post_intent(db, intent("succeeded"), transaction.id, transaction.status, transaction.escrow_fee) == ["payment"]
+        assert (await balances(db))[ESCROW_CUSTODY] == Decimal("1025.00")
+
+        assert await post_releases(db, [(transaction.id, transaction.escrow_fee)]) == 2
+        # Approval replayed, or the capture seen again after approval: nothing new
+        assert await post_releases(db, [(transaction.id, transaction.escrow_fee)]) == 0
+        assert await post_intent(db, intent("succeeded"), transaction.id, EscrowStatus.BUYER_APPROVED, transaction.escrow_fee) == []
+        await db.commit()
+
+        totals = await balances(db)
+        assert totals[ESCROW_CUSTODY] == 0
+        assert (totals[FEE_REVENUE], totals[SELLER_PAYABLE]) == (Decimal("25.00"), Decimal("1000.00"))
+        assert (await verify_ledger(db))["balanced"] is True
+
+
+async def test_approval_before_capture_posts_nothing(session_factory, make_transaction):
+    transaction = await make_transaction(EscrowStatus.INSPECTION_PERIOD, "pi_1")
+    async with session_factory() as db:
+        await post_intent(db, intent("requires_capture"), transaction.id, transaction.status, transaction.escrow_fee)
+        assert await post_releases(db, [(transaction.id, transaction.escrow_fee)]) == 0
+        # Released when the capture of the approved transaction is posted
+        posted = await post_intent(db, intent("succeeded"), transaction.id, EscrowStatus.BUYER_APPROVED, transaction.escrow_fee)
+        assert posted == ["payment", "fee", "release"]
+
+
+async def test_auto_release_posts_fee_and_release(session_factory, make_transaction):
+    transaction = await make_transaction(EscrowStatus.INSPECTION_PERIOD, "pi_1")
+    async with session_factory() as db:
+        row = await db.get(EscrowTransaction, transaction.id)
+        row.inspection_end_date = datetime.utcnow() - timedelta(minutes=1)
+        await post_intent(db, intent("succeeded"), transaction.id, transaction.status, transaction.escrow_fee)
+        await db.commit()
+
+    async with session_factory() as db:
+        assert await apply_due_batch(db, AUTO_RELEASE, datetime.utcnow(), 10) == 1
+    async with session_factory() as db:
+        assert (await db.get(EscrowTransaction, transaction.id)).status == EscrowStatus.BUYER_APPROVED
+        assert await kinds(db) == ["fee", "hold", "payment", "release"]
+        assert (await balances(db))[ESCROW_CUSTODY] == 0
+
+
+async def test_partial_capture_voids_the_rest_of_the_hold(session_factory, make_transaction):
+    transaction = await make_transaction(EscrowStatus.BUYER_APPROVED, "pi_1")
+    async with session_factory() as db:
+        await post_intent(db, intent("requires_capture"), transaction.id, transaction.status, transaction.escrow_fee)
+        posted = await post_intent(
+            db, intent("succeeded", amount_received=60000), transaction.id, transaction.status, transaction.escrow_fee
+        )
+        assert posted == ["payment", "void", "fee", "release"]
+        await db.commit()
+
+        totals = await balances(db)
+        assert (totals[BUYER_AUTHORIZATIONS], totals[ESCROW_CUSTODY]) == (0, 0)
+        assert (totals[FEE_REVENUE], totals[SELLER_PAYABLE]) == (Decimal("25.00"), Decimal("575.00"))
+        assert (await verify_ledger(db))["balanced"] is True
+
+
+async def test_canceled_authorization_voids_the_hold(session_factory, make_transaction):
+    transaction = await make_transaction(EscrowStatus.ITEM_SHIPPED, "pi_1")
+    async with session_factory() as db:
+        await post_intent(db, intent("requires_capture"), transaction.id, transaction.status, transaction.escrow_fee)
+        assert (await balances(db))[ESCROW_CUSTODY] == Decimal("1025.00")
+
+        assert await post_intent(db, intent("canceled"), transaction.id, transaction.status, transaction.escrow_fee) == ["void"]
+        # Redelivered cancellation: nothing new
+        assert await post_intent(db, intent("canceled"), transaction.id, transaction.status, transaction.escrow_fee) == []
+        await db.commit()
+
+        totals = await balances(db)
+        assert (totals[BUYER_AUTHORIZATIONS], totals[ESCROW_CUSTODY]) == (0, 0)
+        assert (await verify_ledger(db))["balanced"] is True
+
+
+async def test_intent_canceled_before_authorization_posts_nothing(session_factory, make_transaction):
+    transaction = await make_transaction(EscrowStatus.PENDING_PAYMENT)
+    async with session_factory() as db:
+        assert await post_intent(db, intent("canceled"), transaction.id, transaction.status, transaction.escrow_fee) == []
@@ -0,0 +1,150 @@
+"""ESCROW outbox: claiming, per-transaction ordering, retries and timestamps"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from escrow_service.models import EscrowOutboxEvent, EscrowStatus
+from escrow_service.outbox import OutboxSink, STATUS_CHANGED, claim_batch, dispatch_batch, naive_utc, retry_delay
+from shared.config import settings
+
+
+class RecordingSink(OutboxSink):
+    name = "recording"
+
+    def __init__(self):
+        self.delivered = []
+
+    async def deliver(self, db, event):
+        self.delivered.append(event.id)
+
+
+class FailingSink(OutboxSink):
+    """Fails the given event ids until they are removed from failing"""
+
+    name = "failing"
+
+    def __init__(self, *failing):
+        self.failing = set(failing)
+
+    async def deliver(self, db, event):
+        if event.id in self.failing:
+            raise RuntimeError("sink down")
+
+
+@pytest.fixture
+def add_events(session_factory):
+    """Add due events in the given order; returns them by name"""
+
+    async def add(*specs):
+        async with session_factory() as db:
+            events = {}
+            for name, transaction in specs:
+                events[name] = EscrowOutboxEvent(
+                    transaction_id=transaction.id, event_type=STATUS_CHANGED, payload={"name": name},
+                    available_at=datetime.utcnow() - timedelta(seconds=1)
+                )
+                db.add(events[name])
+                await db.flush()
+            await db.commit()
+            return events
+
+    return add
+
+
+async def load(session_factory, event):
+    async with session_factory() as db:
+        return await db.get(EscrowOutboxEvent, event.id)
+
+
+async def make_due(session_factory, event):
+    async with session_factory() as db:
+        (await db.get(EscrowOutboxEvent, event.id)).available_at = datetime.utcnow() - timedelta(seconds=1)
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_claim_takes_each_transactions_head_and_its_followers(session_factory, make_transaction, add_events):
+    first, second = await make_transaction(EscrowStatus.PAYMENT_RECEIVED), await make_transaction(EscrowStatus.PAYMENT_RECEIVED)
+    events = await add_events(("a1", first), ("b1", second), ("a2", first), ("a3", first))
+
+    async with session_factory() as db:
+        assert [event.id for event in await claim_batch(db, datetime.utcnow(), 10)] == [
+            events[name].id for name in ("a1", "b1", "a2", "a3")
+        ]
+    async with session_factory() as db:
+        assert [event.id for event in await claim_batch(db, datetime.utcnow(), 1)] == [events["a1"].id]
+
+    # A head waiting for its retry holds back the transaction's later events
+    async with session_factory() as db:
+        (await db.get(EscrowOutboxEvent, events["a1"].id)).available_at = datetime.utcnow() + timedelta(minutes=5)
+        await db.commit()
+    async with session_factory() as db:
+        assert [event.id for event in await claim_batch(db, datetime.utcnow(), 10)] == [events["b1"].id]
+
+
+@pytest.mark.asyncio
+async def test_failed_delivery_blocks_the_transaction_and_retries_only_the_failed_sink(
+    session_factory, make_transaction, add_events
+):
+    first, second = await make_transaction(EscrowStatus.PAYMENT_RECEIVED), await make_transaction(EscrowStatus.PAYMENT_RECEIVED)
+    events = await add_events(("a1", first), ("a2", first), ("b1", second))
+    recording, failing = RecordingSink(), FailingSink(events["a1"].id)
+
+    async with session_factory() as db:
+        assert await dispatch_batch(db, [recording, failing], 10) == 3
+
+    a1, a2, b1 = [await load(session_factory, events[name]) for name in ("a1", "a2", "b1")]
+    assert recording.delivered == [events["a1"].id, events["b1"].id]
+    assert (a1.status, a1.attempts, a1.delivered_sinks) == ("pending", 1, ["recording"])
+    assert a1.last_error == "failing: sink down"
+    expected_retry = datetime.utcnow() + timedelta(seconds=retry_delay(1))
+    assert abs(a1.available_at.replace(tzinfo=None) - expected_retry) < timedelta(seconds=5)
+    assert (a2.status, a2.attempts) == ("pending", 0)
+    assert b1.status == "dispatched"
+
+    # Not due yet: nothing is claimed
+    async with session_factory() as db:
+        assert await dispatch_batch(db, [recording, failing], 10) == 0
+
+    failing.failing.clear()
+    await make_due(session_factory, events["a1"])
+    async with session_factory() as db:
+        assert await dispatch_batch(db, [recording, failing], 10) == 2
+
+    a1, a2 = [await load(session_factory, events[name]) for name in ("a1", "a2")]
+    # The recording sink already had a1: only a2 is new to it
+    assert recording.delivered == [events["a1"].id, events["b1"].id, events["a2"].id]
+    assert (a1.status, a1.attempts, a1.delivered_sinks) == ("dispatched", 2, ["recording", "failing"])
+    assert (a2.status, a2.attempts) == ("dispatched", 1)
+
+
+@pytest.mark.asyncio
+async def test_event_fails_after_max_attempts_and_releases_the_transaction(
+    session_factory, make_transaction, add_events, monkeypatch
+):
+    monkeypatch.setattr(settings, "escrow_outbox_max_attempts", 2)
+    transaction = await make_transaction(EscrowStatus.PAYMENT_RECEIVED)
+    events = await add_events(("a1", transaction), ("a2", transaction))
+    recording, failing = RecordingSink(), FailingSink(events["a1"].id)
+
+    async with session_factory() as db:
+        await dispatch_batch(db, [recording, failing], 10)
+    await make_due(session_factory, events["a1"])
+    async with session_factory() as db:
+        await dispatch_batch(db, [recording, failing], 10)
+
+    a1 = await load(session_factory, events["a1"])
+    assert (a1.status, a1.attempts) == ("failed", 2)
+    async with session_factory() as db:
+        assert await dispatch_batch(db, [recording, failing], 10) == 1
+    assert (await load(session_factory, events["a2"])).status == "dispatched"
+
+
+def test_naive_utc_converts_aware_timestamps_before_dropping_the_offset():
+    moment = datetime(2026, 3, 1, 12, 0, tzinfo=timezone(timedelta(hours=-6)))
+
+    assert naive_utc(moment) == datetime(2026, 3, 1, 18, 0)
+
+
+def test_naive_utc_keeps_naive_timestamps():
+    assert naive_utc(datetime(2026, 3, 1, 12, 0)) == datetime(2026, 3, 1, 12, 0)
@@ -0,0 +1,196 @@
+"""Processor webhook inbox: ingestion, event handlers and the one-at-a-time retry fallback"""
+from datetime import datetime
+import itertools
+
+import pytest
+from sqlalchemy import func, select
+
+from escrow_service.models import EscrowOutboxEvent, EscrowStatus, EscrowTransaction, LedgerJournal
+from escrow_service.outbox import PAYMENT_ALERT
+from payment_service import webhooks
+from payment_service.models import PaymentWebhookEvent
+from payment_service.webhooks import (
+    DISPUTE_CREATED, PAYMENT_AUTHORIZED, PAYMENT_CANCELED, PAYMENT_FAILED, process_batch, store_event
+)
+
+pytestmark = pytest.mark.asyncio
+
+_numbers = itertools.count(1)
+
+
+def intent_event(event_type, intent_id, transaction, payer, amount=102500, currency="mxn", status="requires_capture"):
+    return {
+        "id": f"evt_{next(_numbers)}",
+        "type": event_type,
+        "created": int(datetime.utcnow().timestamp()),
+        "data": {"object": {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": amount,
+            "currency": currency,
+            "status": status,
+            "metadata": {"user_id": str(payer.id), "transaction_id": transaction.transaction_id}
+        }}
+    }
+
+
+def dispute_event(intent_id):
+    return {
+        "id": f"evt_{next(_numbers)}",
+        "type": DISPUTE_CREATED,
+        "created": int(datetime.utcnow().timestamp()),
+        "data": {"object": {
+            "id": f"dp_{next(_numbers)}", "payment_intent": intent_id, "amount": 102500,
+            "currency": "mxn", "reason": "fraudulent"
+        }}
+    }
+
+
+async def deliver(session_factory, *events):
+    """Store events as POST /webhook does and apply them like the worker"""
+    async with session_factory() as db:
+        for event in events:
+            await store_event(db, event)
+    await process_batch(session_factory, 100)
+
+
+async def load(session_factory, transaction):
+    async with session_factory() as db:
+        stored = (await db.execute(
+            select(PaymentWebhookEvent).order_by(PaymentWebhookEvent.id)
+        )).scalars().all()
+        current = await db.get(EscrowTransaction, transaction.id)
+        alerts = (await db.execute(
+            select(EscrowOutboxEvent).where(EscrowOutboxEvent.event_type == PAYMENT_ALERT)
+        )).scalars().all()
+        return stored, current, alerts
+
+
+async def test_store_event_drops_redeliveries(session_factory, users, make_transaction):
+    transaction = await make_transaction()
+    event = intent_event(PAYMENT_AUTHORIZED, "pi_1", transaction, users["buyer"])
+    async with session_factory() as db:
+        assert await store_event(db, event) is True
+        assert await store_event(db, event) is False
+        assert (await db.execute(select(func.count()).select_from(PaymentWebhookEvent))).scalar() == 1
+
+
+async def test_authorized_intent_receives_payment(session_factory, users, make_transaction):
+    transaction = await make_transaction()
+    await deliver(session_factory, intent_event(PAYMENT_AUTHORIZED, "pi_1", transaction, users["buyer"]))
+
+    (event,), current, alerts = await load(session_factory, transaction)
+    assert (event.status, event.result) == ("processed", "payment_received")
+    assert current.status == EscrowStatus.PAYMENT_RECEIVED
+    assert (current.payment_status, current.payment_transaction_id) == ("authorized", "pi_1")
+    assert alerts == []
+
+
+@pytest.mark.parametrize("payer, amount, currency", [
+    ("other", 102500, "mxn"),
+    ("buyer", 100, "mxn"),
+    ("buyer", 102500, "usd"),
+])
+async def test_mismatched_intent_is_ignored_and_alerted(session_factory, users, make_transaction, payer, amount, currency):
+    transaction = await make_transaction()
+    await deliver(session_factory, intent_event(
+        PAYMENT_AUTHORIZED, "pi_other", transaction, users[payer], amount=amount, currency=currency
+    ))
+
+    (event,), current, (alert,) = await load(session_factory, transaction)
+    assert (event.status, event.result) == ("ignored", "payment_mismatch")
+    assert current.status == EscrowStatus.PENDING_PAYMENT
+    assert current.payment_transaction_id is None
+    assert alert.payload["alert"] == "payment_mismatch"
+    assert alert.payload["payment_intent_id"] == "pi_other"
+
+
+async def test_later_intent_does_not_replace_the_payment(session_factory, users, make_transaction):
+    transaction = await make_transaction()
+    await deliver(
+        session_factory,
+        intent_event(PAYMENT_AUTHORIZED, "pi_1", transaction, users["buyer"]),
+        intent_event(PAYMENT_AUTHORIZED, "pi_2", transaction, users["buyer"]),
+        intent_event(PAYMENT_FAILED, "pi_3", transaction, users["buyer"], status="requires_payment_method"),
+    )
+
+    events, current, alerts = await load(session_factory, transaction)
+    assert [event.result for event in events] == ["payment_received", "payment_mismatch", "payment_mismatch"]
+    assert (current.payment_status, current.payment_transaction_id) == ("authorized", "pi_1")
+    assert [alert.payload["mismatches"] for alert in alerts] == [["payment_intent"], ["payment_intent"]]
+
+
+async def test_canceled_authorization_is_voided_and_alerted(session_factory, users, make_transaction):
+    transaction = await make_transaction(EscrowStatus.ITEM_SHIPPED, "pi_1")
+    await deliver(
+        session_factory,
+        intent_event(PAYMENT_AUTHORIZED, "pi_1", transaction, users["buyer"]),
+        intent_event(PAYMENT_CANCELED, "pi_1", transaction, users["buyer"], status="canceled"),
+        intent_event(PAYMENT_CANCELED, "pi_2", transaction, users["buyer"], status="canceled"),
+    )
+
+    events, current, (alert,) = await load(session_factory, transaction)
+    assert [event.result for event in events] == ["payment_recorded", "payment_canceled", "other_intent_canceled"]
+    assert events[2].status == "ignored"
+    assert (current.status, current.payment_status) == (EscrowStatus.ITEM_SHIPPED, "canceled")
+    assert alert.payload["alert"] == "authorization_canceled"
+    async with session_factory() as db:
+        assert sorted((await db.execute(select(LedgerJournal.kind))).scalars().all()) == ["hold", "void"]
+
+
+async def test_chargeback_opens_a_dispute_during_inspection(session_factory, users, make_transaction):
+    transaction = await make_transaction(EscrowStatus.INSPECTION_PERIOD, "pi_1")
+    await deliver(session_factory, dispute_event("pi_1"))
+
+    (event,), current, alerts = await load(session_factory, transaction)
+    assert (event.status, event.result) == ("processed", "disputed")
+    assert current.status == EscrowStatus.DISPUTED
+    assert current.dispute_info["is_disputed"] is True
+    assert alerts == []
+
+
+@pytest.mark.parametrize("escrow_status", [
+    EscrowStatus.CANCELLED, EscrowStatus.EXPIRED, EscrowStatus.FUNDS_RELEASED, EscrowStatus.PENDING_AGREEMENT
+])
+async def test_chargeback_outside_the_lifecycle_is_recorded_without_a_transition(session_factory, users, make_transaction, escrow_status):
+    transaction = await make_transaction(escrow_status, "pi_1")
+    await deliver(session_factory, dispute_event("pi_1"))
+
+    (event,), current, (alert,) = await load(session_factory, transaction)
+    assert (event.status, event.result) == ("processed", "chargeback_recorded")
+    assert current.status == escrow_status
+    assert not current.dispute_info.get("is_disputed")
+    assert current.dispute_info["chargebacks"][0]["status"] == escrow_status.value
+    assert alert.payload["alert"] == "chargeback"
+
+
+async def test_failing_event_is_retried_alone(session_factory, users, make_transaction, monkeypatch):
+    first = await make_transaction()
+    second = await make_transaction()
+
+    async def broken_handler(db, transaction, intent):
+        raise RuntimeError("handler bug")
+
+    monkeypatch.setitem(webhooks.EVENT_HANDLERS, PAYMENT_FAILED, broken_handler)
+    monkeypatch.setattr(webhooks.settings, "payment_webhook_max_attempts", 2)
+    await deliver(
+        session_factory,
+        intent_event(PAYMENT_FAILED, "pi_1", first, users["buyer"], status="requires_payment_method"),
+        intent_event(PAYMENT_AUTHORIZED, "pi_2", second, users["buyer"]),
+    )
+
+    (broken, applied), _, _ = await load(session_factory, first)
+    assert (applied.status, applied.result) == ("processed", "payment_received")
+    assert (broken.status, broken.attempts) == ("pending", 1)
+    assert broken.last_error == "RuntimeError: handler bug"
+    assert broken.available_at.replace(tzinfo=None) > datetime.utcnow()
+
+    # Due again: the last allowed attempt marks it failed
+    async with session_factory() as db:
+        event = await db.get(PaymentWebhookEvent, broken.id)
+        event.available_at = datetime.utcnow()
+        await db.commit()
+    await process_batch(session_factory, 100)
+
+    (broken, _), _, _ = await load(session_factory, first)
+    assert (broken.status, broken.attempts) == ("failed", 2)
@@ -0,0 +1,131 @@
+"""Payout runs: retries of transient capture errors and unpayable intents"""
+from decimal import Decimal
+import itertools
+
+import pytest
+from sqlalchemy import select
+
+from escrow_service.ledger import post_intent
+from escrow_service.models import (
+    Currency, DeliveryMethod, EscrowStatus, EscrowTransaction, ItemCategory, ItemCondition, LedgerJournal
+)
+from payment_service.gateway import PaymentGatewayError, PaymentGatewayUnavailable
+from payment_service.models import PayoutRunItem
+from payment_service.payouts import run_payouts
+from shared.config import settings
+
+pytestmark = pytest.mark.asyncio
+
+_numbers = itertools.count(1)
+
+
+class ScriptedGateway:
+    """Answers captures of each intent from its script, one step per call (the last step repeats)"""
+
+    def __init__(self, scripts, intents=None):
+        self.scripts = scripts
+        self.intents = intents or {}
+        self.captures = {intent_id: 0 for intent_id in scripts}
+
+    async def capture_payment_intent(self, payment_intent_id, idempotency_key=None):
+        script = self.scripts[payment_intent_id]
+        step = script[min(self.captures[payment_intent_id], len(script) - 1)]
+        self.captures[payment_intent_id] += 1
+        if isinstance(step, Exception):
+            raise step
+        return {"id": payment_intent_id, "status": "succeeded", "currency": "mxn", "amount": 102500, "amount_received": 102500}
+
+    async def retrieve_payment_intent(self, payment_intent_id):
+        return self.intents[payment_intent_id]
+
+
+def unavailable():
+    return PaymentGatewayUnavailable("Payment processor unavailable: HTTP 503", status_code=503)
+
+
+def unexpected_state():
+    return PaymentGatewayError("PaymentIntent status is canceled", code="payment_intent_unexpected_state")
+
+
+async def approved_transactions(service_database, service_users, count):
+    """Approved transactions whose held payments await capture; returns their intent ids"""
+    number = next(_numbers)
+    intent_ids = [f"pi_payout_{number}_{index}" for index in range(count)]
+    async with service_database.AsyncSessionLocal() as db:
+        transactions = [
+            EscrowTransaction(
+                transaction_id=f"PAYOUT-{number}-{index}",
+                buyer_id=service_users["buyer"].id,
+                seller_id=service_users["seller"].id,
+                item_title="Test item",
+                item_description="Test item",
+                item_category=ItemCategory.ELECTRONICS,
+                item_condition=ItemCondition.GOOD,
+                item_estimated_value=Decimal("1000"),
+                price=Decimal("1000"),
+                currency=Currency.MXN,
+                escrow_fee=Decimal("25"),
+                total_amount=Decimal("1025"),
+                delivery_method=DeliveryMethod.PICKUP,
+                status=EscrowStatus.BUYER_APPROVED,
+                payment_status="authorized",
+                payment_transaction_id=intent_id
+            )
+            for index, intent_id in enumerate(intent_ids)
+        ]
+        db.add_all(transactions)
+        await db.flush()
+        for transaction in transactions:
+            await post_intent(
+                db, {"id": transaction.payment_transaction_id, "status": "requires_capture", "currency": "mxn", "amount": 102500},
+                transaction.id, transaction.status, transaction.escrow_fee
+            )
+        await db.commit()
+    return intent_ids
+
+
+async def payment_statuses(service_database, intent_ids):
+    async with service_database.AsyncSessionLocal() as db:
+        return dict((await db.execute(
+            select(EscrowTransaction.payment_transaction_id, EscrowTransaction.payment_status)
+            .where(EscrowTransaction.payment_transaction_id.in_(intent_ids))
+        )).all())
+
+
+async def test_transient_errors_are_retried_and_unpayable_intents_leave_later_runs(
+    service_database, service_users, monkeypatch
+):
+    monkeypatch.setattr(settings, "payout_max_attempts", 3)
+    monkeypatch.setattr(settings, "payout_retry_base_seconds", 0)
+    recovers, canceled, missing, down = await approved_transactions(service_database, service_users, 4)
+    gateway = ScriptedGateway(
+        {
+            recovers: [unavailable(), PaymentGatewayError("Too many requests", status_code=429, code="rate_limit"), None],
+            canceled: [unexpected_state()],
+            missing: [PaymentGatewayError("No such payment_intent", status_code=404, code="resource_missing")],
+            down: [unavailable()],
+        },
+        intents={canceled: {"id": canceled, "status": "canceled", "currency": "mxn", "amount": 102500}}
+    )
+
+    report = await run_payouts(rate_per_second=0, gateway=gateway)
+
+    assert gateway.captures == {recovers: 3, canceled: 1, missing: 1, down: 3}
+    assert (report["captured"], report["failed"]) == (1, 3)
+    assert await payment_statuses(service_database, [recovers, canceled, missing, down]) == {
+        recovers: "completed", canceled: "canceled", missing: "capture_failed", down: "authorized"
+    }
+    async with service_database.AsyncSessionLocal() as db:
+        items = dict((await db.execute(
+            select(PayoutRunItem.payment_intent_id, PayoutRunItem.attempts)
+            .where(PayoutRunItem.run_id == report["run_id"])
+        )).all())
+        void = (await db.execute(
+            select(LedgerJournal.kind).where(LedgerJournal.reference == f"void:{canceled}")
+        )).scalar()
+    assert items == {recovers: 3, canceled: 1, missing: 1, down: 3}
+    assert void == "void"
+
+    # Only the payment that is still authorized is tried again
+    report = await run_payouts(rate_per_second=0, gateway=ScriptedGateway({down: [None]}))
+    assert (report["items"], report["captured"]) == (1, 1)
@@ -0,0 +1,132 @@
+"""ESCROW lifecycle transitions through the escrow service app"""
+from datetime import timedelta
+from decimal import Decimal
+import itertools
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from escrow_service.main import app
+from escrow_service.models import (
+    Currency, DeliveryMethod, EscrowDispute, EscrowMessage, EscrowOutboxEvent, EscrowStatus, EscrowTransaction,
+    ItemCategory, ItemCondition
+)
+from escrow_service.outbox import STATUS_CHANGED
+
+pytestmark = pytest.mark.asyncio
+
+_numbers = itertools.count(1)
+
+
+async def create_transaction(service_database, service_users, escrow_status, **fields) -> EscrowTransaction:
+    async with service_database.AsyncSessionLocal() as db:
+        transaction = EscrowTransaction(
+            transaction_id=f"TRANSITION-{next(_numbers)}-{service_users['buyer'].id}",
+            buyer_id=service_users["buyer"].id,
+            seller_id=service_users["seller"].id,
+            item_title="Test item",
+            item_description="Test item",
+            item_category=ItemCategory.ELECTRONICS,
+            item_condition=ItemCondition.GOOD,
+            item_estimated_value=Decimal("1000"),
+            price=Decimal("1000"),
+            currency=Currency.MXN,
+            escrow_fee=Decimal("25"),
+            total_amount=Decimal("1025"),
+            delivery_method=DeliveryMethod.PICKUP,
+            status=escrow_status,
+            **fields
+        )
+        db.add(transaction)
+        await db.commit()
+        return transaction
+
+
+def client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def test_deliver_sets_the_inspection_window_in_the_guarded_update(service_database, service_users):
+    transaction = await create_transaction(
+        service_database, service_users, EscrowStatus.ITEM_SHIPPED, inspection_period_days=5
+    )
+
+    async with client() as http:
+        seller = await http.put(f"/transactions/{transaction.id}/deliver", headers=service_users["seller"].headers)
+        delivered = await http.put(f"/transactions/{transaction.id}/deliver", headers=service_users["buyer"].headers)
+
+    assert seller.status_code == 403
+    assert delivered.status_code == 200
+    async with service_database.AsyncSessionLocal() as db:
+        current = await db.get(EscrowTransaction, transaction.id)
+        assert current.status == EscrowStatus.INSPECTION_PERIOD
+        window = current.inspection_end_date - current.inspection_start_date
+        assert abs(window - timedelta(days=5)) < timedelta(seconds=1)
+
+
+@pytest.mark.parametrize("party", ["buyer", "seller"])
+async def test_dispute_during_inspection(service_database, service_users, party):
+    transaction = await create_transaction(service_database, service_users, EscrowStatus.INSPECTION_PERIOD)
+
+    async with client() as http:
+        response = await http.post(
+            f"/transactions/{transaction.id}/dispute", json={"reason": "not_as_described", "description": "Broken"},
+            headers={**service_users[party].headers, "If-Match": str(transaction.version)}
+        )
+
+    assert response.status_code == 200
+    assert response.json()["version"] == transaction.version + 1
+    async with service_database.AsyncSessionLocal() as db:
+        current = await db.get(EscrowTransaction, transaction.id)
+        (dispute,) = (await db.execute(
+            select(EscrowDispute).where(EscrowDispute.transaction_id == transaction.id)
+        )).scalars().all()
+        (event,) = (await db.execute(
+            select(EscrowOutboxEvent).where(
+                EscrowOutboxEvent.transaction_id == transaction.id, EscrowOutboxEvent.event_type == STATUS_CHANGED
+            )
+        )).scalars().all()
+        messages = (await db.execute(
+            select(EscrowMessage.message).where(EscrowMessage.transaction_id == transaction.id)
+        )).scalars().all()
+    assert current.status == EscrowStatus.DISPUTED
+    assert current.dispute_info["dispute_id"] == dispute.id
+    assert dispute.initiated_by_id == service_users[party].id
+    assert (event.payload["operation"], event.payload["dispute_id"]) == ("dispute", dispute.id)
+    assert messages == ["Dispute created: not_as_described"]
+
+
+@pytest.mark.parametrize("escrow_status", [
+    EscrowStatus.PENDING_AGREEMENT, EscrowStatus.BUYER_APPROVED, EscrowStatus.FUNDS_RELEASED, EscrowStatus.DISPUTED
+])
+async def test_dispute_outside_inspection_is_refused(service_database, service_users, escrow_status):
+    transaction = await create_transaction(service_database, service_users, escrow_status)
+
+    async with client() as http:
+        response = await http.post(
+            f"/transactions/{transaction.id}/dispute", json={"reason": "late", "description": "Late"},
+            headers=service_users["buyer"].headers
+        )
+
+    assert response.status_code == 409
+    async with service_database.AsyncSessionLocal() as db:
+        assert (await db.get(EscrowTransaction, transaction.id)).status == escrow_status
+        assert (await db.execute(
+            select(EscrowDispute).where(EscrowDispute.transaction_id == transaction.id)
+        )).first() is None
+
+
+async def test_dispute_guard_errors(service_database, service_users):
+    transaction = await create_transaction(service_database, service_users, EscrowStatus.INSPECTION_PERIOD)
+    body = {"reason": "late", "description": "Late"}
+
+    async with client() as http:
+        outsider = await http.post(f"/transactions/{transaction.id}/dispute", json=body, headers=service_users["broker"].headers)
+        stale = await http.post(
+            f"/transactions/{transaction.id}/dispute", json=body,
+            headers={**service_users["buyer"].headers, "If-Match": str(transaction.version + 1)}
+        )
+        missing = await http.post("/transactions/999999/dispute", json=body, headers=service_users["buyer"].headers)
+
+    assert (outsider.status_code, stale.status_code, missing.status_code) == (403, 409, 404)